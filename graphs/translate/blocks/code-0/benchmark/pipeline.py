@@ -0,0 +1,146 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import tracemalloc
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import index
+
+from logic import Adapter, Translator
+from logic.adapter import FakeTranslator
+from synthetic import make_epub
+
+# chapters, paragraphs per chapter, images
+_Sizes: dict[str, tuple[int, int, int]] = {
+  "small": (8, 40, 4),
+  "medium": (30, 120, 20),
+  "large": (100, 250, 60),
+}
+
+# 与 index.main 翻译单本书的路径完全相同（index._translate_book），各阶段的耗时取自 Translator 的 Metrics
+def _run_book(file_path: str, translator: Translator, output_folder: str, args):
+  options = {
+    "streaming": args.streaming,
+    "pack_spines": args.pack_spines,
+    "compress_level": args.compress_level,
+  }
+  if args.streaming:
+    options["output_path"] = os.path.join(output_folder, os.path.basename(file_path))
+  index._translate_book(index._OptionsContext(options), file_path, translator)
+
+# 进程的最大常驻内存（包括 libxml2 的 DOM 与 zlib 的缓冲区），是整个进程至今的峰值而不是单本书的。
+# Linux 上 ru_maxrss 以 KB 计，macOS 上以字节计
+def _peak_rss_bytes() -> int:
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  if sys.platform == "darwin":
+    return peak
+  return peak * 1024
+
+def _bench(size: str, folder_path: str, args) -> dict:
+  chapters, paragraphs, images = _Sizes[size]
+  file_path = os.path.join(folder_path, f"{size}.epub")
+  make_epub(file_path, chapters, paragraphs, images=images, seed=args.seed)
+
+  fake = FakeTranslator(
+    latency=args.latency,
+    jitter=args.jitter,
+    error_rate=args.error_rate,
+    seed=args.seed,
+  )
+  translator = Translator(
+    project_id="",
+    source_language_code="en",
+    target_language_code="zh-CN",
+    max_paragraph_characters=args.max_paragraph_characters,
+    clean_format=False,
+    adapter=Adapter.Fake,
+    concurrency=args.concurrency,
+    client=fake,
+    max_retries=args.max_retries,
+    overlap_paragraphs=args.overlap_paragraphs,
+    overlap_mode=args.overlap_mode,
+    async_requests=args.async_requests,
+  )
+
+  # tracemalloc 只跟踪 Python 分配器（不含 libxml2 与 zlib），而且会明显拖慢运行，因此只在需要时开启
+  if args.python_heap:
+    tracemalloc.start()
+  output_folder = tempfile.mkdtemp(dir=folder_path)
+  begin = time.perf_counter()
+  try:
+    with contextlib.redirect_stdout(io.StringIO()):
+      _run_book(file_path, translator, output_folder, args)
+  finally:
+    elapsed = time.perf_counter() - begin
+    python_heap_peak = None
+    if args.python_heap:
+      _, python_heap_peak = tracemalloc.get_traced_memory()
+      tracemalloc.stop()
+    translator.close()
+    shutil.rmtree(output_folder)
+
+  summary = translator.metrics.summary()
+  return {
+    "size": size,
+    "file_bytes": os.path.getsize(file_path),
+    "seconds": elapsed,
+    "requests": fake.requests,
+    "characters": fake.characters,
+    "overlap_characters": translator.overlap_characters,
+    "chars_per_second": fake.characters / elapsed,
+    "requests_per_second": fake.requests / elapsed,
+    "peak_rss_bytes": _peak_rss_bytes(),
+    "python_heap_peak_bytes": python_heap_peak,
+    "stages": dict((name, stage["seconds"]) for name, stage in summary["stages"].items()),
+    "adapter_seconds": sum(adapter["seconds"] for adapter in summary["adapters"].values()),
+  }
+
+# run ``python graphs/translate/blocks/code-0/benchmark/pipeline.py --sizes small,medium``
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Offline benchmark of the EPub translation pipeline.")
+  parser.add_argument("--sizes", default="small,medium", help=f"comma separated, from {list(_Sizes.keys())}")
+  parser.add_argument("--latency", type=float, default=0.05, help="seconds per fake request")
+  parser.add_argument("--jitter", type=float, default=0.02, help="uniform +/- seconds added to latency")
+  parser.add_argument("--error-rate", type=float, default=0.0, help="probability that a fake request fails")
+  parser.add_argument("--max-retries", type=int, default=5)
+  parser.add_argument("--concurrency", type=int, default=1, help="threads, or in-flight requests with --async-requests")
+  parser.add_argument("--async-requests", action="store_true", help="drive requests from one event loop")
+  parser.add_argument("--max-paragraph-characters", type=int, default=800)
+  parser.add_argument("--overlap-paragraphs", type=int, default=2)
+  parser.add_argument("--overlap-mode", choices=("translate", "context"), default="translate")
+  parser.add_argument("--streaming", action="store_true", help="write the EPub to a file instead of base64")
+  parser.add_argument("--pack-spines", action="store_true", help="pack paragraphs across chapters")
+  parser.add_argument("--compress-level", type=int, default=6)
+  parser.add_argument("--python-heap", action="store_true", help="also trace the Python heap peak (slow)")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--json", action="store_true", help="print one JSON report per size")
+  args = parser.parse_args()
+
+  folder_path = tempfile.mkdtemp()
+  try:
+    for size in args.sizes.split(","):
+      report = _bench(size.strip(), folder_path, args)
+      if args.json:
+        print(json.dumps(report))
+        continue
+      stages = " ".join(f"{stage}={seconds:.3f}s" for stage, seconds in report["stages"].items())
+      memory = f"peak RSS {report['peak_rss_bytes'] / 1024 / 1024:.1f}MB"
+      if report["python_heap_peak_bytes"] is not None:
+        memory += f", Python heap {report['python_heap_peak_bytes'] / 1024 / 1024:.1f}MB"
+      print(
+        f"{report['size']:>6}: {report['seconds']:.2f}s, "
+        f"{report['requests']} requests ({report['requests_per_second']:.1f}/s), "
+        f"{report['characters']} chars ({report['chars_per_second']:.0f}/s, {report['overlap_characters']} overlap), "
+        f"{memory}"
+      )
+      print(f"        {stages} adapter={report['adapter_seconds']:.3f}s")
+  finally:
+    shutil.rmtree(folder_path)
@@ -0,0 +1,89 @@
+import io
+import os
+import re
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from logic.paragraph_sliter import split_paragraph, _BracketDict, _SplitSentenceSet, _StopSentenceSet, _MinSentenceLen
+
+# 逐字符调用正则的旧实现，作为对照
+def _split_paragraph_by_char(text: str) -> list:
+  words_in_sentence = 0
+  is_read_words = False
+  bracket_stack = []
+  sentences = []
+  buffer = io.StringIO()
+
+  for char in text:
+    buffer.write(char)
+
+    if char in _SplitSentenceSet:
+      words_in_sentence = 0
+    elif is_read_words and re.match(r"^[\s\n]$", char):
+      words_in_sentence += 1
+      is_read_words = False
+    elif not is_read_words and not re.match(r"^[\s\n]$", char):
+      is_read_words = True
+
+    if len(bracket_stack) > 0 and char == bracket_stack[-1]:
+      bracket_stack.pop()
+    elif char in _BracketDict:
+      bracket_stack.append(_BracketDict[char])
+    elif len(bracket_stack) == 0 and (
+      char in _StopSentenceSet
+    or (
+      words_in_sentence > 1 and char == "."
+    )):
+      words_in_sentence = 0
+      buffer.flush()
+      sentences.append(buffer.getvalue())
+      buffer.close()
+      buffer = io.StringIO()
+
+  last_sentence = buffer.getvalue()
+  buffer.close()
+
+  if len(last_sentence):
+    sentences.append(last_sentence)
+
+  target_sentences = []
+  last_append_index = -1
+
+  for sentence in sentences:
+    if last_append_index >= 0 and len(sentence) < _MinSentenceLen:
+      target_sentences[last_append_index] += sentence
+    else:
+      last_append_index = len(target_sentences)
+      target_sentences.append(sentence)
+
+  return target_sentences
+
+def _random_text(random: random.Random, length: int) -> str:
+  alphabet = list("abcdefghij   \n\t.,:;?!\"'()[]“”‘’「」【】（）。；？！中文段落") + ["<i>", "</i>", "B.C."]
+  return "".join(random.choice(alphabet) for _ in range(length))
+
+def _bench(split, text_list: list[str], rounds: int) -> float:
+  begin = time.perf_counter()
+  for _ in range(rounds):
+    for text in text_list:
+      split(text)
+  return time.perf_counter() - begin
+
+# run ``python graphs/translate/blocks/code-0/benchmark/split_paragraph.py``
+if __name__ == "__main__":
+  rand = random.Random(42)
+
+  for _ in range(2000):
+    text = _random_text(rand, rand.randint(0, 400))
+    assert split_paragraph(text) == _split_paragraph_by_char(text), repr(text)
+
+  sentence = "Most people, when they think of the Greek genius, naturally call to mind its masterpieces (in literature and art). "
+  chapter = [sentence * rand.randint(5, 40) for _ in range(200)]
+  chapter_chars = sum(len(text) for text in chapter)
+
+  for name, split in (("by char", _split_paragraph_by_char), ("compiled", split_paragraph)):
+    elapsed = _bench(split, chapter, rounds=3)
+    print(f"{name:>10}: {elapsed:.3f}s, {chapter_chars * 3 / elapsed / 1e6:.2f}M chars/s")
@@ -0,0 +1,92 @@
+import random
+import zipfile
+
+_Words = (
+  "the of and to in is was that for it as with his on be at by this had not are but from or have an they which "
+  "one you were her all she there would their we him been has when who will more no if out so said what up its "
+  "about into than them can only other new some could time these two may then do first any my now such like our "
+  "over man me even most made after also did many before must through back years where much your way well down "
+  "should because each just those people how too little state good very make world still own see men work long"
+).split(" ")
+
+# 生成结构完整、内容随机的 EPub，用于离线基准测试
+def make_epub(
+  path: str,
+  chapters: int,
+  paragraphs_per_chapter: int,
+  images: int = 0,
+  image_size: int = 64 * 1024,
+  seed: int = 0,
+):
+  rand = random.Random(seed)
+
+  with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+    zip_file.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip")
+    for folder in ("META-INF/", "OEBPS/", "OEBPS/text/", "OEBPS/images/"):
+      zip_file.writestr(zipfile.ZipInfo(folder), "")
+
+    zip_file.writestr("META-INF/container.xml", (
+      '<?xml version="1.0"?>'
+      '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+      '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>'
+      '</container>'
+    ))
+
+    items = []
+    itemrefs = []
+    nav_points = []
+
+    for i in range(chapters):
+      items.append(f'<item id="chapter{i}" href="text/chapter{i}.xhtml" media-type="application/xhtml+xml"/>')
+      itemrefs.append(f'<itemref idref="chapter{i}"/>')
+      nav_points.append(
+        f'<navPoint id="nav{i}" playOrder="{i + 1}"><navLabel><text>Chapter {i + 1}: {_sentence(rand, 3, 6)}</text></navLabel>'
+        f'<content src="text/chapter{i}.xhtml"/></navPoint>'
+      )
+      zip_file.writestr(f"OEBPS/text/chapter{i}.xhtml", _chapter(rand, i, paragraphs_per_chapter, images))
+
+    for i in range(images):
+      items.append(f'<item id="image{i}" href="images/image{i}.jpg" media-type="image/jpeg"/>')
+      zip_file.writestr(f"OEBPS/images/image{i}.jpg", rand.randbytes(image_size))
+
+    zip_file.writestr("OEBPS/content.opf", (
+      '<?xml version="1.0" encoding="utf-8"?>'
+      '<package xmlns="http://www.idpf.org/2007/opf" version="2.0" unique-identifier="bookid">'
+      '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:opf="http://www.idpf.org/2007/opf">'
+      f'<dc:title>{_sentence(rand, 3, 6)}</dc:title>'
+      '<dc:creator opf:role="aut">Synthetic Author</dc:creator>'
+      '</metadata>'
+      '<manifest><item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>'
+      f'{"".join(items)}</manifest>'
+      f'<spine toc="ncx">{"".join(itemrefs)}</spine>'
+      '</package>'
+    ))
+    zip_file.writestr("OEBPS/toc.ncx", (
+      '<?xml version="1.0" encoding="utf-8"?>'
+      '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">'
+      f'<navMap>{"".join(nav_points)}</navMap>'
+      '</ncx>'
+    ))
+
+def _chapter(rand: random.Random, index: int, paragraphs: int, images: int) -> str:
+  body = [f"<h1>Chapter {index + 1}</h1>"]
+
+  for _ in range(paragraphs):
+    sentences = [_sentence(rand, 6, 30) + rand.choice((".", ".", ".", "?", "!")) for _ in range(rand.randint(1, 8))]
+    body.append(f'<p class="text">{" ".join(sentences)}</p>')
+
+  if images > 0:
+    body.append(f'<img src="../images/image{rand.randrange(images)}.jpg" alt=""/>')
+
+  return (
+    '<?xml version="1.0" encoding="utf-8"?>\n'
+    '<html xmlns="http://www.w3.org/1999/xhtml"><head>'
+    f'<title>Chapter {index + 1}</title>'
+    '</head><body>'
+    f'{"".join(body)}'
+    '</body></html>'
+  )
+
+def _sentence(rand: random.Random, min_words: int, max_words: int) -> str:
+  words = [rand.choice(_Words) for _ in range(rand.randint(min_words, max_words))]
+  return " ".join(words).capitalize()
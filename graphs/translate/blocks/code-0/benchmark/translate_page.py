@@ -0,0 +1,84 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from logic import Adapter, Translator
+from logic.adapter import FakeTranslator
+from synthetic import _sentence
+
+# 单个章节的段落数，覆盖普通章节与合并成一个文件的整本书
+_Sizes: dict[str, int] = {
+  "small": 1000,
+  "medium": 4000,
+  "large": 16000,
+}
+
+# 约四分之一的段落带有行内标签或实体，其余为纯文本
+def _chapter(rand: random.Random, paragraphs: int) -> str:
+  body = []
+  for i in range(paragraphs):
+    text = " ".join(_sentence(rand, 6, 30) + "." for _ in range(rand.randint(1, 6)))
+    if i % 4 == 0:
+      text = f"<i>{_sentence(rand, 1, 3)}</i> &amp; {text}"
+    body.append(f'<p class="text" id="p{i}">{text}</p>')
+
+  return (
+    '<?xml version="1.0" encoding="utf-8"?>\n'
+    '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>Chapter</title></head>'
+    f'<body><div>{"".join(body)}</div></body></html>'
+  )
+
+def _bench(size: str, args) -> dict:
+  content = _chapter(random.Random(args.seed), _Sizes[size])
+  fake = FakeTranslator(seed=args.seed)
+  translator = Translator(
+    project_id="",
+    source_language_code="en",
+    target_language_code="zh-CN",
+    max_paragraph_characters=args.max_paragraph_characters,
+    clean_format=args.clean_format,
+    adapter=Adapter.Fake,
+    client=fake,
+  )
+  begin = time.perf_counter()
+  try:
+    with contextlib.redirect_stdout(io.StringIO()):
+      translator.translate_page("chapter.xhtml", content)
+  finally:
+    elapsed = time.perf_counter() - begin
+    translator.close()
+
+  stages = translator.metrics.summary()["stages"]
+  return {
+    "size": size,
+    "paragraphs": _Sizes[size],
+    "seconds": elapsed,
+    "requests": fake.requests,
+    "stages": dict((name, stage["seconds"]) for name, stage in stages.items()),
+  }
+
+# run ``python graphs/translate/blocks/code-0/benchmark/translate_page.py --sizes small,medium,large``
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark Translator.translate_page on large chapters without network.")
+  parser.add_argument("--sizes", default="small,medium,large", help=f"comma separated, from {list(_Sizes.keys())}")
+  parser.add_argument("--max-paragraph-characters", type=int, default=800)
+  parser.add_argument("--clean-format", action="store_true")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--json", action="store_true", help="print one JSON report per size")
+  args = parser.parse_args()
+
+  for size in args.sizes.split(","):
+    report = _bench(size.strip(), args)
+    if args.json:
+      print(json.dumps(report))
+      continue
+    stages = " ".join(f"{stage}={seconds:.3f}s" for stage, seconds in report["stages"].items())
+    print(f"{report['size']:>6}: {report['paragraphs']} paragraphs, {report['seconds']:.2f}s, {report['requests']} requests")
+    print(f"        {stages}")
@@ -1,34 +1,600 @@
 import io
 import os
+import json
 import time
 import zipfile
 import tempfile
 import base64
 import shutil
+import unittest
+import contextlib
 
+from typing import Callable, Optional
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree
-from logic import Adapter, Translator, EpubContent
+from logic import (
+  Adapter, Translator, EpubContent, ArchiveEpubContent, Spine,
+  TranslationCache, Checkpoint, Metrics, TranslationManifest, CostEstimate, ArchiveWriter,
+  WorkQueue, queue_job, queue_options, queue_worker_name,
+)
 
 def main(props, context):
-  if context.options["adapter"] == "google":
-    adapter=Adapter.Google
-  elif context.options["adapter"] == "open_ai":
-    adapter=Adapter.OpenAI
+  adapter = _parse_adapter(context.options["adapter"])
+
+  cache = None
+  if context.options.get("cache_path") is not None:
+    cache = TranslationCache(
+      path=context.options["cache_path"],
+      max_size=context.options.get("cache_max_size", 512) * 1024 * 1024,
+    )
+
+  metrics = Metrics(
+    sink=lambda event: context.result(event, "events", False),
+    profile_path=context.options.get("profile_path"),
+  )
+  targets = context.options["target"]
+  if isinstance(targets, str):
+    targets = [targets]
+
+  translators: dict[str, Translator] = {}
+  for target in targets:
+    translators[target] = _create_translator(context, adapter, target, len(targets), cache, metrics)
+  translator = translators[targets[0]]
+
+  try:
+    book_paths = _batch_book_paths(context.options)
+    queue_role = context.options.get("queue_role")
+    if len(targets) > 1 and book_paths is not None:
+      raise Exception("multiple targets are not supported in batch mode")
+    if queue_role is not None and (len(targets) > 1 or book_paths is not None):
+      raise Exception("work queue supports a single book and a single target")
+
+    if context.options.get("dry_run", False):
+      result_key, result_value = "estimate", _estimate_books(context, book_paths, translators)
+    elif queue_role == "worker":
+      result_key, result_value = "worker", _run_queue_worker(context, translator)
+    elif queue_role == "coordinator":
+      result_key, result_value = _translate_queued_book(context, context.options["file"], translator)
+    elif len(targets) > 1:
+      result_key, result_value = "paths", _translate_targets(context, context.options["file"], translators)
+    elif book_paths is None:
+      result_key, result_value = _translate_book(context, context.options["file"], translator)
+    else:
+      result_key, result_value = "books", _translate_books(context, book_paths, translator, targets[0])
+
+    print(f"Overlap context: {translator.overlap_characters}/{translator.group_characters} characters")
+    summary = _metrics_summary(translators)
+    if summary["filtered_characters"] > 0:
+      print(f"Skipped untranslatable: {summary['filtered_characters']} characters {summary['filtered_paragraphs']}")
+    print(f"Metrics: {json.dumps(summary)}")
+    context.result(summary, "metrics", False)
+    context.result(result_value, result_key, True)
+
+  finally:
+    metrics.dump_profiles()
+    for translator in translators.values():
+      translator.close()
+    if cache is not None:
+      print(f"Translation cache: {cache.stats()}")
+      cache.close()
+
+def _parse_adapter(name: str) -> Adapter:
+  if name == "google":
+    return Adapter.Google
+  elif name == "open_ai":
+    return Adapter.OpenAI
+  elif name == "pool":
+    return Adapter.Pool
   else:
-    raise Exception("invalid adapter")
+    raise Exception(f"invalid adapter: {name}")
 
-  translator = Translator(
-    project_id="balmy-mile-348403",
+# adapter 为 pool 时由 backends 给出各个后端（Google 项目、OpenAI 密钥或端点）及各自的配额。
+# 多个目标语言时配额同样按语言平分
+def _pool_backends(context, target_count: int) -> Optional[list[dict]]:
+  if context.options["adapter"] != "pool":
+    return None
+  backends = []
+  for i, option in enumerate(context.options.get("backends") or []):
+    backend = dict(option)
+    backend["adapter"] = _parse_adapter(option["adapter"])
+    if backend["adapter"] == Adapter.Pool:
+      raise Exception("pool backends can not be pools")
+    backend.setdefault("name", f"{option['adapter']}-{i}")
+    for key in ("requests_per_minute", "characters_per_minute"):
+      if backend.get(key) is not None:
+        backend[key] = max(1, backend[key] // target_count)
+    backends.append(backend)
+  return backends
+
+# 多个目标语言时，每种语言一个 Translator（接口客户端与缓存范围都与目标语言绑定），共用缓存与统计。
+# 限流额度按语言平分，使合计的请求速度仍然符合配额
+def _create_translator(context, adapter: Adapter, target: str, target_count: int, cache, metrics: Metrics) -> Translator:
+  requests_per_minute, characters_per_minute = _rate_limits(context, target_count)
+
+  # 断点按分组序号记录译文，分组大小在运行中变化会使续传错位，因此两者不能同时使用
+  adaptive_group_size = context.options.get("adaptive_group_size", False)
+  if adaptive_group_size and context.options.get("checkpoint_path") is not None:
+    print("Adaptive group size is disabled because checkpoint_path is set")
+    adaptive_group_size = False
+
+  return Translator(
+    project_id=context.options.get("project_id", "balmy-mile-348403"),
     source_language_code=context.options["source"],
-    target_language_code=context.options["target"],
+    target_language_code=target,
     max_paragraph_characters=context.options.get("max_paragraph_characters", 800),
     clean_format=context.options["clean_format"],
     adapter=adapter,
+    concurrency=context.options.get("concurrency", 1),
+    cache=cache,
+    requests_per_minute=requests_per_minute,
+    characters_per_minute=characters_per_minute,
+    max_retries=context.options.get("max_retries", 5),
+    request_timeout=context.options.get("request_timeout"),
+    overlap_paragraphs=context.options.get("overlap_paragraphs", 2),
+    overlap_mode=context.options.get("overlap_mode", "translate"),
+    metrics=metrics,
+    async_requests=context.options.get("async_requests", False),
+    skip_untranslatable=context.options.get("skip_untranslatable", False),
+    dry_run=context.options.get("dry_run", False),
+    group_budget=context.options.get("group_budget"),
+    adaptive_group_size=adaptive_group_size,
+    hedge_requests=context.options.get("hedge_requests", False),
+    hedge_budget=context.options.get("hedge_budget", 0.05),
+    backends=_pool_backends(context, target_count),
+  )
+
+def _rate_limits(context, target_count: int) -> tuple[Optional[int], Optional[int]]:
+  requests_per_minute = context.options.get("requests_per_minute")
+  characters_per_minute = context.options.get("characters_per_minute")
+  if requests_per_minute is not None:
+    requests_per_minute = max(1, requests_per_minute // target_count)
+  if characters_per_minute is not None:
+    characters_per_minute = max(1, characters_per_minute // target_count)
+  return requests_per_minute, characters_per_minute
+
+# 试运行：每本书、每种目标语言各估算一次（跳过无需翻译的段落时，各语言的结果可能不同）。
+# 单本书单种语言时直接返回估算结果，否则以目标语言或书籍为键。
+# incremental 时读取实际运行会使用的清单（不写回），可以复用的段落不计入请求
+def _estimate_books(context, book_paths: Optional[list[str]], translators: dict[str, Translator]) -> dict:
+  output_folder = context.options.get("output_folder")
+  folder_context = _OptionsContext(dict(
+    (key, value) for key, value in context.options.items() if key != "manifest_path"
+  ))
+
+  if book_paths is None:
+    file_path = context.options["file"]
+    if len(translators) == 1:
+      translator = next(iter(translators.values()))
+      output_path = context.options.get("output_path") if context.options.get("streaming", False) else None
+      manifest = _open_manifest(context, translator, output_path)
+      return _estimate_book(context, file_path, translator, 1, manifest)
+
+    stem, _ = os.path.splitext(os.path.basename(file_path))
+    estimates = {}
+    for target, translator in translators.items():
+      manifest = None
+      if output_folder is not None:
+        manifest = _open_manifest(folder_context, translator, os.path.join(output_folder, f"{stem}.{target}.epub"))
+      estimates[target] = _estimate_book(context, file_path, translator, len(translators), manifest)
+    return estimates
+
+  target, translator = next(iter(translators.items()))
+  output_paths = None
+  if output_folder is not None:
+    output_paths = _batch_output_paths(book_paths, output_folder, target)
+  estimates = {}
+  for index, book_path in enumerate(book_paths):
+    manifest = None
+    if output_paths is not None:
+      manifest = _open_manifest(folder_context, translator, output_paths[index])
+    estimates[book_path] = _estimate_book(context, book_path, translator, 1, manifest)
+  return estimates
+
+def _estimate_book(context, file_path: str, translator, target_count: int, manifest: Optional[TranslationManifest] = None) -> dict:
+  requests_per_minute, characters_per_minute = _rate_limits(context, target_count)
+  estimate = CostEstimate(
+    concurrency=context.options.get("concurrency", 1),
+    requests_per_minute=requests_per_minute,
+    characters_per_minute=characters_per_minute,
+    latency=context.options.get("estimated_latency", 2.0),
+    price_per_million_characters=context.options.get("price_per_million_characters"),
+  )
+
+  with zipfile.ZipFile(file_path, "r") as source_zip:
+    epub_content = ArchiveEpubContent(source_zip)
+    ncx_tree = None
+    if epub_content.ncx_path is not None:
+      ncx_tree = etree.fromstring(source_zip.read(epub_content.ncx_path)).getroottree()
+
+    _, _, _, text_list = _metadata_texts(context, epub_content, ncx_tree)
+    estimate.add(translator.estimate_texts("metadata", text_list))
+
+    pages = [
+      (spine.path, source_zip.read(spine.path).decode("utf-8"))
+      for spine in epub_content.spines
+      if spine.media_type == "application/xhtml+xml"
+    ]
+    if context.options.get("pack_spines", False):
+      estimate.add(translator.estimate_pages(pages, manifest))
+    else:
+      for page_path, page_content in pages:
+        estimate.add(translator.estimate_page(page_path, page_content, manifest))
+
+  summary = estimate.summary()
+  if manifest is not None:
+    summary["reused_paragraphs"] = manifest.reused_paragraphs
+    summary["reused_characters"] = manifest.reused_characters
+  print(
+    f"Dry run: {file_path} {summary['requests']} requests, {summary['characters']} characters "
+    f"(overlap {summary['overlap_characters']}, context {summary['context_characters']}), "
+    f"about {summary['seconds']:.0f}s"
+  )
+  return summary
+
+# 翻译一本书。返回 flow 的输出：流式模式为 ("path", 输出文件)，否则为 ("bin", base64 编码的 EPub)
+def _translate_book(context, file_path: str, translator, output_path: Optional[str] = None) -> tuple[str, str]:
+  unzip_path = None
+  checkpoint = None
+  created_output_path = None
+
+  if context.options.get("checkpoint_path") is not None:
+    checkpoint = Checkpoint(
+      folder_path=context.options["checkpoint_path"],
+      file_path=file_path,
+      options=_checkpoint_options(context.options),
+    )
+    if checkpoint.is_resumed:
+      print(f"Resume translation from checkpoint: {checkpoint.path}")
+
+  try:
+    if output_path is not None or context.options.get("streaming", False):
+      if output_path is None:
+        output_path = context.options.get("output_path")
+      if output_path is None:
+        output_fd, output_path = tempfile.mkstemp(suffix=".epub")
+        os.close(output_fd)
+        created_output_path = output_path
+      # 临时输出文件每次都不同，旁边的清单下次找不到，与 base64 输出一样需要 manifest_path
+      manifest = _open_manifest(context, translator, output_path if created_output_path is None else None)
+      _translate_archive(context, file_path, output_path, translator, checkpoint, manifest)
+      created_output_path = None
+      result = ("path", output_path)
+    else:
+      unzip_path = tempfile.mkdtemp()
+      manifest = _open_manifest(context, translator, None, unzip_path)
+      result = ("bin", _translate_zip_file(context, file_path, unzip_path, translator, checkpoint, manifest))
+
+    _save_manifest(manifest)
+    if checkpoint is not None:
+      checkpoint.clear()
+      checkpoint = None
+    return result
+
+  finally:
+    if checkpoint is not None:
+      checkpoint.close()
+    if unzip_path is not None:
+      shutil.rmtree(unzip_path)
+    # 失败时删除为输出预先创建的空文件；指定的 output_path 不会被写入（见 _write_archive）
+    if created_output_path is not None and os.path.exists(created_output_path):
+      os.remove(created_output_path)
+
+# incremental 选项：译文输出为文件时，清单保存在它旁边（<输出文件>.manifest.json）；
+# 输出为 base64 或流式输出到临时文件（未指定 output_path）时没有固定的位置，需要用 manifest_path 指定清单的位置
+def _open_manifest(context, translator, output_path: Optional[str], root: Optional[str] = None) -> Optional[TranslationManifest]:
+  if not context.options.get("incremental", False):
+    return None
+
+  manifest_path = context.options.get("manifest_path")
+  if manifest_path is None and output_path is not None:
+    manifest_path = f"{output_path}.manifest.json"
+  if manifest_path is None:
+    print("Incremental translation needs manifest_path when the output is not a file, skipped")
+    return None
+
+  manifest = TranslationManifest(manifest_path, translator.manifest_scope, root=root)
+  if manifest.previous_size > 0:
+    print(f"Reuse translations from manifest: {manifest_path} ({manifest.previous_size} paragraphs)")
+  return manifest
+
+def _save_manifest(manifest: Optional[TranslationManifest]):
+  if manifest is not None:
+    manifest.save()
+    print(f"Translation manifest: {manifest.path} {manifest.stats()}")
+
+def _metrics_summary(translators: dict[str, Translator]) -> dict:
+  translator_list = list(translators.values())
+  summary = translator_list[0].metrics.summary()
+  summary["overlap_characters"] = sum(t.overlap_characters for t in translator_list)
+  summary["group_characters"] = sum(t.group_characters for t in translator_list)
+  summary["filtered_characters"] = sum(t.filtered_characters for t in translator_list)
+  filtered_paragraphs: dict[str, int] = {}
+  for t in translator_list:
+    for reason, count in t.filtered_paragraphs.items():
+      filtered_paragraphs[reason] = filtered_paragraphs.get(reason, 0) + count
+  summary["filtered_paragraphs"] = filtered_paragraphs
+  if len(translator_list) == 1:
+    summary["adapter_stats"] = translator_list[0].adapter_stats()
+    summary["group_budget"] = translator_list[0].group_budget.stats()
+  else:
+    summary["adapter_stats"] = dict((target, t.adapter_stats()) for target, t in translators.items())
+    summary["group_budget"] = dict((target, t.group_budget.stats()) for target, t in translators.items())
+  return summary
+
+# 批量模式：files 给出 EPub 列表，或 folder 给出一个包含 EPub 的目录（不递归）
+def _batch_book_paths(options: dict) -> Optional[list[str]]:
+  if options.get("files") is not None:
+    return list(options["files"])
+  if options.get("folder") is not None:
+    folder_path = options["folder"]
+    return sorted(
+      os.path.join(folder_path, name)
+      for name in os.listdir(folder_path)
+      if name.lower().endswith(".epub")
+    )
+  return None
+
+# 批量翻译多本书。所有书共用同一个 Translator，因此共用翻译线程池（或事件循环）、接口客户端、缓存与限流额度。
+# book_concurrency 本书同时进行，各自以流式方式写入 output_folder；某本书失败不影响其他书
+def _translate_books(context, book_paths: list[str], translator, target: str) -> list[dict]:
+  output_folder = context.options.get("output_folder")
+  if output_folder is None:
+    output_folder = tempfile.mkdtemp()
+  os.makedirs(output_folder, exist_ok=True)
+
+  output_paths = _batch_output_paths(book_paths, output_folder, target)
+  metrics = translator.metrics
+  begin = time.perf_counter()
+
+  def translate_book(index: int) -> dict:
+    book_path = book_paths[index]
+    book_begin = time.perf_counter()
+    report = {
+      "file": book_path,
+      "output": output_paths[index],
+    }
+    with metrics.labels(book=book_path):
+      metrics.emit({ "type": "book", "status": "started", "index": index, "total": len(book_paths) })
+      try:
+        # title 与 manifest_path 选项只对单本书有意义，不能套用到每一本上
+        book_context = _OptionsContext(dict(
+          (key, value) for key, value in context.options.items() if key not in ("title", "manifest_path")
+        ))
+        _translate_book(book_context, book_path, translator, output_paths[index])
+        report["status"] = "completed"
+      except Exception as e:
+        print(f"Translate book failed: {book_path}: {e}")
+        report["status"] = "failed"
+        report["error"] = str(e)
+      report["seconds"] = time.perf_counter() - book_begin
+      metrics.emit({
+        "type": "book",
+        **dict((key, value) for key, value in report.items() if key != "file"),
+      })
+    return report
+
+  # 书籍线程只负责解析、分组与写出，请求都提交到 Translator 共用的线程池，不会产生嵌套等待
+  book_concurrency = max(1, context.options.get("book_concurrency", 2))
+  with ThreadPoolExecutor(max_workers=book_concurrency) as executor:
+    reports = list(executor.map(translate_book, range(len(book_paths))))
+
+  elapsed = time.perf_counter() - begin
+  characters = sum(
+    counter["characters"]
+    for counter in metrics.summary()["adapters"].values()
+  )
+  completed = sum(1 for report in reports if report["status"] == "completed")
+  print(
+    f"Batch completed: {completed}/{len(reports)} books in {elapsed:.1f}s, "
+    f"{characters} characters ({characters / max(elapsed, 1e-9):.0f}/s)"
   )
-  file_path = context.options["file"]
-  unzip_path = tempfile.mkdtemp()
+  metrics.emit({
+    "type": "batch",
+    "completed": completed,
+    "failed": len(reports) - completed,
+    "seconds": elapsed,
+    "characters": characters,
+    "characters_per_second": characters / max(elapsed, 1e-9),
+  })
+  return reports
+
+# 输出文件与多目标语言相同，命名为 <原文件名>.<目标语言>.epub，不同目录下的同名文件加上序号区分。
+# output_folder 与原文件所在目录相同时，输出文件也不会覆盖任何一本原书
+def _batch_output_paths(book_paths: list[str], output_folder: str, target: str) -> list[str]:
+  input_paths = set(os.path.realpath(book_path) for book_path in book_paths)
+  output_paths = []
+  used_names = set()
+  for book_path in book_paths:
+    stem, _ = os.path.splitext(os.path.basename(book_path))
+    name = f"{stem}.{target}.epub"
+    suffix = 1
+    while name in used_names or os.path.realpath(os.path.join(output_folder, name)) in input_paths:
+      suffix += 1
+      name = f"{stem}-{suffix}.{target}.epub"
+    used_names.add(name)
+    output_paths.append(os.path.join(output_folder, name))
+  return output_paths
+
+# 多目标语言：压缩包只读取一次，章节只解析、分组一次，各语言并行翻译并从同一份解析结果写出各自的 EPub。
+# 返回 { 目标语言: 输出文件 }
+def _translate_targets(context, file_path: str, translators: dict[str, Translator]) -> dict[str, str]:
+  output_folder = context.options.get("output_folder")
+  if output_folder is None:
+    output_folder = tempfile.mkdtemp()
+  os.makedirs(output_folder, exist_ok=True)
+
+  stem, _ = os.path.splitext(os.path.basename(file_path))
+  output_paths = dict(
+    (target, os.path.join(output_folder, f"{stem}.{target}.epub"))
+    for target in translators.keys()
+  )
+  parser = next(iter(translators.values()))
+
+  with zipfile.ZipFile(file_path, "r") as source_zip:
+    epub_content = ArchiveEpubContent(source_zip)
+    parsed_pages = {}
+    for spine in epub_content.spines:
+      if spine.media_type == "application/xhtml+xml":
+        parsed_pages[spine.path] = parser.parse_page(spine.path, source_zip.read(spine.path).decode("utf-8"))
+
+    def translate_target(target: str):
+      translator = translators[target]
+      target_context = _OptionsContext(dict(context.options, target=target))
+      target_context.options.pop("manifest_path", None)
+      manifest = _open_manifest(target_context, translator, output_paths[target])
+      checkpoint = None
+
+      if context.options.get("checkpoint_path") is not None:
+        checkpoint = Checkpoint(
+          folder_path=context.options["checkpoint_path"],
+          file_path=file_path,
+          options=_checkpoint_options(target_context.options),
+        )
+      try:
+        # ZipFile 的读取不能在线程之间交错，每种语言各自打开一次（只读取目录，不重复解析章节）
+        with translator.metrics.labels(target=target), zipfile.ZipFile(file_path, "r") as target_source_zip:
+          _write_archive(target_context, target_source_zip, output_paths[target], translator, checkpoint, manifest, parsed_pages)
+        _save_manifest(manifest)
+        if checkpoint is not None:
+          checkpoint.clear()
+          checkpoint = None
+      finally:
+        if checkpoint is not None:
+          checkpoint.close()
+
+    with ThreadPoolExecutor(max_workers=len(translators)) as executor:
+      for _ in executor.map(translate_target, translators.keys()):
+        pass
+
+  return output_paths
+
+# 工作队列：协调者（queue_role 为 coordinator）把章节写入 queue_path 下的队列，自己也参与翻译，
+# 全部完成后用队列中的译文组装 EPub；其余进程以 worker 运行，只领取并翻译章节。
+# 书名、作者与目录由协调者翻译
+def _translate_queued_book(context, file_path: str, translator) -> tuple[str, str]:
+  queue = _open_queue(context)
+  options = queue_options(_queue_options(context.options))
+  job = queue_job(file_path, options)
 
   try:
+    with zipfile.ZipFile(file_path, "r") as source_zip:
+      epub_content = ArchiveEpubContent(source_zip)
+      queue.enqueue(job, options, [
+        (spine.href, spine.path, source_zip.read(spine.path).decode("utf-8"))
+        for spine in epub_content.spines
+        if spine.media_type == "application/xhtml+xml"
+      ])
+      print(f"Queued {file_path} as job {job[:12]}: {queue.progress(job)}")
+
+      worker = queue_worker_name()
+      while True:
+        if _work_queue_unit(queue, translator, options, worker, job):
+          continue
+        progress = queue.progress(job)
+        if progress.get("failed", 0) > 0:
+          raise Exception(f"translate queued spines failed: {queue.errors(job)}")
+        if progress.get("pending", 0) == 0 and progress.get("claimed", 0) == 0:
+          break
+        time.sleep(context.options.get("queue_poll_interval", 1.0))
+
+      output_path = context.options.get("output_path")
+      if output_path is None:
+        output_fd, output_path = tempfile.mkstemp(suffix=".epub")
+        os.close(output_fd)
+      _write_archive(context, source_zip, output_path, translator, None, spine_contents=queue.results(job))
+
+    queue.remove(job)
+    if context.options.get("streaming", False) or context.options.get("output_path") is not None:
+      return "path", output_path
+
+    with open(output_path, "rb") as file:
+      data = base64.b64encode(file.read()).decode("utf-8")
+    os.remove(output_path)
+    return "bin", data
+
+  finally:
+    queue.close()
+
+# 工作进程：领取选项与自己一致的章节，直到队列中没有可领取的单元；
+# 设置 worker_idle_timeout 时，空闲这么多秒后才退出，以便等待新的书加入队列
+def _run_queue_worker(context, translator) -> dict:
+  queue = _open_queue(context)
+  options = queue_options(_queue_options(context.options))
+  worker = queue_worker_name()
+  idle_timeout = context.options.get("worker_idle_timeout", 0)
+  report = { "worker": worker, "completed": 0, "failed": 0 }
+  idle_since = time.monotonic()
+
+  try:
+    while True:
+      claimed = _work_queue_unit(queue, translator, options, worker, report=report)
+      if claimed:
+        idle_since = time.monotonic()
+      elif time.monotonic() - idle_since >= idle_timeout:
+        break
+      else:
+        time.sleep(context.options.get("queue_poll_interval", 1.0))
+  finally:
+    queue.close()
+
+  print(f"Queue worker {worker} finished: {report}")
+  return report
+
+# 领取并翻译一个单元，没有可领取的单元时返回 False。失败的单元交还队列，由其他进程或之后重试
+def _work_queue_unit(queue: WorkQueue, translator, options: str, worker: str, job: Optional[str] = None, report: Optional[dict] = None) -> bool:
+  unit = queue.claim(options, worker, job)
+  if unit is None:
+    return False
+
+  try:
+    with queue.heartbeat(unit), translator.metrics.labels(job=unit.job[:12], spine=unit.href):
+      content = translator.translate_page(unit.path, unit.source)
+  except Exception as e:
+    print(f"Translate queued spine failed: {unit.href}: {e}")
+    queue.fail(unit, str(e))
+    if report is not None:
+      report["failed"] += 1
+  else:
+    queue.complete(unit, content)
+    if report is not None:
+      report["completed"] += 1
+  return True
+
+def _open_queue(context) -> WorkQueue:
+  return WorkQueue(
+    path=os.path.join(context.options["queue_path"], "queue.db"),
+    lease_seconds=context.options.get("queue_lease", 600),
+  )
+
+# 影响章节译文的选项。书名与章节无关，工作队列也不合并章节
+def _queue_options(options: dict) -> dict:
+  return dict(
+    (key, value) for key, value in _checkpoint_options(options).items()
+    if key not in ("title", "pack_spines")
+  )
+
+# 只替换 options 的 context，用于批量模式中的单本书与多目标语言中的单种语言
+class _OptionsContext:
+  def __init__(self, options: dict):
+    self.options = options
+
+def _checkpoint_options(options: dict) -> dict:
+  # 只有影响译文的选项才参与断点的匹配
+  keys = (
+    "title", "source", "target", "max_paragraph_characters", "clean_format", "adapter",
+    "pack_spines", "overlap_paragraphs", "overlap_mode", "group_budget", "skip_untranslatable",
+  )
+  return dict((key, options.get(key)) for key in keys)
+
+def _translate_zip_file(
+  context,
+  file_path: str,
+  unzip_path: str,
+  translator,
+  checkpoint: Optional[Checkpoint],
+  manifest: Optional[TranslationManifest] = None,
+) -> str:
+  with translator.metrics.stage("unzip"):
     with zipfile.ZipFile(file_path, "r") as zip_ref:
       for member in zip_ref.namelist():
         target_path = os.path.join(unzip_path, member)
@@ -38,81 +604,405 @@ def main(props, context):
           with zip_ref.open(member) as source, open(target_path, "wb") as file:
               file.write(source.read())
 
-    _translate_folder(context, unzip_path, translator)
+  _translate_folder(context, unzip_path, translator, checkpoint, manifest)
+
+  with translator.metrics.stage("rezip"):
     in_memory_zip = io.BytesIO()
 
-    with zipfile.ZipFile(in_memory_zip, "w") as zip_file:
+    with _open_archive_writer(context, in_memory_zip) as writer:
       for root, _, files in os.walk(unzip_path):
         for file in files:
           file_path = os.path.join(root, file)
           relative_path = os.path.relpath(file_path, unzip_path)
-          zip_file.write(file_path, arcname=relative_path)
-          
+          with open(file_path, "rb") as source:
+            writer.copy(zipfile.ZipInfo.from_file(file_path, arcname=relative_path), source)
+
     in_memory_zip.seek(0)
     zip_data = in_memory_zip.read()
-    base64_str = base64.b64encode(zip_data).decode("utf-8")
-    context.result(base64_str, "bin", True)
+    return base64.b64encode(zip_data).decode("utf-8")
 
-  finally:
-    shutil.rmtree(unzip_path)
+# 不解压到临时目录，逐个读取压缩包成员并写入输出文件。
+# 只有 OPF、NCX 与 XHTML 章节会被重写，其余成员（图片、字体、样式表）按块流式拷贝
+def _translate_archive(
+  context,
+  file_path: str,
+  output_path: str,
+  translator,
+  checkpoint: Optional[Checkpoint],
+  manifest: Optional[TranslationManifest] = None,
+):
+  with zipfile.ZipFile(file_path, "r") as source_zip:
+    _write_archive(context, source_zip, output_path, translator, checkpoint, manifest)
+
+# parsed_pages 为 parse_page 预先解析好的章节（多目标语言时共用），此时不读取原文、也不合并章节；
+# spine_contents 为已经在别处（工作队列）翻译好的章节 { 路径: 译文 }。
+# 先写入 <输出文件>.tmp，全部成功后才替换输出文件，翻译中途失败时不会留下截断但看似完整的 EPub
+def _write_archive(
+  context,
+  source_zip: zipfile.ZipFile,
+  output_path: str,
+  translator,
+  checkpoint: Optional[Checkpoint],
+  manifest: Optional[TranslationManifest] = None,
+  parsed_pages: Optional[dict] = None,
+  spine_contents: Optional[dict[str, str]] = None,
+):
+  temp_path = f"{output_path}.tmp"
+  target_zip = _open_archive_writer(context, temp_path)
+  try:
+    _write_archive_entries(
+      context, source_zip, target_zip, translator, checkpoint,
+      manifest, parsed_pages, spine_contents,
+    )
+  except BaseException:
+    try:
+      target_zip.close()
+    finally:
+      os.remove(temp_path)
+    raise
+
+  with translator.metrics.stage("rezip"):
+    target_zip.close()
+  os.replace(temp_path, output_path)
+
+def _write_archive_entries(
+  context,
+  source_zip: zipfile.ZipFile,
+  target_zip: ArchiveWriter,
+  translator,
+  checkpoint: Optional[Checkpoint],
+  manifest: Optional[TranslationManifest],
+  parsed_pages: Optional[dict],
+  spine_contents: Optional[dict[str, str]],
+):
+  epub_content = ArchiveEpubContent(source_zip)
+  ncx_path = epub_content.ncx_path
+  ncx_tree = None
 
-def _translate_folder(context, path: str, translator):
+  if ncx_path is not None:
+    ncx_tree = etree.fromstring(source_zip.read(ncx_path)).getroottree()
+
+  _translate_metadata(context, epub_content, ncx_tree, translator, checkpoint)
+
+  spine_dict: dict[str, Spine] = {}
+  for spine in epub_content.spines:
+    if spine.media_type == "application/xhtml+xml":
+      spine_dict[spine.path] = spine
+
+  packed_contents: Optional[dict[str, str]] = spine_contents
+  if packed_contents is None and parsed_pages is None and context.options.get("pack_spines", False):
+    packed_contents = _translate_packed_spines(
+      spines=list(spine_dict.values()),
+      read_content=lambda spine: source_zip.read(spine.path).decode("utf-8"),
+      translator=translator,
+      checkpoint=checkpoint,
+      manifest=manifest,
+    )
+
+  for info in source_zip.infolist():
+    if info.filename == epub_content.content_path:
+      with translator.metrics.stage("rezip"):
+        target_zip.write(info, epub_content.to_bytes())
+
+    elif info.filename == ncx_path:
+      with translator.metrics.stage("rezip"):
+        target_zip.write(info, etree.tostring(ncx_tree, pretty_print=True))
+
+    elif info.filename in spine_dict:
+      spine = spine_dict[info.filename]
+      if packed_contents is not None:
+        content = packed_contents[spine.path]
+      else:
+        content = _translate_spine(
+          spine=spine,
+          read_content=lambda: source_zip.read(info).decode("utf-8"),
+          translator=translator,
+          checkpoint=checkpoint,
+          manifest=manifest,
+          parsed_page=parsed_pages.get(spine.path) if parsed_pages is not None else None,
+        )
+      with translator.metrics.stage("rezip"):
+        target_zip.write(info, content.encode("utf-8"))
+
+    elif info.is_dir():
+      target_zip.write(info, b"")
+
+    else:
+      with translator.metrics.stage("rezip"):
+        with source_zip.open(info, "r") as source:
+          target_zip.copy(info, source)
+
+# compress_level 为 0 时所有成员都不压缩
+def _open_archive_writer(context, file) -> ArchiveWriter:
+  return ArchiveWriter(
+    file,
+    compress_level=context.options.get("compress_level", 6),
+    concurrency=context.options.get("compress_concurrency"),
+  )
+
+def _translate_folder(
+  context,
+  path: str,
+  translator,
+  checkpoint: Optional[Checkpoint],
+  manifest: Optional[TranslationManifest] = None,
+):
   epub_content = EpubContent(path)
+  ncx_path = epub_content.ncx_path
+  ncx_tree = None
 
-  if "title" in context.options:
-    book_title = context.options["title"]
-  else:
-    book_title = epub_content.title
-    if not book_title is None:
-      book_title = _link_translated(book_title, translator.translate([book_title])[0])
+  if ncx_path is not None:
+    ncx_tree = etree.parse(ncx_path)
+
+  _translate_metadata(context, epub_content, ncx_tree, translator, checkpoint)
+  epub_content.save()
+
+  if ncx_tree is not None:
+    ncx_tree.write(ncx_path, pretty_print=True)
+
+  _translate_spines(context, epub_content, translator, checkpoint, manifest)
+
+# 书名、作者与目录（NCX）合并成一次翻译请求
+def _translate_metadata(context, epub_content: EpubContent, ncx_tree, translator, checkpoint: Optional[Checkpoint]):
+  book_title, authors, ncx_text_doms, text_list = _metadata_texts(context, epub_content, ncx_tree)
+  to_text_list = _translate_texts(translator, checkpoint, "metadata", text_list)
+
+  if "title" not in context.options and not book_title is None:
+    book_title = _link_translated(book_title, to_text_list.pop(0))
 
   if not book_title is None:
     epub_content.title = book_title
 
-  authors = epub_content.authors
-  to_authors = translator.translate(authors)
-
   for i, author in enumerate(authors):
-    authors[i] = _link_translated(author, to_authors[i])
+    authors[i] = _link_translated(author, to_text_list.pop(0))
 
   epub_content.authors = authors
-  epub_content.save()
 
-  _transalte_ncx(epub_content, translator)
-  _translate_spines(epub_content, path, translator)
+  for text_dom in ncx_text_doms:
+    text_dom.text = _link_translated(text_dom.text, to_text_list.pop(0))
 
-def _transalte_ncx(epub_content: EpubContent, translator):
-  ncx_path = epub_content.ncx_path
+# 返回 (书名, 作者列表, NCX 的文字节点, 需要翻译的文字)
+def _metadata_texts(context, epub_content: EpubContent, ncx_tree):
+  text_list: list[str] = []
+  book_title = None
 
-  if ncx_path is not None:
-    tree = etree.parse(ncx_path)
-    root = tree.getroot()
-    namespaces={ "ns": root.nsmap.get(None) }
-    text_doms = []
-    text_list = []
+  if "title" in context.options:
+    book_title = context.options["title"]
+  else:
+    book_title = epub_content.title
+    if not book_title is None:
+      text_list.append(book_title)
+
+  authors = epub_content.authors
+  text_list.extend(authors)
 
+  ncx_text_doms = []
+  if ncx_tree is not None:
+    root = ncx_tree.getroot()
+    namespaces={ "ns": root.nsmap.get(None) }
     for text_dom in root.xpath("//ns:text", namespaces=namespaces):
-      text_doms.append(text_dom)
+      ncx_text_doms.append(text_dom)
       text_list.append(text_dom.text)
-    
-    for index, text in enumerate(translator.translate(text_list)):
-      text_dom = text_doms[index]
-      text_dom.text = _link_translated(text_dom.text, text)
 
-    tree.write(ncx_path, pretty_print=True)
+  return book_title, authors, ncx_text_doms, text_list
 
-def _translate_spines(epub_content: EpubContent, path: str, translator):
-  for spine in epub_content.spines:
-    if spine.media_type == "application/xhtml+xml":
-      file_path = spine.path
-      with open(file_path, "r", encoding="utf-8") as file:
-        content = file.read()
-        content = translator.translate_page(file_path, content)
-      with open(file_path, "w", encoding="utf-8") as file:
-        file.write(content)
+def _translate_spines(
+  context,
+  epub_content: EpubContent,
+  translator,
+  checkpoint: Optional[Checkpoint],
+  manifest: Optional[TranslationManifest] = None,
+):
+  spines = [s for s in epub_content.spines if s.media_type == "application/xhtml+xml"]
+
+  def read_content(spine: Spine) -> str:
+    with open(spine.path, "r", encoding="utf-8") as file:
+      return file.read()
+
+  def write_content(spine: Spine, content: str):
+    with open(spine.path, "w", encoding="utf-8") as file:
+      file.write(content)
+
+  if context.options.get("pack_spines", False):
+    packed_contents = _translate_packed_spines(spines, read_content, translator, checkpoint, manifest)
+    for spine in spines:
+      write_content(spine, packed_contents[spine.path])
+  else:
+    for spine in spines:
+      content = _translate_spine(spine, lambda: read_content(spine), translator, checkpoint, manifest)
+      write_content(spine, content)
+
+def _translate_packed_spines(
+  spines: list[Spine],
+  read_content: Callable[[Spine], str],
+  translator,
+  checkpoint: Optional[Checkpoint],
+  manifest: Optional[TranslationManifest] = None,
+) -> dict[str, str]:
+  journal = None
+  if checkpoint is not None:
+    journal = checkpoint.scope("spines")
+
+  contents = translator.translate_pages(
+    pages=[(spine.path, read_content(spine)) for spine in spines],
+    journal=journal,
+    manifest=manifest,
+  )
+  return dict((spine.path, contents[i]) for i, spine in enumerate(spines))
+
+def _translate_spine(
+  spine: Spine,
+  read_content: Callable[[], str],
+  translator,
+  checkpoint: Optional[Checkpoint],
+  manifest: Optional[TranslationManifest] = None,
+  parsed_page = None,
+) -> str:
+  content = None
+
+  if checkpoint is not None:
+    content = checkpoint.spine_content(spine.href)
+
+  if content is not None:
+    print(f"Translate skipped (checkpoint): {spine.path}")
+    if manifest is not None:
+      manifest.restore(spine.path, checkpoint.spine_manifest(spine.href))
+    return content
+
+  journal = None
+  if checkpoint is not None:
+    journal = checkpoint.scope(f"spine:{spine.href}")
+
+  if parsed_page is not None:
+    content = translator.translate_parsed_page(parsed_page, journal, manifest)
+  else:
+    content = translator.translate_page(spine.path, read_content(), journal, manifest)
+
+  if checkpoint is not None:
+    manifest_entries = None
+    if manifest is not None:
+      manifest_entries = manifest.entries(spine.path)
+    checkpoint.complete_spine(spine.href, content, manifest_entries)
+
+  return content
+
+def _translate_texts(translator, checkpoint: Optional[Checkpoint], key: str, text_list: list[str]) -> list[str]:
+  if checkpoint is not None:
+    to_text_list = checkpoint.get(key)
+    if to_text_list is not None:
+      return to_text_list
+
+  to_text_list = translator.translate(text_list)
+
+  if checkpoint is not None:
+    checkpoint.put(key, to_text_list)
+  return to_text_list
 
 def _link_translated(origin: str, target: str) -> str:
   if origin == target:
     return origin
   else:
-    return f"{origin} - {target}"
\ No newline at end of file
+    return f"{origin} - {target}"
+
+# run ``python -m unittest index`` in graphs/translate/blocks/code-0
+class _Test(unittest.TestCase):
+
+  def setUp(self):
+    self._folder_path = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self._folder_path)
+
+  # 中途失败、从断点续译之后，清单仍包含全部章节，再次增量翻译时所有章节的段落都可以复用
+  def test_incremental_after_resume(self):
+    from logic.adapter import FakeTranslator
+    from benchmark.synthetic import make_epub
+
+    file_path = os.path.join(self._folder_path, "book.epub")
+    make_epub(file_path, chapters=5, paragraphs_per_chapter=30, seed=0)
+    options = {
+      "streaming": True,
+      "output_path": os.path.join(self._folder_path, "book.zh-CN.epub"),
+      "incremental": True,
+      "checkpoint_path": os.path.join(self._folder_path, "checkpoint"),
+    }
+
+    class CrashingTranslator(FakeTranslator):
+      def __init__(self, crash_after: Optional[int] = None):
+        super().__init__()
+        self._crash_after = crash_after
+
+      def translate(self, text_list: list[str], mime_type: str, context: Optional[list[str]] = None):
+        if self._crash_after is not None and self.requests >= self._crash_after:
+          raise RuntimeError("crashed")
+        return super().translate(text_list, mime_type, context)
+
+    def translate(client: CrashingTranslator, options: dict):
+      translator = Translator(
+        project_id="",
+        source_language_code="en",
+        target_language_code="zh-CN",
+        max_paragraph_characters=800,
+        clean_format=False,
+        adapter=Adapter.Fake,
+        concurrency=1,
+        client=client,
+      )
+      try:
+        with contextlib.redirect_stdout(io.StringIO()):
+          _translate_book(_OptionsContext(options), file_path, translator)
+      finally:
+        translator.close()
+
+    # 书名等元数据一次请求，其余为章节的请求
+    reference = CrashingTranslator()
+    translate(reference, dict(options, output_path=os.path.join(self._folder_path, "reference.epub"), checkpoint_path=None))
+    self.assertGreater(reference.requests, 6)
+
+    with self.assertRaises(RuntimeError):
+      translate(CrashingTranslator(crash_after=reference.requests // 2), options)
+    self.assertFalse(os.path.exists(f"{options['output_path']}.manifest.json"))
+
+    resumed = CrashingTranslator()
+    translate(resumed, options)
+    self.assertLess(resumed.requests, reference.requests)
+    with open(f"{options['output_path']}.manifest.json", "r", encoding="utf-8") as file:
+      files = json.load(file)["files"]
+    self.assertEqual(sorted(files.keys()), [f"OEBPS/text/chapter{i}.xhtml" for i in range(5)])
+
+    rerun = CrashingTranslator()
+    translate(rerun, dict(options, checkpoint_path=None))
+    self.assertEqual(rerun.requests, 1)
+
+  # 流式输出到临时文件时没有固定的位置存放清单，需要 manifest_path
+  def test_incremental_temporary_output(self):
+    from logic.adapter import FakeTranslator
+    from benchmark.synthetic import make_epub
+
+    file_path = os.path.join(self._folder_path, "book.epub")
+    make_epub(file_path, chapters=2, paragraphs_per_chapter=10, seed=0)
+    manifest_path = os.path.join(self._folder_path, "book.manifest.json")
+
+    for options in (
+      { "streaming": True, "incremental": True },
+      { "streaming": True, "incremental": True, "manifest_path": manifest_path },
+    ):
+      translator = Translator(
+        project_id="",
+        source_language_code="en",
+        target_language_code="zh-CN",
+        max_paragraph_characters=800,
+        clean_format=False,
+        adapter=Adapter.Fake,
+        concurrency=1,
+        client=FakeTranslator(),
+      )
+      try:
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+          _, output_path = _translate_book(_OptionsContext(options), file_path, translator)
+      finally:
+        translator.close()
+      os.remove(output_path)
+      self.assertFalse(os.path.exists(f"{output_path}.manifest.json"))
+      if "manifest_path" in options:
+        self.assertTrue(os.path.exists(manifest_path))
+      else:
+        self.assertIn("Incremental translation needs manifest_path", output.getvalue())
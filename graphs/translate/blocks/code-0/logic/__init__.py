@@ -1,2 +1,10 @@
 from .translator import Translator, Adapter
-from .content_parser import EpubContent
\ No newline at end of file
+from .content_parser import EpubContent, ArchiveEpubContent, Spine
+from .cache import TranslationCache
+from .checkpoint import Checkpoint
+from .metrics import Metrics
+from .manifest import TranslationManifest
+from .estimate import CostEstimate
+from .archive import ArchiveWriter
+from .budget import GroupBudget
+from .work_queue import WorkQueue, WorkUnit, queue_job, queue_options, queue_worker_name
\ No newline at end of file
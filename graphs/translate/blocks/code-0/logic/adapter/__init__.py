@@ -1,2 +1,6 @@
 from .google import GoogleTranslator
-from .openai import OpenAITranslator
\ No newline at end of file
+from .openai import OpenAITranslator
+from .fake import FakeTranslator
+from .throttle import ThrottledTranslator
+from .hedge import HedgedTranslator
+from .pool import PooledTranslator, PoolBackend
\ No newline at end of file
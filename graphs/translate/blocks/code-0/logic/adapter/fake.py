@@ -0,0 +1,71 @@
+import time
+import random
+import asyncio
+import threading
+
+from typing import Optional
+
+# 不访问网络的替身翻译接口，与 GoogleTranslator、OpenAITranslator 遵循相同的 translate(text_list, mime_type)
+# 与 translate_async 约定。可以设定每次请求的延迟、抖动与失败率，用于离线测量整条流水线的性能
+class FakeTranslator:
+  supports_context = True
+  supports_async = True
+  budget_unit = "characters"
+  group_budget = 5000
+  max_group_budget = 30000
+
+  def __init__(
+    self,
+    latency: float = 0.0,
+    jitter: float = 0.0,
+    error_rate: float = 0.0,
+    error_code: int = 503,
+    prefix: str = "[fake] ",
+    seed: int = 0,
+  ):
+    self.latency: float = latency
+    self.jitter: float = jitter
+    self.error_rate: float = error_rate
+    self.error_code: int = error_code
+    self.prefix: str = prefix
+    self.requests: int = 0
+    self.characters: int = 0
+    self.context_characters: int = 0
+    self.errors: int = 0
+    self._random = random.Random(seed)
+    self._lock = threading.Lock()
+
+  def translate(self, text_list: list[str], mime_type: str, context: Optional[list[str]] = None):
+    request_id, delay, failed = self._begin(text_list, context)
+    if delay > 0.0:
+      time.sleep(delay)
+    return self._reply(text_list, request_id, failed)
+
+  async def translate_async(self, text_list: list[str], mime_type: str, context: Optional[list[str]] = None):
+    request_id, delay, failed = self._begin(text_list, context)
+    if delay > 0.0:
+      await asyncio.sleep(delay)
+    return self._reply(text_list, request_id, failed)
+
+  def _begin(self, text_list: list[str], context: Optional[list[str]]) -> tuple[int, float, bool]:
+    with self._lock:
+      self.requests += 1
+      request_id = self.requests
+      self.characters += sum(len(text) for text in text_list)
+      if context is not None:
+        self.context_characters += sum(len(text) for text in context)
+      delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+      failed = self._random.random() < self.error_rate
+      if failed:
+        self.errors += 1
+    return request_id, delay, failed
+
+  def _reply(self, text_list: list[str], request_id: int, failed: bool) -> list[str]:
+    if failed:
+      raise FakeTranslatorError(self.error_code, f"injected failure on request {request_id}")
+    return [f"{self.prefix}{text}" for text in text_list]
+
+class FakeTranslatorError(Exception):
+  def __init__(self, code: int, message: str):
+    super().__init__(message)
+    self.code: int = code
@@ -2,29 +2,59 @@ from google.cloud import translate
 
 # https://cloud.google.com/translate/docs/advanced/translate-text-advance?hl=zh-cn
 class GoogleTranslator:
-  def __init__(self, 
+  supports_async = True
+  # 每组请求的大小预算：官方建议每次请求不超过 5000 个字符，单次请求的上限为 30000 个码位
+  budget_unit = "characters"
+  group_budget = 5000
+  max_group_budget = 30000
+
+  def __init__(self,
     project_id: str,
-    source_language_code: str, 
+    source_language_code: str,
     target_language_code: str,
   ):
     self.project_id = project_id
     self.source_language_code = source_language_code
     self.target_language_code = target_language_code
     self._client = translate.TranslationServiceClient()
+    # gRPC 的异步客户端绑定在创建它的事件循环上，因此在第一次异步调用时才创建
+    self._async_client = None
 
   def translate(self, text_list: list[str], mime_type: str):
-    location = "global"
-    parent = f"projects/{self.project_id}/locations/{location}"
     response = self._client.translate_text(
-      request={
-        "parent": parent,
-        "contents": text_list,
-        "mime_type": mime_type,
-        "source_language_code": self.source_language_code,
-        "target_language_code": self.target_language_code,
-      }
+      request=self._request(text_list, mime_type),
+    )
+    return list(map(
+      lambda x: x.translated_text,
+      response.translations,
+    ))
+
+  async def translate_async(self, text_list: list[str], mime_type: str):
+    if self._async_client is None:
+      self._async_client = translate.TranslationServiceAsyncClient()
+    response = await self._async_client.translate_text(
+      request=self._request(text_list, mime_type),
     )
     return list(map(
       lambda x: x.translated_text,
       response.translations,
     ))
+
+  def close(self):
+    self._client.transport.close()
+
+  async def close_async(self):
+    if self._async_client is not None:
+      await self._async_client.transport.close()
+      self._async_client = None
+
+  def _request(self, text_list: list[str], mime_type: str) -> dict:
+    location = "global"
+    parent = f"projects/{self.project_id}/locations/{location}"
+    return {
+      "parent": parent,
+      "contents": text_list,
+      "mime_type": mime_type,
+      "source_language_code": self.source_language_code,
+      "target_language_code": self.target_language_code,
+    }
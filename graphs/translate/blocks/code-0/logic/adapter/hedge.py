@@ -0,0 +1,298 @@
+import time
+import asyncio
+import unittest
+import threading
+
+from collections import deque
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from .fake import FakeTranslator, FakeTranslatorError
+
+# 对冲请求：一次请求的耗时超过近期成功请求耗时的 percentile 分位数（默认 p95）时，再发出一个相同的请求，
+# 先返回的结果胜出。一章要等所有分组都返回才能写出，少数特别慢的响应会拖住整章，对冲可以削掉这部分长尾。
+# 额外发出的请求数不超过总请求数的 budget 比例；近期样本少于 min_samples 时不对冲。
+# 包裹在 ThrottledTranslator 之外，对冲请求同样受限流与重试的约束
+class HedgedTranslator:
+  def __init__(
+    self,
+    translator,
+    budget: float = 0.05,
+    percentile: float = 0.95,
+    min_samples: int = 20,
+    max_workers: int = 8,
+    recent_latencies: int = 1000,
+  ):
+    self._translator = translator
+    self._budget: float = budget
+    self._percentile: float = percentile
+    self._min_samples: int = min_samples
+    self._max_workers: int = max(2, max_workers)
+    self._executor: Optional[ThreadPoolExecutor] = None
+    self._latencies: deque = deque(maxlen=recent_latencies)
+    self._lock = threading.Lock()
+    self.requests: int = 0
+    self.hedged: int = 0
+    self.hedge_wins: int = 0
+
+  @property
+  def translator(self):
+    return self._translator
+
+  @property
+  def supports_context(self) -> bool:
+    return getattr(self._translator, "supports_context", False)
+
+  @property
+  def supports_async(self) -> bool:
+    return getattr(self._translator, "supports_async", False)
+
+  # 记录调用方实际等到的耗时（对冲时为胜出请求的耗时），落败请求的耗时不计入
+  def translate(self, text_list: list[str], mime_type: str, **kwargs):
+    begin = time.perf_counter()
+    result = self._translate(text_list, mime_type, **kwargs)
+    self._record(begin)
+    return result
+
+  async def translate_async(self, text_list: list[str], mime_type: str, **kwargs):
+    begin = time.perf_counter()
+    result = await self._translate_async(text_list, mime_type, **kwargs)
+    self._record(begin)
+    return result
+
+  def _translate(self, text_list: list[str], mime_type: str, **kwargs):
+    threshold = self._begin()
+    if threshold is None:
+      return self._translator.translate(text_list, mime_type, **kwargs)
+
+    # 同步接口无法取消，落败的请求在线程池中自行结束，结果被丢弃
+    executor = self._get_executor()
+    primary = executor.submit(self._translator.translate, text_list, mime_type, **kwargs)
+    done, _ = wait([primary], timeout=threshold)
+    if len(done) > 0 or not self._take_hedge():
+      return primary.result()
+
+    hedge = executor.submit(self._translator.translate, text_list, mime_type, **kwargs)
+    pending = { primary, hedge }
+    error = None
+    while len(pending) > 0:
+      done, pending = wait(pending, return_when=FIRST_COMPLETED)
+      for future in done:
+        if future.exception() is None:
+          self._on_finished(future is hedge)
+          return future.result()
+        if error is None or future is primary:
+          error = future.exception()
+    raise error
+
+  async def _translate_async(self, text_list: list[str], mime_type: str, **kwargs):
+    threshold = self._begin()
+    primary = asyncio.ensure_future(self._translator.translate_async(text_list, mime_type, **kwargs))
+    if threshold is None:
+      return await primary
+
+    done, _ = await asyncio.wait({ primary }, timeout=threshold)
+    if len(done) > 0 or not self._take_hedge():
+      return await primary
+
+    hedge = asyncio.ensure_future(self._translator.translate_async(text_list, mime_type, **kwargs))
+    pending = { primary, hedge }
+    error = None
+    try:
+      while len(pending) > 0:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+          if task.exception() is None:
+            self._on_finished(task is hedge)
+            return task.result()
+          if error is None or task is primary:
+            error = task.exception()
+      raise error
+    finally:
+      for task in pending:
+        task.cancel()
+
+  # 不等待落败的请求结束
+  def close(self):
+    if self._executor is not None:
+      self._executor.shutdown(wait=False)
+      self._executor = None
+    if hasattr(self._translator, "close"):
+      self._translator.close()
+
+  async def close_async(self):
+    if hasattr(self._translator, "close_async"):
+      await self._translator.close_async()
+
+  def stats(self) -> dict:
+    return {
+      "requests": self.requests,
+      "hedged": self.hedged,
+      "hedge_wins": self.hedge_wins,
+      "threshold": self._threshold(),
+    }
+
+  # 计入一次请求，返回需要对冲的耗时阈值
+  def _begin(self) -> Optional[float]:
+    with self._lock:
+      self.requests += 1
+    return self._threshold()
+
+  # 近期成功请求耗时的分位数，样本不足时返回 None
+  def _threshold(self) -> Optional[float]:
+    with self._lock:
+      if len(self._latencies) < self._min_samples:
+        return None
+      latencies = sorted(self._latencies)
+    index = min(len(latencies) - 1, int(len(latencies) * self._percentile))
+    return latencies[index]
+
+  def _take_hedge(self) -> bool:
+    with self._lock:
+      if self.hedged + 1 > self.requests * self._budget:
+        return False
+      self.hedged += 1
+      return True
+
+  def _on_finished(self, hedge_won: bool):
+    if hedge_won:
+      with self._lock:
+        self.hedge_wins += 1
+
+  def _record(self, begin: float):
+    with self._lock:
+      self._latencies.append(time.perf_counter() - begin)
+
+  def _get_executor(self) -> ThreadPoolExecutor:
+    with self._lock:
+      if self._executor is None:
+        self._executor = ThreadPoolExecutor(
+          max_workers=self._max_workers,
+          thread_name_prefix="hedged-request",
+        )
+      return self._executor
+
+# run ``python -m unittest logic.adapter.hedge`` in graphs/translate/blocks/code-0
+class _Test(unittest.TestCase):
+
+  def test_no_hedge_before_samples(self):
+    for run in (self._run_sync, self._run_async):
+      with self.subTest(run=run.__name__):
+        fake = _ScriptedTranslator(delays={ 1: 0.05 })
+        translator = self._translator(fake, min_samples=5)
+        self.assertEqual(run(translator, ["a"]), ["1:a"])
+        self.assertEqual(translator.stats()["hedged"], 0)
+        self.assertEqual(fake.requests, 1)
+
+  # 原请求超过阈值时发出对冲请求，先返回的胜出
+  def test_hedge_wins(self):
+    for run in (self._run_sync, self._run_async):
+      with self.subTest(run=run.__name__):
+        fake = _ScriptedTranslator(delays={ 21: 1.0 })
+        translator = self._warm_up(fake, run)
+        begin = time.perf_counter()
+        self.assertEqual(run(translator, ["a"]), ["22:a"])
+        self.assertLess(time.perf_counter() - begin, 0.5)
+        self.assertEqual(translator.stats()["hedged"], 1)
+        self.assertEqual(translator.stats()["hedge_wins"], 1)
+
+  def test_primary_wins(self):
+    for run in (self._run_sync, self._run_async):
+      with self.subTest(run=run.__name__):
+        fake = _ScriptedTranslator(delays={ 21: 0.1, 22: 1.0 })
+        translator = self._warm_up(fake, run)
+        self.assertEqual(run(translator, ["a"]), ["21:a"])
+        self.assertEqual(translator.stats()["hedged"], 1)
+        self.assertEqual(translator.stats()["hedge_wins"], 0)
+
+  # 异步模式下落败的请求被取消
+  def test_cancel_loser(self):
+    fake = _ScriptedTranslator(delays={ 21: 1.0 })
+    translator = self._warm_up(fake, self._run_async)
+
+    async def translate():
+      result = await translator.translate_async(["a"], "text/plain")
+      # 让被取消的任务有机会处理 CancelledError
+      await asyncio.sleep(0.01)
+      return result
+
+    self.assertEqual(asyncio.run(translate()), ["22:a"])
+    self.assertEqual(fake.cancelled, 1)
+
+  # 对冲之后原请求失败，仍以对冲请求的结果为准；两个都失败时抛出原请求的错误
+  def test_primary_fails_after_hedge(self):
+    for run in (self._run_sync, self._run_async):
+      with self.subTest(run=run.__name__):
+        fake = _ScriptedTranslator(delays={ 21: 0.1, 22: 0.3 }, failures={ 21 })
+        translator = self._warm_up(fake, run)
+        self.assertEqual(run(translator, ["a"]), ["22:a"])
+        self.assertEqual(translator.stats()["hedge_wins"], 1)
+
+        fake = _ScriptedTranslator(delays={ 21: 0.1, 22: 0.3 }, failures={ 21, 22 }, error_codes={ 21: 500, 22: 503 })
+        translator = self._warm_up(fake, run)
+        with self.assertRaises(FakeTranslatorError) as raised:
+          run(translator, ["a"])
+        self.assertEqual(raised.exception.code, 500)
+
+  # 对冲请求数不超过总请求数的 budget 比例
+  def test_budget(self):
+    for run in (self._run_sync, self._run_async):
+      with self.subTest(run=run.__name__):
+        fake = _ScriptedTranslator(delays=dict((request_id, 0.02) for request_id in range(21, 100)))
+        # 取中位数作为阈值，慢请求的耗时计入样本后阈值仍然很低，每个请求都想要对冲
+        translator = self._warm_up(fake, run, budget=0.1, percentile=0.5)
+        for _ in range(10):
+          self.assertEqual(len(run(translator, ["a"])), 1)
+        stats = translator.stats()
+        self.assertEqual(stats["requests"], 30)
+        self.assertEqual(stats["hedged"], 3)
+        self.assertEqual(fake.requests, 33)
+
+  # 20 个快速请求作为阈值的样本，之后的请求序号从 21 开始
+  def _warm_up(self, fake: "_ScriptedTranslator", run, budget: float = 1.0, percentile: float = 0.95) -> HedgedTranslator:
+    translator = self._translator(fake, budget=budget, percentile=percentile, min_samples=20)
+    for _ in range(20):
+      run(translator, ["warm up"])
+    return translator
+
+  def _translator(self, fake: "_ScriptedTranslator", **kwargs) -> HedgedTranslator:
+    translator = HedgedTranslator(fake, max_workers=4, **kwargs)
+    self.addCleanup(translator.close)
+    return translator
+
+  def _run_sync(self, translator: HedgedTranslator, text_list: list[str]) -> list[str]:
+    return translator.translate(text_list, "text/plain")
+
+  def _run_async(self, translator: HedgedTranslator, text_list: list[str]) -> list[str]:
+    return asyncio.run(translator.translate_async(text_list, "text/plain"))
+
+# delays、failures 与 error_codes 以请求序号（从 1 开始，对冲请求也占一个序号）为键，
+# 译文前加上请求序号，以区分胜出的是哪个请求
+class _ScriptedTranslator(FakeTranslator):
+  def __init__(
+    self,
+    delays: Optional[dict[int, float]] = None,
+    failures: Optional[set[int]] = None,
+    error_codes: Optional[dict[int, int]] = None,
+  ):
+    super().__init__(prefix="")
+    self._delays: dict[int, float] = delays or {}
+    self._failures: set[int] = failures or set()
+    self._error_codes: dict[int, int] = error_codes or {}
+    self.cancelled: int = 0
+
+  async def translate_async(self, text_list: list[str], mime_type: str, context: Optional[list[str]] = None):
+    try:
+      return await super().translate_async(text_list, mime_type, context)
+    except asyncio.CancelledError:
+      with self._lock:
+        self.cancelled += 1
+      raise
+
+  def _begin(self, text_list: list[str], context: Optional[list[str]]) -> tuple[int, float, bool]:
+    request_id, delay, failed = super()._begin(text_list, context)
+    return request_id, self._delays.get(request_id, delay), failed or request_id in self._failures
+
+  def _reply(self, text_list: list[str], request_id: int, failed: bool) -> list[str]:
+    if failed:
+      raise FakeTranslatorError(self._error_codes.get(request_id, self.error_code), f"scripted failure on request {request_id}")
+    return [f"{request_id}:{text}" for text in text_list]
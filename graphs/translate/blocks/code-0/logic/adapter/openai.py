@@ -1,25 +1,164 @@
+import os
 import re
 import requests
+import tempfile
+import unittest
+import threading
 
+from typing import Optional
+from requests.adapters import HTTPAdapter
+
+# {language} 为目标语言的名称，见 _language_name
 _AdminPrompt = """
-I want you to act as an Chinese translator, spelling corrector and improver. 
-Next user will speak to you in any language and you will detect the language, translate it and answer in the corrected and improved version of my text, in Chinese. 
-I want you to replace simplified A0-level words and sentences with more beautiful and elegant, upper level Chinese words and sentences. Keep the meaning same, but make them more literary. 
+I want you to act as an {language} translator, spelling corrector and improver. 
+Next user will speak to you in any language and you will detect the language, translate it and answer in the corrected and improved version of my text, in {language}. 
+I want you to replace simplified A0-level words and sentences with more beautiful and elegant, upper level {language} words and sentences. Keep the meaning same, but make them more literary. 
 I want you to only reply the correction, the improvements and nothing else, do not write explanations.
 Next user will speak a passage. The passage is divided into multiple lines, each line starting with a number (an Arabic numeral followed by a colon). Your translation should also respond in multiple lines, with corresponding numbers at the beginning of each line in the translation.
 """
 
+_ContextPrompt = """
+The passage continues the following text. It is given only as context, do not translate it and do not include it in your reply:
+"""
+
+# 提示词中使用的语言名称，未列出的语言直接使用语言代码
+_LanguageNames: dict[str, str] = {
+  "zh": "Chinese",
+  "zh-cn": "Chinese",
+  "zh-hans": "Chinese",
+  "zh-tw": "Traditional Chinese",
+  "zh-hk": "Traditional Chinese",
+  "zh-hant": "Traditional Chinese",
+  "en": "English",
+  "ja": "Japanese",
+  "ko": "Korean",
+  "fr": "French",
+  "de": "German",
+  "es": "Spanish",
+  "it": "Italian",
+  "pt": "Portuguese",
+  "ru": "Russian",
+  "ar": "Arabic",
+}
+
+def _language_name(language_code: str) -> str:
+  code = language_code.lower()
+  if code in _LanguageNames:
+    return _LanguageNames[code]
+  return _LanguageNames.get(code.split("-")[0], language_code)
+
 class OpenAITranslator:
-  def __init__(self):
-    with open("/app/workspace/token.txt", "r") as file:
-      auth_token = file.read()
-    self._model = "gpt-3.5-turbo"
-    self._api_url = "https://aigptx.top/v1/chat/completions"
-    self._headers = headers = {
+  # translate 接受 context 参数，上下文只放在提示词中，不计入需要翻译的行
+  supports_context = True
+  # 同时提供 translate_async，可由事件循环驱动
+  supports_async = True
+  # 每组请求的大小预算按估计的 token 数计。gpt-3.5-turbo 的上下文为 4096 个 token，
+  # 需要容纳提示词、原文与（中文通常更长的）译文，因此原文不超过 1500 个 token
+  budget_unit = "tokens"
+  group_budget = 1000
+  max_group_budget = 1500
+
+  def __init__(
+    self,
+    pool_size: int = 8,
+    connect_timeout: float = 10.0,
+    read_timeout: float = 120.0,
+    max_line_retries: int = 2,
+    target_language_code: str = "zh-CN",
+    token_path: str = "/app/workspace/token.txt",
+    api_url: str = "https://aigptx.top/v1/chat/completions",
+    model: str = "gpt-3.5-turbo",
+  ):
+    with open(token_path, "r") as file:
+      auth_token = file.read().strip()
+    self._model = model
+    self._admin_prompt: str = _AdminPrompt.format(language=_language_name(target_language_code))
+    self._api_url = api_url
+    self._auth_token: str = auth_token
+    self._pool_size: int = pool_size
+    self._connect_timeout: float = connect_timeout
+    self._read_timeout: float = read_timeout
+    self._timeout = (connect_timeout, read_timeout)
+    self._max_line_retries: int = max_line_retries
+    self._lock = threading.Lock()
+    self.requests: int = 0
+    self.missing_lines: int = 0
+    self.line_retries: int = 0
+    self.unrecovered_lines: int = 0
+
+    # 复用同一个连接池保持长连接，避免每组段落都重新建立 TLS 连接。
+    # 会话创建后不再修改，可以在多个线程之间共享
+    self._session = requests.Session()
+    self._session.headers.update({
       "Authorization": f"Bearer {auth_token}",
+    })
+    adapter = HTTPAdapter(
+      pool_connections=1,
+      pool_maxsize=pool_size,
+      pool_block=True,
+    )
+    self._session.mount("https://", adapter)
+    self._session.mount("http://", adapter)
+
+    # 异步请求使用 httpx（openai 依赖它），客户端绑定在事件循环上，第一次异步调用时才创建
+    self._async_client = None
+
+  def translate(self, text_list: list[str], mime_type: str, context: Optional[list[str]] = None):
+    exchange = self._exchange(text_list, context)
+    messages = next(exchange)
+    while True:
+      try:
+        messages = exchange.send(self._request(messages))
+      except StopIteration as e:
+        return e.value
+
+  async def translate_async(self, text_list: list[str], mime_type: str, context: Optional[list[str]] = None):
+    exchange = self._exchange(text_list, context)
+    messages = next(exchange)
+    while True:
+      try:
+        messages = exchange.send(await self._request_async(messages))
+      except StopIteration as e:
+        return e.value
+
+  def stats(self) -> dict:
+    return {
+      "requests": self.requests,
+      "missing_lines": self.missing_lines,
+      "line_retries": self.line_retries,
+      "unrecovered_lines": self.unrecovered_lines,
     }
 
-  def translate(self, text_list: list[str], mime_type: str):
+  # 与网络无关的请求流程：每 yield 一组 messages，调用方把接口的回复 send 回来，最终以 return 给出译文。
+  # 同步与异步的 translate 共用这段逻辑，只是发送请求的方式不同
+  def _exchange(self, text_list: list[str], context: Optional[list[str]]):
+    response = yield self._build_messages(text_list, context)
+    to_text_list = self._parse_reply(response, len(text_list))
+    missing_indexes = self._find_missing(text_list, to_text_list)
+    if len(missing_indexes) > 0:
+      with self._lock:
+        self.missing_lines += len(missing_indexes)
+
+    # 模型偶尔会漏掉或合并若干行，只把缺失的行重新编号后再请求一次，而不是重译整组
+    retries = 0
+    while len(missing_indexes) > 0 and retries < self._max_line_retries:
+      retries += 1
+      with self._lock:
+        self.line_retries += 1
+      retry_text_list = [text_list[i] for i in missing_indexes]
+      response = yield self._build_messages(retry_text_list, context)
+      for i, text in enumerate(self._parse_reply(response, len(retry_text_list))):
+        to_text_list[missing_indexes[i]] = text
+      missing_indexes = self._find_missing(text_list, to_text_list)
+
+    if len(missing_indexes) > 0:
+      with self._lock:
+        self.unrecovered_lines += len(missing_indexes)
+      print(f"OpenAI reply is missing {len(missing_indexes)} line(s) after {retries} retry(s)")
+
+    return to_text_list
+
+  def _build_messages(self, text_list: list[str], context: Optional[list[str]]) -> list:
     text_buffer_list = []
 
     for index, text in enumerate(text_list):
@@ -27,15 +166,27 @@ class OpenAITranslator:
       text = text.strip()
       text_buffer_list.append(f"{index + 1}: {text}")
 
-    response = self._request([{
+    messages = [{
       "role": "system",
-      "content": _AdminPrompt,
-    }, {
+      "content": self._admin_prompt,
+    }]
+    if context is not None and len(context) > 0:
+      context_text = "\n".join(map(lambda x: re.sub(r"\s+", " ", x).strip(), context))
+      messages.append({
+        "role": "system",
+        "content": f"{_ContextPrompt}{context_text}",
+      })
+    messages.append({
       "role": "user",
       "content": "\n".join(text_buffer_list),
-    }])
+    })
+    with self._lock:
+      self.requests += 1
+    return messages
+
+  def _parse_reply(self, response: dict, count: int) -> list[str]:
     response: str = response["choices"][0]["message"]["content"]
-    to_text_list = [""] * len(text_list)
+    to_text_list = [""] * count
 
     for line in response.split("\n"):
       match = re.search(r"^\d+\:", line)
@@ -43,23 +194,141 @@ class OpenAITranslator:
         index = re.sub(r"\:$", "",  match.group(0))
         index = int(index) - 1
         text = re.sub(r"^\d+\:\s*", "", line)
-        if index < len(to_text_list):
+        if 0 <= index < len(to_text_list):
           to_text_list[index] = text
 
     return to_text_list
 
+  # 原文不为空而译文为空的行视为缺失（序号超出范围的行在解析时已被丢弃）
+  def _find_missing(self, text_list: list[str], to_text_list: list[str]) -> list[int]:
+    missing_indexes = []
+    for index, text in enumerate(text_list):
+      if to_text_list[index].strip() == "" and text.strip() != "":
+        missing_indexes.append(index)
+    return missing_indexes
+
   def _request(self, messages: list):
-    response = requests.post(
+    response = self._session.post(
       self._api_url,
-      headers=self._headers,
+      timeout=self._timeout,
       stream=False,
       json={
         "model": self._model,
         "messages": messages,
       },
     )
+    # 让 429 与 5xx 以异常的形式抛出，交给 ThrottledTranslator 判断是否重试
+    response.raise_for_status()
+    return response.json()
+
+  async def _request_async(self, messages: list):
+    if self._async_client is None:
+      import httpx
+      self._async_client = httpx.AsyncClient(
+        headers={ "Authorization": f"Bearer {self._auth_token}" },
+        timeout=httpx.Timeout(self._read_timeout, connect=self._connect_timeout),
+        limits=httpx.Limits(
+          max_connections=self._pool_size,
+          max_keepalive_connections=self._pool_size,
+        ),
+      )
+    response = await self._async_client.post(
+      self._api_url,
+      json={
+        "model": self._model,
+        "messages": messages,
+      },
+    )
+    response.raise_for_status()
     return response.json()
 
+  def close(self):
+    self._session.close()
+
+  async def close_async(self):
+    if self._async_client is not None:
+      await self._async_client.aclose()
+      self._async_client = None
+
+# 用替身 _request 测试缺失行的重试，不访问网络
+# run ``python -m unittest logic.adapter.openai`` in graphs/translate/blocks/code-0
+class _Test(unittest.TestCase):
+
+  def setUp(self):
+    token_fd, self._token_path = tempfile.mkstemp()
+    with os.fdopen(token_fd, "w") as file:
+      file.write("token")
+
+  def tearDown(self):
+    os.remove(self._token_path)
+
+  # replies 依次作为每次请求的回复，返回 (translator, 每次请求的 messages)
+  def _translator(self, replies: list[str], max_line_retries: int = 2):
+    translator = OpenAITranslator(token_path=self._token_path, max_line_retries=max_line_retries)
+    requests_messages = []
+
+    def request(messages: list):
+      requests_messages.append(messages)
+      return { "choices": [{ "message": { "content": replies[len(requests_messages) - 1] } }] }
+
+    translator._request = request
+    self.addCleanup(translator.close)
+    return translator, requests_messages
+
+  def test_retry_missing_lines(self):
+    # 第 2、3 行被合并到第 2 行，第 4 行漏掉；序号 0 与 9 超出范围，丢弃
+    translator, requests_messages = self._translator([
+      "0: bogus\n1: A\n2: B C\n5: E\n9: bogus",
+      "1: C\n2: D",
+    ])
+    result = translator.translate(["a", "b", "c", "d", "e"], "text/plain", context=["before"])
+
+    self.assertEqual(result, ["A", "B C", "C", "D", "E"])
+    self.assertEqual(len(requests_messages), 2)
+    retry_messages = requests_messages[1]
+    self.assertEqual(retry_messages[-1], { "role": "user", "content": "1: c\n2: d" })
+    self.assertIn("before", retry_messages[1]["content"])
+    self.assertEqual(translator.stats(), {
+      "requests": 2,
+      "missing_lines": 2,
+      "line_retries": 1,
+      "unrecovered_lines": 0,
+    })
+
+  def test_unrecovered_lines(self):
+    translator, requests_messages = self._translator([
+      "1: A",
+      "",
+      "",
+    ])
+    result = translator.translate(["a", "b", " "], "text/plain")
+
+    # 空白的原文不算缺失
+    self.assertEqual(result, ["A", "", ""])
+    self.assertEqual(len(requests_messages), 3)
+    self.assertEqual(requests_messages[1][-1]["content"], "1: b")
+    self.assertEqual(requests_messages[2][-1]["content"], "1: b")
+    self.assertEqual(translator.stats(), {
+      "requests": 3,
+      "missing_lines": 1,
+      "line_retries": 2,
+      "unrecovered_lines": 1,
+    })
+
+  def test_target_language(self):
+    for language_code, language in (("zh-CN", "Chinese"), ("ja", "Japanese"), ("en-US", "English"), ("xx", "xx")):
+      translator = OpenAITranslator(token_path=self._token_path, target_language_code=language_code)
+      self.addCleanup(translator.close)
+      prompt = translator._build_messages(["a"], None)[0]["content"]
+      self.assertIn(f"in {language}.", prompt)
+      self.assertNotIn("{language}", prompt)
+
+  def test_no_retry_when_complete(self):
+    translator, requests_messages = self._translator(["1: A\n2: B"], max_line_retries=0)
+    self.assertEqual(translator.translate(["a", "b"], "text/plain"), ["A", "B"])
+    self.assertEqual(len(requests_messages), 1)
+    self.assertEqual(translator.stats()["missing_lines"], 0)
+
 # run python graphs/translate/blocks/code-0/logic/adapter/openai.py
 if __name__ == "__main__":
   translator = OpenAITranslator()
@@ -0,0 +1,235 @@
+import time
+import asyncio
+import unittest
+import threading
+
+from typing import Optional
+from .fake import FakeTranslator, FakeTranslatorError
+from .throttle import _error_status, _is_transient, _retry_after, _ThrottledStatusSet
+
+class PoolBackend:
+  def __init__(self, name: str, translator, weight: float = 1.0):
+    self.name: str = name
+    self.translator = translator
+    self.weight: float = max(weight, 1e-9)
+    self.in_flight: int = 0
+    self.requests: int = 0
+    self.characters: int = 0
+    self.seconds: float = 0.0
+    self.failures: int = 0
+    self.throttled: int = 0
+    self.consecutive_failures: int = 0
+    self.available_at: float = 0.0
+
+# 把分组分散到多个后端（多个 Google 项目、多个 OpenAI 密钥或端点），突破单个配额的吞吐上限。
+# 每次请求选择可用后端中 (已发出 + 在途的请求数) / 权重 最小的一个，请求数按权重（通常取各自的配额）分配；
+# 请求失败的后端暂时移出轮换（连续失败时冷却时间加倍，有 Retry-After 时以它为准），请求转到其他后端重试，
+# 最多 max_failovers 次。所有后端都在冷却时，等待最先恢复的一个。
+# 载荷错误等不属于限流或暂时性错误的失败换后端也不会成功，直接抛出，不让后端冷却
+class PooledTranslator:
+  def __init__(
+    self,
+    backends: list[PoolBackend],
+    max_failovers: int = 3,
+    base_cooldown: float = 1.0,
+    max_cooldown: float = 60.0,
+  ):
+    if len(backends) == 0:
+      raise ValueError("translator pool needs at least one backend")
+    self._backends: list[PoolBackend] = backends
+    self._max_failovers: int = max_failovers
+    self._base_cooldown: float = base_cooldown
+    self._max_cooldown: float = max_cooldown
+    self._lock = threading.Lock()
+    self._started_at: Optional[float] = None
+    self.failovers: int = 0
+
+  @property
+  def supports_context(self) -> bool:
+    return all(getattr(b.translator, "supports_context", False) for b in self._backends)
+
+  @property
+  def supports_async(self) -> bool:
+    return all(getattr(b.translator, "supports_async", False) for b in self._backends)
+
+  def translate(self, text_list: list[str], mime_type: str, **kwargs):
+    characters = sum(len(text) for text in text_list)
+    attempt = 0
+
+    while True:
+      backend, wait = self._acquire()
+      if wait > 0.0:
+        time.sleep(wait)
+      begin = time.perf_counter()
+      try:
+        result = backend.translator.translate(text_list, mime_type, **kwargs)
+      except Exception as e:
+        self._on_failure(backend, e, attempt, begin)
+        attempt += 1
+      else:
+        self._on_success(backend, characters, begin)
+        return result
+
+  async def translate_async(self, text_list: list[str], mime_type: str, **kwargs):
+    characters = sum(len(text) for text in text_list)
+    attempt = 0
+
+    while True:
+      backend, wait = self._acquire()
+      try:
+        if wait > 0.0:
+          await asyncio.sleep(wait)
+        begin = time.perf_counter()
+        result = await backend.translator.translate_async(text_list, mime_type, **kwargs)
+      except asyncio.CancelledError:
+        # 例如对冲请求落败后被取消，可能还在等待后端冷却
+        with self._lock:
+          backend.in_flight -= 1
+        raise
+      except Exception as e:
+        self._on_failure(backend, e, attempt, begin)
+        attempt += 1
+      else:
+        self._on_success(backend, characters, begin)
+        return result
+
+  def close(self):
+    for backend in self._backends:
+      if hasattr(backend.translator, "close"):
+        backend.translator.close()
+
+  async def close_async(self):
+    for backend in self._backends:
+      if hasattr(backend.translator, "close_async"):
+        await backend.translator.close_async()
+
+  def stats(self) -> dict:
+    with self._lock:
+      now = time.perf_counter()
+      elapsed = now - self._started_at if self._started_at is not None else 0.0
+      backends = {}
+      for backend in self._backends:
+        backends[backend.name] = {
+          "requests": backend.requests,
+          "characters": backend.characters,
+          "failures": backend.failures,
+          "throttled": backend.throttled,
+          "seconds": backend.seconds,
+          "characters_per_second": backend.characters / elapsed if elapsed > 0.0 else 0.0,
+          "available": backend.available_at <= now,
+        }
+      return {
+        "failovers": self.failovers,
+        "backends": backends,
+      }
+
+  # 选出本次请求的后端并计入在途数，返回 (后端, 需要等待它恢复的秒数)
+  def _acquire(self) -> tuple[PoolBackend, float]:
+    with self._lock:
+      now = time.perf_counter()
+      if self._started_at is None:
+        self._started_at = now
+      available = [b for b in self._backends if b.available_at <= now]
+      if len(available) > 0:
+        backend = min(available, key=lambda b: (b.requests + b.in_flight + 1) / b.weight)
+        wait = 0.0
+      else:
+        backend = min(self._backends, key=lambda b: b.available_at)
+        wait = backend.available_at - now
+      backend.in_flight += 1
+      return backend, wait
+
+  def _on_success(self, backend: PoolBackend, characters: int, begin: float):
+    with self._lock:
+      backend.in_flight -= 1
+      backend.requests += 1
+      backend.characters += characters
+      backend.seconds += time.perf_counter() - begin
+      backend.consecutive_failures = 0
+
+  # 把失败的后端移出轮换；不可重试或次数用尽时抛出原异常
+  def _on_failure(self, backend: PoolBackend, error: Exception, attempt: int, begin: float):
+    status = _error_status(error)
+    throttled = status in _ThrottledStatusSet
+    with self._lock:
+      backend.in_flight -= 1
+      backend.requests += 1
+      backend.failures += 1
+      backend.seconds += time.perf_counter() - begin
+      if not (throttled or _is_transient(error, status)):
+        raise error
+
+      backend.consecutive_failures += 1
+      if throttled:
+        backend.throttled += 1
+
+      cooldown = _retry_after(error)
+      if cooldown is None:
+        cooldown = self._base_cooldown * (2 ** (backend.consecutive_failures - 1))
+      backend.available_at = time.perf_counter() + min(cooldown, self._max_cooldown)
+
+      if attempt >= self._max_failovers:
+        raise error
+      self.failovers += 1
+
+    print(f"Translate backend {backend.name} failed ({status or type(error).__name__}), fail over {attempt + 1}/{self._max_failovers}")
+
+# run ``python -m unittest logic.adapter.pool`` in graphs/translate/blocks/code-0
+class _Test(unittest.TestCase):
+
+  def test_fail_over_transient(self):
+    for error_code in (429, 503):
+      with self.subTest(error_code=error_code):
+        failing = FakeTranslator(error_rate=1.0, error_code=error_code)
+        healthy = FakeTranslator(prefix="")
+        pool = self._pool(failing, healthy)
+        for _ in range(4):
+          self.assertEqual(pool.translate(["a"], "text/plain"), ["a"])
+        # 失败的后端在冷却中，之后的请求都转到另一个后端
+        self.assertEqual(failing.requests, 1)
+        self.assertEqual(healthy.requests, 4)
+        self.assertEqual(pool.failovers, 1)
+        self.assertFalse(pool.stats()["backends"]["b0"]["available"])
+
+  # 载荷错误等换后端也不会成功，直接抛出，各后端都不冷却
+  def test_no_fail_over_client_error(self):
+    for run in (self._run_sync, self._run_async):
+      with self.subTest(run=run.__name__):
+        first = FakeTranslator(error_rate=1.0, error_code=400)
+        second = FakeTranslator(error_rate=1.0, error_code=400)
+        pool = self._pool(first, second)
+        with self.assertRaises(FakeTranslatorError):
+          run(pool, ["a"])
+        self.assertEqual(first.requests + second.requests, 1)
+        self.assertEqual(pool.failovers, 0)
+        self.assertTrue(all(backend["available"] for backend in pool.stats()["backends"].values()))
+        self.assertTrue(all(backend.in_flight == 0 for backend in pool._backends))
+
+  # 等待后端冷却时被取消（例如对冲请求落败），在途数仍然归还
+  def test_cancel_during_cooldown(self):
+    pool = self._pool(FakeTranslator(error_rate=1.0, error_code=503), base_cooldown=10.0)
+
+    async def cancel_while_waiting():
+      with self.assertRaises(FakeTranslatorError):
+        await pool.translate_async(["a"], "text/plain")
+      task = asyncio.ensure_future(pool.translate_async(["a"], "text/plain"))
+      await asyncio.sleep(0.05)
+      task.cancel()
+      with self.assertRaises(asyncio.CancelledError):
+        await task
+
+    asyncio.run(cancel_while_waiting())
+    self.assertEqual(pool._backends[0].in_flight, 0)
+
+  def _pool(self, *translators: FakeTranslator, base_cooldown: float = 1.0) -> PooledTranslator:
+    return PooledTranslator(
+      backends=[PoolBackend(f"b{i}", translator) for i, translator in enumerate(translators)],
+      max_failovers=len(translators) - 1,
+      base_cooldown=base_cooldown,
+    )
+
+  def _run_sync(self, pool: PooledTranslator, text_list: list[str]) -> list[str]:
+    return pool.translate(text_list, "text/plain")
+
+  def _run_async(self, pool: PooledTranslator, text_list: list[str]) -> list[str]:
+    return asyncio.run(pool.translate_async(text_list, "text/plain"))
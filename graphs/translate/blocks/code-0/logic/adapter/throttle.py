@@ -0,0 +1,479 @@
+import time
+import random
+import asyncio
+import unittest
+import threading
+
+from typing import Optional
+from .fake import FakeTranslator, FakeTranslatorError
+
+_ThrottledStatusSet: set = { 429 }
+_TransientStatusSet: set = { 408, 500, 502, 503, 504 }
+
+# 包裹任意翻译接口（GoogleTranslator、OpenAITranslator 等）：
+# 1. 令牌桶限制每分钟的请求数与字符数
+# 2. 遇到限流（429）或暂时性错误（5xx、超时、断线）时以带抖动的指数退避重试
+# 3. AIMD 调整同时在途的请求数：成功时缓慢增加，被限流时减半
+# 这样可以贴着服务商的真实配额运行，而不会因为一次 429 让整本书失败。
+# 内层接口实现了 translate_async 时，translate_async 以协程的方式等待，不占用线程
+class ThrottledTranslator:
+  def __init__(
+    self,
+    translator,
+    requests_per_minute: Optional[int] = None,
+    characters_per_minute: Optional[int] = None,
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+    max_concurrency: int = 1,
+  ):
+    self._translator = translator
+    self._max_retries: int = max_retries
+    self._base_delay: float = base_delay
+    self._max_delay: float = max_delay
+    self._requests_bucket = _TokenBucket.per_minute(requests_per_minute)
+    self._characters_bucket = _TokenBucket.per_minute(characters_per_minute)
+    self._limit = _AdaptiveLimit(max_concurrency)
+    self._lock = threading.Lock()
+    self.requests: int = 0
+    self.retries: int = 0
+    self.throttled: int = 0
+    self.failures: int = 0
+
+  @property
+  def translator(self):
+    return self._translator
+
+  @property
+  def supports_context(self) -> bool:
+    return getattr(self._translator, "supports_context", False)
+
+  @property
+  def supports_async(self) -> bool:
+    return getattr(self._translator, "supports_async", False)
+
+  def translate(self, text_list: list[str], mime_type: str, **kwargs):
+    characters = sum(len(text) for text in text_list)
+    attempt = 0
+
+    while True:
+      if self._requests_bucket is not None:
+        self._requests_bucket.take(1)
+      if self._characters_bucket is not None:
+        self._characters_bucket.take(characters)
+
+      self._limit.acquire()
+      try:
+        with self._lock:
+          self.requests += 1
+        result = self._translator.translate(text_list, mime_type, **kwargs)
+
+      except Exception as e:
+        delay = self._on_failure(e, attempt)
+        attempt += 1
+
+      else:
+        self._limit.increase()
+        return result
+
+      finally:
+        self._limit.release()
+
+      time.sleep(delay)
+
+  async def translate_async(self, text_list: list[str], mime_type: str, **kwargs):
+    characters = sum(len(text) for text in text_list)
+    attempt = 0
+
+    while True:
+      if self._requests_bucket is not None:
+        await self._requests_bucket.take_async(1)
+      if self._characters_bucket is not None:
+        await self._characters_bucket.take_async(characters)
+
+      await self._limit.acquire_async()
+      try:
+        with self._lock:
+          self.requests += 1
+        result = await self._translator.translate_async(text_list, mime_type, **kwargs)
+
+      except Exception as e:
+        delay = self._on_failure(e, attempt)
+        attempt += 1
+
+      else:
+        self._limit.increase()
+        return result
+
+      finally:
+        self._limit.release()
+
+      await asyncio.sleep(delay)
+
+  def close(self):
+    if hasattr(self._translator, "close"):
+      self._translator.close()
+
+  async def close_async(self):
+    if hasattr(self._translator, "close_async"):
+      await self._translator.close_async()
+
+  # 记录一次失败的请求并返回重试前需要等待的秒数；不可重试或重试次数用尽时抛出原异常
+  def _on_failure(self, error: Exception, attempt: int) -> float:
+    status = _error_status(error)
+    throttled = status in _ThrottledStatusSet
+
+    if throttled:
+      self._limit.decrease()
+      with self._lock:
+        self.throttled += 1
+
+    if attempt >= self._max_retries or not (throttled or _is_transient(error, status)):
+      with self._lock:
+        self.failures += 1
+      raise error
+
+    delay = self._backoff_delay(attempt, error)
+    with self._lock:
+      self.retries += 1
+    print(f"Translate request failed ({status or type(error).__name__}), retry {attempt + 1}/{self._max_retries} in {delay:.1f}s")
+    return delay
+
+  def stats(self) -> dict:
+    return {
+      "requests": self.requests,
+      "retries": self.retries,
+      "throttled": self.throttled,
+      "failures": self.failures,
+      "concurrency": self._limit.limit,
+    }
+
+  def _backoff_delay(self, attempt: int, error: Exception) -> float:
+    retry_after = _retry_after(error)
+    if retry_after is not None:
+      return min(retry_after, self._max_delay)
+    # full jitter: https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+    return random.uniform(0.0, min(self._max_delay, self._base_delay * (2 ** attempt)))
+
+class _TokenBucket:
+  @staticmethod
+  def per_minute(rate: Optional[int]) -> Optional["_TokenBucket"]:
+    if rate is None or rate <= 0:
+      return None
+    # 最多积攒 10 秒的额度，避免空闲后一次性放出整分钟的突发流量
+    return _TokenBucket(rate / 60.0, max(1.0, rate / 6.0))
+
+  def __init__(self, rate: float, capacity: float):
+    self._rate: float = rate
+    self._capacity: float = capacity
+    self._tokens: float = capacity
+    self._updated_at: float = time.monotonic()
+    self._lock = threading.Lock()
+
+  def take(self, amount: float):
+    while True:
+      wait = self._try_take(amount)
+      if wait <= 0.0:
+        return
+      time.sleep(wait)
+
+  async def take_async(self, amount: float):
+    while True:
+      wait = self._try_take(amount)
+      if wait <= 0.0:
+        return
+      await asyncio.sleep(wait)
+
+  # 额度足够时扣除并返回 0，否则返回还需等待的秒数
+  def _try_take(self, amount: float) -> float:
+    # 单次请求可能超过桶的容量，此时只要桶满就放行，欠下的额度由后续请求等待偿还
+    required = min(amount, self._capacity)
+
+    with self._lock:
+      now = time.monotonic()
+      self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+      self._updated_at = now
+
+      if self._tokens >= required:
+        self._tokens -= amount
+        return 0.0
+      return (required - self._tokens) / self._rate
+
+class _AdaptiveLimit:
+  def __init__(self, max_limit: int):
+    self._max_limit: float = float(max(1, max_limit))
+    self._limit: float = self._max_limit
+    self._in_flight: int = 0
+    self._condition = threading.Condition()
+    # 在事件循环中等待名额的协程，名额释放时通过 call_soon_threadsafe 唤醒
+    self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+  @property
+  def limit(self) -> int:
+    return int(self._limit)
+
+  def acquire(self):
+    with self._condition:
+      while self._in_flight >= int(self._limit):
+        self._condition.wait()
+      self._in_flight += 1
+
+  async def acquire_async(self):
+    loop = asyncio.get_running_loop()
+    while True:
+      with self._condition:
+        if self._in_flight < int(self._limit):
+          self._in_flight += 1
+          return
+        future = loop.create_future()
+        self._waiters.append((loop, future))
+      await future
+
+  def release(self):
+    with self._condition:
+      self._in_flight -= 1
+      self._notify()
+
+  def increase(self):
+    with self._condition:
+      # 每个窗口（约 limit 个成功请求）增加 1
+      self._limit = min(self._max_limit, self._limit + 1.0 / self._limit)
+      self._notify()
+
+  def _notify(self):
+    self._condition.notify_all()
+    for loop, future in self._waiters:
+      loop.call_soon_threadsafe(_resolve_waiter, future)
+    self._waiters.clear()
+
+  def decrease(self):
+    with self._condition:
+      self._limit = max(1.0, self._limit / 2.0)
+
+def _error_status(error: Exception) -> Optional[int]:
+  # google.api_core 的异常带有 HTTP 状态码 code；requests 的 HTTPError 带有 response
+  code = getattr(error, "code", None)
+  if isinstance(code, int):
+    return code
+  response = getattr(error, "response", None)
+  status_code = getattr(response, "status_code", None)
+  if isinstance(status_code, int):
+    return status_code
+  return None
+
+def _is_transient(error: Exception, status: Optional[int]) -> bool:
+  if status is not None:
+    return status in _TransientStatusSet
+  return (
+    isinstance(error, (ConnectionError, TimeoutError)) or
+    _is_requests_network_error(error) or
+    _is_httpx_network_error(error)
+  )
+
+def _is_requests_network_error(error: Exception) -> bool:
+  try:
+    import requests
+  except ImportError:
+    return False
+  return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+def _is_httpx_network_error(error: Exception) -> bool:
+  try:
+    import httpx
+  except ImportError:
+    return False
+  return isinstance(error, httpx.TransportError)
+
+def _resolve_waiter(future: asyncio.Future):
+  if not future.done():
+    future.set_result(None)
+
+def _retry_after(error: Exception) -> Optional[float]:
+  response = getattr(error, "response", None)
+  headers = getattr(response, "headers", None)
+  if headers is None:
+    return None
+  value = headers.get("Retry-After")
+  try:
+    return float(value) if value is not None else None
+  except ValueError:
+    return None
+
+# run ``python -m unittest logic.adapter.throttle`` in graphs/translate/blocks/code-0
+class _Test(unittest.TestCase):
+
+  def test_retry_transient(self):
+    for error_code in (500, 502, 503, 504, 408):
+      with self.subTest(error_code=error_code):
+        fake = FakeTranslator(error_rate=1.0, error_code=error_code)
+        translator = self._translator(fake, max_retries=2)
+        with self.assertRaises(FakeTranslatorError):
+          translator.translate(["a"], "text/plain")
+        self.assertEqual(fake.requests, 3)
+        self.assertEqual(translator.stats()["retries"], 2)
+        self.assertEqual(translator.stats()["throttled"], 0)
+        self.assertEqual(translator.stats()["failures"], 1)
+        self.assertEqual(translator.stats()["concurrency"], 4)
+
+  # 限流时重试，并把在途请求数减半
+  def test_retry_throttled(self):
+    fake = FakeTranslator(error_rate=1.0, error_code=429)
+    translator = self._translator(fake, max_retries=2)
+    with self.assertRaises(FakeTranslatorError):
+      translator.translate(["a"], "text/plain")
+    self.assertEqual(fake.requests, 3)
+    self.assertEqual(translator.stats()["throttled"], 3)
+    self.assertEqual(translator.stats()["concurrency"], 1)
+
+  # 其余 4xx（例如载荷错误）重试也不会成功，直接抛出
+  def test_no_retry_client_error(self):
+    for error_code in (400, 401, 403, 404, 413):
+      with self.subTest(error_code=error_code):
+        fake = FakeTranslator(error_rate=1.0, error_code=error_code)
+        translator = self._translator(fake, max_retries=2)
+        with self.assertRaises(FakeTranslatorError):
+          translator.translate(["a"], "text/plain")
+        self.assertEqual(fake.requests, 1)
+        self.assertEqual(translator.stats()["retries"], 0)
+
+  def test_network_errors(self):
+    for error, retried in (
+      (ConnectionError("reset"), True),
+      (TimeoutError("timed out"), True),
+      (ValueError("bad reply"), False),
+    ):
+      with self.subTest(error=type(error).__name__):
+        inner = _FailingTranslator([error])
+        translator = self._translator(inner, max_retries=2)
+        if retried:
+          self.assertEqual(translator.translate(["a"], "text/plain"), ["[fake] a"])
+          self.assertEqual(inner.requests, 2)
+        else:
+          with self.assertRaises(type(error)):
+            translator.translate(["a"], "text/plain")
+          self.assertEqual(inner.requests, 1)
+
+  def test_retry_async(self):
+    inner = _FailingTranslator([FakeTranslatorError(503, "unavailable"), FakeTranslatorError(429, "throttled")])
+    translator = self._translator(inner, max_retries=2)
+    self.assertEqual(asyncio.run(translator.translate_async(["a"], "text/plain")), ["[fake] a"])
+    self.assertEqual(inner.requests, 3)
+    self.assertEqual(translator.stats()["retries"], 2)
+    self.assertEqual(translator.stats()["throttled"], 1)
+
+    fake = FakeTranslator(error_rate=1.0, error_code=400)
+    translator = self._translator(fake, max_retries=2)
+    with self.assertRaises(FakeTranslatorError):
+      asyncio.run(translator.translate_async(["a"], "text/plain"))
+    self.assertEqual(fake.requests, 1)
+
+  def test_retry_after(self):
+    translator = self._translator(FakeTranslator(), max_retries=2)
+    translator._max_delay = 10.0
+    self.assertEqual(_retry_after(_HttpError(429, { "Retry-After": "3" })), 3.0)
+    self.assertIsNone(_retry_after(_HttpError(429, { "Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT" })))
+    self.assertIsNone(_retry_after(_HttpError(503, {})))
+    self.assertIsNone(_retry_after(FakeTranslatorError(503, "unavailable")))
+    self.assertEqual(_error_status(_HttpError(429, {})), 429)
+    self.assertEqual(translator._backoff_delay(5, _HttpError(429, { "Retry-After": "3" })), 3.0)
+    self.assertEqual(translator._backoff_delay(0, _HttpError(429, { "Retry-After": "120" })), 10.0)
+
+    # 没有 Retry-After 时为 [0, base_delay * 2^attempt] 内的随机值，不超过 max_delay
+    for attempt in range(10):
+      delay = translator._backoff_delay(attempt, FakeTranslatorError(503, "unavailable"))
+      self.assertGreaterEqual(delay, 0.0)
+      self.assertLessEqual(delay, min(10.0, 0.001 * (2 ** attempt)))
+
+    inner = _FailingTranslator([_HttpError(429, { "Retry-After": "0.01" })])
+    translator = self._translator(inner, max_retries=2)
+    self.assertEqual(translator.translate(["a"], "text/plain"), ["[fake] a"])
+    self.assertEqual(translator.stats()["throttled"], 1)
+
+  def test_adaptive_limit(self):
+    limit = _AdaptiveLimit(4)
+    self.assertEqual(limit.limit, 4)
+    limit.decrease()
+    self.assertEqual(limit.limit, 2)
+    limit.decrease()
+    limit.decrease()
+    self.assertEqual(limit.limit, 1)
+
+    # 每个窗口（约 limit 个成功请求）增加 1，不超过上限
+    limit.increase()
+    self.assertEqual(limit.limit, 2)
+    limit.increase()
+    limit.increase()
+    self.assertEqual(limit.limit, 2)
+    limit.increase()
+    self.assertEqual(limit.limit, 3)
+    for _ in range(20):
+      limit.increase()
+    self.assertEqual(limit.limit, 4)
+
+  def test_adaptive_limit_blocks(self):
+    limit = _AdaptiveLimit(1)
+    limit.acquire()
+    acquired = threading.Event()
+
+    def acquire():
+      limit.acquire()
+      acquired.set()
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    self.assertFalse(acquired.wait(0.05))
+    limit.release()
+    self.assertTrue(acquired.wait(1.0))
+    thread.join()
+
+  # 超过容量的一次请求在桶满时放行，透支的额度由后续请求等待偿还
+  def test_token_bucket_overdraft(self):
+    bucket = _TokenBucket(rate=100.0, capacity=10.0)
+    self.assertEqual(bucket._try_take(50), 0.0)
+    wait = bucket._try_take(1)
+    self.assertAlmostEqual(wait, 0.41, delta=0.02)
+    self.assertGreater(bucket._try_take(50), 0.4)
+
+    bucket = _TokenBucket(rate=100.0, capacity=10.0)
+    self.assertEqual(bucket._try_take(4), 0.0)
+    self.assertEqual(bucket._try_take(6), 0.0)
+    self.assertAlmostEqual(bucket._try_take(5), 0.05, delta=0.01)
+
+    self.assertIsNone(_TokenBucket.per_minute(None))
+    self.assertIsNone(_TokenBucket.per_minute(0))
+    bucket = _TokenBucket.per_minute(600)
+    self.assertEqual(bucket._capacity, 100.0)
+
+  def _translator(self, translator, max_retries: int) -> ThrottledTranslator:
+    throttled = ThrottledTranslator(translator, max_retries=max_retries, base_delay=0.001, max_concurrency=4)
+    self.addCleanup(throttled.close)
+    return throttled
+
+# 依次抛出 errors 中的异常，之后的请求成功
+class _FailingTranslator:
+  supports_async = True
+
+  def __init__(self, errors: list[Exception]):
+    self._errors: list[Exception] = list(errors)
+    self._translator = FakeTranslator()
+    self.requests: int = 0
+
+  def translate(self, text_list: list[str], mime_type: str):
+    self.requests += 1
+    if len(self._errors) > 0:
+      raise self._errors.pop(0)
+    return self._translator.translate(text_list, mime_type)
+
+  async def translate_async(self, text_list: list[str], mime_type: str):
+    return self.translate(text_list, mime_type)
+
+class _HttpResponse:
+  def __init__(self, status_code: int, headers: dict):
+    self.status_code: int = status_code
+    self.headers: dict = headers
+
+# 与 requests 的 HTTPError 相同，状态码与响应头在 response 上
+class _HttpError(Exception):
+  def __init__(self, status_code: int, headers: dict):
+    super().__init__(f"HTTP {status_code}")
+    self.response = _HttpResponse(status_code, headers)
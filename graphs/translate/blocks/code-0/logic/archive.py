@@ -0,0 +1,231 @@
+import io
+import os
+import sys
+import time
+import zlib
+import shutil
+import zipfile
+import unittest
+
+from collections import deque
+from typing import BinaryIO, Optional, Union
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# 已经压缩过的媒体，再用 deflate 压缩几乎没有收益，原样存储
+_StoredExtensions = frozenset((
+  ".jpg", ".jpeg", ".png", ".gif", ".webp", ".avif",
+  ".woff", ".woff2",
+  ".mp3", ".m4a", ".aac", ".ogg", ".oga", ".mp4", ".webm",
+  ".zip", ".gz",
+))
+
+# _write_compressed 直接使用的 ZipFile 内部属性，依赖 CPython zipfile 的实现细节
+_ZipFileInternals = ("_lock", "_seekable", "start_dir", "_writecheck", "_didModify", "fp", "filelist", "NameToInfo")
+
+_MimetypeName = "mimetype"
+_EpubMimetype = b"application/epub+zip"
+
+# 写出 EPub 压缩包。
+# mimetype 总是第一个成员且不压缩（OCF 规范要求）；图片、音视频等已压缩的媒体原样存储；
+# 其余成员（XHTML、CSS、OPF、NCX）交给线程池并行压缩（zlib 压缩时释放 GIL），调用方可以继续翻译下一章。
+# 成员按调用顺序写入，与原压缩包一致
+class ArchiveWriter:
+  def __init__(self, file: Union[str, BinaryIO], compress_level: int = 6, concurrency: Optional[int] = None):
+    if concurrency is None:
+      concurrency = os.cpu_count() or 1
+    self._zip = zipfile.ZipFile(file, "w")
+    _check_internals(self._zip)
+    self._compress_level: int = compress_level
+    self._max_pending: int = max(1, concurrency) * 4
+    self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    self._pending: deque[tuple[zipfile.ZipInfo, Future]] = deque()
+
+    mimetype_info = zipfile.ZipInfo(_MimetypeName, time.localtime(time.time())[:6])
+    mimetype_info.external_attr = 0o600 << 16
+    self._zip.writestr(mimetype_info, _EpubMimetype, compress_type=zipfile.ZIP_STORED)
+
+  def __enter__(self) -> "ArchiveWriter":
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  # info 为原压缩包中的 ZipInfo（保留时间与权限）或成员名。mimetype 已在开头写出，忽略
+  def write(self, info: Union[str, zipfile.ZipInfo], data: bytes):
+    target_info = self._target_info(info)
+    if target_info is None:
+      return
+    if self._is_stored(target_info):
+      self._write_stored(target_info, data)
+      return
+
+    future = self._executor.submit(_compress, data, self._compress_level)
+    self._pending.append((target_info, future))
+    self._flush(block=len(self._pending) > self._max_pending)
+
+  # 从文件对象写入。原样存储的成员按块拷贝，不整个读入内存
+  def copy(self, info: Union[str, zipfile.ZipInfo], source: BinaryIO):
+    target_info = self._target_info(info)
+    if target_info is None:
+      return
+    if not self._is_stored(target_info):
+      self.write(info, source.read())
+      return
+
+    self._flush(block=True)
+    with self._zip.open(target_info, "w") as target:
+      shutil.copyfileobj(source, target, 1024 * 1024)
+
+  def close(self):
+    try:
+      self._flush(block=True)
+    finally:
+      self._executor.shutdown(wait=True)
+      self._zip.close()
+
+  def _target_info(self, info: Union[str, zipfile.ZipInfo]) -> Optional[zipfile.ZipInfo]:
+    if isinstance(info, zipfile.ZipInfo):
+      target_info = zipfile.ZipInfo(info.filename, info.date_time)
+      target_info.external_attr = info.external_attr
+      target_info.file_size = info.file_size
+    else:
+      target_info = zipfile.ZipInfo(info, time.localtime(time.time())[:6])
+    if target_info.filename == _MimetypeName:
+      return None
+    if not target_info.external_attr:
+      target_info.external_attr = 0o600 << 16
+
+    if self._is_stored(target_info):
+      target_info.compress_type = zipfile.ZIP_STORED
+    else:
+      target_info.compress_type = zipfile.ZIP_DEFLATED
+    return target_info
+
+  def _is_stored(self, info: zipfile.ZipInfo) -> bool:
+    if self._compress_level == 0 or info.is_dir():
+      return True
+    _, extension = os.path.splitext(info.filename)
+    return extension.lower() in _StoredExtensions
+
+  def _write_stored(self, info: zipfile.ZipInfo, data: bytes):
+    self._flush(block=True)
+    self._zip.writestr(info, data)
+
+  # 按顺序写出已压缩完成的成员；block 为 True 时等待所有成员
+  def _flush(self, block: bool):
+    while len(self._pending) > 0:
+      info, future = self._pending[0]
+      if not block and not future.done():
+        break
+      self._pending.popleft()
+      crc, size, compressed = future.result()
+      self._write_compressed(info, crc, size, compressed)
+
+  # ZipFile 只能在写入时自己压缩，这里仿照 ZipFile.mkdir 直接写出本地文件头与压缩好的数据。
+  # 大小与 CRC 在写文件头之前已知，因此不需要数据描述符，不可 seek 的输出也适用
+  def _write_compressed(self, info: zipfile.ZipInfo, crc: int, size: int, compressed: bytes):
+    info.CRC = crc
+    info.file_size = size
+    info.compress_size = len(compressed)
+    zip64 = size > zipfile.ZIP64_LIMIT or len(compressed) > zipfile.ZIP64_LIMIT
+    zip_file = self._zip
+
+    with zip_file._lock:
+      if zip_file._seekable:
+        zip_file.fp.seek(zip_file.start_dir)
+      info.header_offset = zip_file.fp.tell()
+      zip_file._writecheck(info)
+      zip_file._didModify = True
+      zip_file.filelist.append(info)
+      zip_file.NameToInfo[info.filename] = info
+      zip_file.fp.write(info.FileHeader(zip64))
+      zip_file.fp.write(compressed)
+      zip_file.start_dir = zip_file.fp.tell()
+
+# zipfile 的内部实现变化时立即报错，而不是写出损坏的压缩包
+def _check_internals(zip_file: zipfile.ZipFile):
+  missing = [name for name in _ZipFileInternals if not hasattr(zip_file, name)]
+  if not hasattr(zipfile.ZipInfo, "FileHeader"):
+    missing.append("ZipInfo.FileHeader")
+  if len(missing) > 0:
+    zip_file.close()
+    raise RuntimeError(
+      f"ArchiveWriter can not write pre-compressed entries with the zipfile of Python {sys.version.split()[0]}, "
+      f"missing: {', '.join(missing)}"
+    )
+
+# 与 ZipFile 的 deflate 压缩相同：不带 zlib 头的原始 deflate 流
+def _compress(data: bytes, compress_level: int) -> tuple[int, int, bytes]:
+  compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15)
+  compressed = compressor.compress(data) + compressor.flush()
+  return zlib.crc32(data), len(data), compressed
+
+# run ``python graphs/translate/blocks/code-0/logic/archive.py``
+class _Test(unittest.TestCase):
+
+  def test_round_trip(self):
+    for compress_level in (0, 6):
+      for seekable in (True, False):
+        with self.subTest(compress_level=compress_level, seekable=seekable):
+          self._assert_round_trip(compress_level, seekable)
+
+  def test_missing_internals(self):
+    class _ZipFile(zipfile.ZipFile):
+      def __getattribute__(self, name: str):
+        if name == "_writecheck":
+          raise AttributeError(name)
+        return super().__getattribute__(name)
+
+    with self.assertRaises(RuntimeError):
+      _check_internals(_ZipFile(io.BytesIO(), "w"))
+
+  def _assert_round_trip(self, compress_level: int, seekable: bool):
+    members = [
+      ("META-INF/", b""),
+      ("META-INF/container.xml", b"<container/>" * 50),
+      ("OEBPS/text/chapter.xhtml", "<p>段落</p>".encode("utf-8") * 2000),
+      ("OEBPS/images/cover.jpg", os.urandom(4096)),
+      ("OEBPS/style.css", b"p { margin: 0; }" * 100),
+    ]
+    buffer = io.BytesIO()
+    output = buffer if seekable else _UnseekableWriter(buffer)
+
+    with ArchiveWriter(output, compress_level=compress_level, concurrency=2) as writer:
+      # 原压缩包里的 mimetype 会被忽略，不会写出第二份
+      writer.write("mimetype", b"application/epub+zip")
+      for name, data in members:
+        if name.endswith(".jpg"):
+          writer.copy(name, io.BytesIO(data))
+        else:
+          writer.write(name, data)
+
+    data = buffer.getvalue()
+    # OCF：mimetype 为第一个成员，不压缩，且本地文件头之后紧跟着它的内容
+    self.assertEqual(data[30:38], b"mimetype")
+    self.assertEqual(data[38:58], _EpubMimetype)
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+      self.assertIsNone(zip_file.testzip())
+      infos = zip_file.infolist()
+      self.assertEqual([info.filename for info in infos], ["mimetype"] + [name for name, _ in members])
+      self.assertEqual(infos[0].compress_type, zipfile.ZIP_STORED)
+      for name, content in members:
+        info = zip_file.getinfo(name)
+        self.assertEqual(zip_file.read(name), content)
+        if compress_level == 0 or name.endswith((".jpg", "/")):
+          self.assertEqual(info.compress_type, zipfile.ZIP_STORED, name)
+        else:
+          self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED, name)
+
+class _UnseekableWriter(io.RawIOBase):
+  def __init__(self, target: io.BytesIO):
+    self._target = target
+
+  def writable(self) -> bool:
+    return True
+
+  def write(self, data) -> int:
+    return self._target.write(data)
+
+if __name__ == "__main__":
+  unittest.main()
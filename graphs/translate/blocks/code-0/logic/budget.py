@@ -0,0 +1,115 @@
+import re
+import time
+import threading
+
+from typing import Callable
+
+_WidePattern = re.compile(r"[\u1100-\u11ff\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+
+# 粗略估计文字的 token 数：中日韩文字约每字一个 token，其余文字约每 4 个字符一个 token。
+# 只用于分组预算，不需要与接口的分词器完全一致
+def estimate_tokens(text: str) -> int:
+  wide = len(_WidePattern.findall(text))
+  return wide + (len(text) - wide + 3) // 4
+
+def budget_measure(unit: str) -> Callable[[str], int]:
+  if unit == "tokens":
+    return estimate_tokens
+  elif unit == "characters":
+    return len
+  else:
+    raise ValueError(f"invalid budget unit: {unit}")
+
+# 预算换算成单段文字的字符上限，过长的文字按它截断或切开。按 token 计时按西文的比例（约每 token 4 个字符）换算，
+# 使不超过预算的西文文字不会被截断
+def budget_characters(budget: int, unit: str) -> int:
+  if unit == "tokens":
+    return budget * 4
+  elif unit == "characters":
+    return budget
+  else:
+    raise ValueError(f"invalid budget unit: {unit}")
+
+# 每组请求的大小预算。adaptive 时根据请求的耗时与失败调整预算，使每秒翻译的量（预算单位 / 秒）最大：
+# 每收集 window 个请求评估一次，吞吐比上一轮高就沿同一方向继续调整，明显变差（超过 tolerance）则掉头；
+# 调整之前发出的请求按旧的大小分组，不计入下一轮的评估；
+# 请求失败（超时重试耗尽、载荷或上下文超限等）时立即减半。预算始终在 [minimum, maximum] 之间，
+# maximum 为接口的硬性上限，因此不会越过载荷或上下文的限制
+class GroupBudget:
+  def __init__(
+    self,
+    budget: int,
+    minimum: int,
+    maximum: int,
+    unit: str,
+    adaptive: bool = False,
+    window: int = 16,
+    step: float = 1.25,
+    tolerance: float = 0.05,
+  ):
+    self.unit: str = unit
+    self.measure: Callable[[str], int] = budget_measure(unit)
+    self._minimum: int = max(1, minimum)
+    self._maximum: int = max(self._minimum, maximum)
+    self._budget: float = min(max(budget, self._minimum), self._maximum)
+    self._adaptive: bool = adaptive
+    self._window: int = window
+    self._step: float = step
+    self._tolerance: float = tolerance
+    self._adjusted_at: float = time.perf_counter()
+    self._lock = threading.Lock()
+    self._direction: int = 1
+    self._previous_throughput: float = None
+    self._units: int = 0
+    self._seconds: float = 0.0
+    self._count: int = 0
+    self.adjustments: int = 0
+
+  @property
+  def budget(self) -> int:
+    return int(self._budget)
+
+  # begin 为请求开始的时刻（time.perf_counter）
+  def record(self, units: int, begin: float, seconds: float, succeeded: bool):
+    if not self._adaptive:
+      return
+    with self._lock:
+      if begin < self._adjusted_at:
+        return
+      if not succeeded:
+        self._direction = -1
+        self._previous_throughput = None
+        self._adjust(0.5)
+        return
+
+      self._units += units
+      self._seconds += seconds
+      self._count += 1
+      if self._count < self._window:
+        return
+
+      throughput = self._units / max(self._seconds, 1e-9)
+      if self._previous_throughput is not None and \
+         throughput < self._previous_throughput * (1 - self._tolerance):
+        self._direction = -self._direction
+      self._previous_throughput = throughput
+
+      if self._direction > 0:
+        self._adjust(self._step)
+      else:
+        self._adjust(1 / self._step)
+
+  def stats(self) -> dict:
+    return {
+      "unit": self.unit,
+      "budget": self.budget,
+      "adjustments": self.adjustments,
+    }
+
+  def _adjust(self, factor: float):
+    self._budget = min(max(self._budget * factor, self._minimum), self._maximum)
+    self._units = 0
+    self._seconds = 0.0
+    self._count = 0
+    self._adjusted_at = time.perf_counter()
+    self.adjustments += 1
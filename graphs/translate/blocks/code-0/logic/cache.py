@@ -0,0 +1,141 @@
+import re
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+from typing import Optional
+
+# 翻译记忆：以 (译者, 源语言, 目标语言, mime type, 规范化原文的哈希) 为键，把译文存在本地 SQLite 中。
+# 重跑同一本书、或者不同的书共享同样的版权页等样板文字时，命中的段落不必再次请求翻译接口
+class TranslationCache:
+  def __init__(self, path: str, max_size: int = 512 * 1024 * 1024):
+    folder_path = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder_path, exist_ok=True)
+
+    self.max_size: int = max_size
+    self.hits: int = 0
+    self.misses: int = 0
+    self.evictions: int = 0
+    self._lock = threading.Lock()
+    self._conn = sqlite3.connect(path, check_same_thread=False)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.execute("""
+      CREATE TABLE IF NOT EXISTS translations (
+        key TEXT PRIMARY KEY,
+        target TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        accessed_at REAL NOT NULL
+      )
+    """)
+    self._conn.execute("CREATE INDEX IF NOT EXISTS translations_accessed_at ON translations (accessed_at)")
+    self._conn.commit()
+    self._size: int = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM translations").fetchone()[0]
+
+  @property
+  def size(self) -> int:
+    return self._size
+
+  def get_list(self, scope: str, mime_type: str, text_list: list[str]) -> list[Optional[str]]:
+    keys = [self._key(scope, mime_type, text) for text in text_list]
+
+    with self._lock:
+      found = self._select(keys)
+      if len(found) > 0:
+        now = time.time()
+        self._conn.executemany(
+          "UPDATE translations SET accessed_at = ? WHERE key = ?",
+          [(now, key) for key in found.keys()],
+        )
+        self._conn.commit()
+
+      target_list = [found.get(key) for key in keys]
+      hits = len([x for x in target_list if x is not None])
+      self.hits += hits
+      self.misses += len(target_list) - hits
+
+    return target_list
+
+  # 只读查询，不更新访问时间与命中统计，用于试运行的估算
+  def peek_list(self, scope: str, mime_type: str, text_list: list[str]) -> list[Optional[str]]:
+    keys = [self._key(scope, mime_type, text) for text in text_list]
+    with self._lock:
+      found = self._select(keys)
+    return [found.get(key) for key in keys]
+
+  def put_list(self, scope: str, mime_type: str, text_list: list[str], target_list: list[str]):
+    now = time.time()
+    rows: dict[str, tuple] = {}
+
+    for text, target in zip(text_list, target_list):
+      # 空译文多半是接口漏掉了这一行，不能当作结果记住
+      if target == "":
+        continue
+      key = self._key(scope, mime_type, text)
+      rows[key] = (key, target, len(key) + len(target.encode("utf-8")), now)
+
+    if len(rows) == 0:
+      return
+
+    with self._lock:
+      for key, _, size, _ in rows.values():
+        row = self._conn.execute("SELECT size FROM translations WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+          self._size -= row[0]
+        self._size += size
+
+      self._conn.executemany(
+        "INSERT OR REPLACE INTO translations (key, target, size, accessed_at) VALUES (?, ?, ?, ?)",
+        list(rows.values()),
+      )
+      self._evict()
+      self._conn.commit()
+
+  def stats(self) -> dict:
+    return {
+      "hits": self.hits,
+      "misses": self.misses,
+      "evictions": self.evictions,
+      "size": self._size,
+    }
+
+  def close(self):
+    with self._lock:
+      self._conn.close()
+
+  def _select(self, keys: list[str]) -> dict[str, str]:
+    found: dict[str, str] = {}
+    # SQLite 单条语句的参数个数有上限，分批查询
+    for i in range(0, len(keys), 500):
+      batch = keys[i:i + 500]
+      placeholders = ",".join("?" * len(batch))
+      for key, target in self._conn.execute(
+        f"SELECT key, target FROM translations WHERE key IN ({placeholders})",
+        batch,
+      ):
+        found[key] = target
+    return found
+
+  def _evict(self):
+    # 超出容量时按最久未访问的顺序淘汰
+    while self._size > self.max_size:
+      rows = self._conn.execute(
+        "SELECT key, size FROM translations ORDER BY accessed_at ASC LIMIT 256"
+      ).fetchall()
+      if len(rows) == 0:
+        self._size = 0
+        break
+      removed_keys = []
+      for key, size in rows:
+        if self._size <= self.max_size:
+          break
+        removed_keys.append((key,))
+        self._size -= size
+      self._conn.executemany("DELETE FROM translations WHERE key = ?", removed_keys)
+      self.evictions += len(removed_keys)
+
+  def _key(self, scope: str, mime_type: str, text: str) -> str:
+    text = re.sub(r"\s+", " ", text).strip()
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"{scope}:{mime_type}:{digest}"
@@ -0,0 +1,121 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+from typing import Any, Optional
+
+# 断点续译：把已完成的翻译记录在日志里。进程中途退出后，用相同的输入文件与选项再次运行，
+# 会跳过已完成的章节（spine）与章节内已完成的分组，直接复用之前的译文
+class Checkpoint:
+  def __init__(self, folder_path: str, file_path: str, options: dict):
+    hash = hashlib.sha256()
+    with open(file_path, "rb") as file:
+      for chunk in iter(lambda: file.read(1024 * 1024), b""):
+        hash.update(chunk)
+    hash.update(json.dumps(options, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+
+    self.path: str = os.path.join(folder_path, hash.hexdigest())
+    self._journal_path: str = os.path.join(self.path, "journal.jsonl")
+    self._lock = threading.Lock()
+    self._values: dict[str, Any] = {}
+    self._spines: dict[str, str] = {}
+    self._spine_manifests: dict[str, dict] = {}
+
+    os.makedirs(self.path, exist_ok=True)
+
+    if os.path.exists(self._journal_path):
+      self._load()
+
+    self._journal = open(self._journal_path, "a", encoding="utf-8")
+
+  @property
+  def is_resumed(self) -> bool:
+    return len(self._values) > 0 or len(self._spines) > 0
+
+  def get(self, key: str) -> Optional[Any]:
+    with self._lock:
+      return self._values.get(key)
+
+  def put(self, key: str, value: Any):
+    with self._lock:
+      self._values[key] = value
+      self._append({ "kind": "value", "key": key, "value": value })
+
+  def scope(self, prefix: str) -> "CheckpointScope":
+    return CheckpointScope(self, prefix)
+
+  def spine_content(self, href: str) -> Optional[str]:
+    with self._lock:
+      file_name = self._spines.get(href)
+    if file_name is None:
+      return None
+    with open(os.path.join(self.path, file_name), "r", encoding="utf-8") as file:
+      return file.read()
+
+  # 增量重译清单中这个章节的段落（见 TranslationManifest.entries），没有随章节保存时为 None
+  def spine_manifest(self, href: str) -> Optional[dict]:
+    with self._lock:
+      return self._spine_manifests.get(href)
+
+  def complete_spine(self, href: str, content: str, manifest_entries: Optional[dict] = None):
+    file_name = hashlib.sha256(href.encode("utf-8")).hexdigest() + ".xhtml"
+    file_path = os.path.join(self.path, file_name)
+    temp_path = f"{file_path}.tmp"
+
+    # 先完整写入译文再记日志，保证日志里出现的章节一定有完整的文件
+    with open(temp_path, "w", encoding="utf-8") as file:
+      file.write(content)
+      file.flush()
+      os.fsync(file.fileno())
+    os.replace(temp_path, file_path)
+
+    record = { "kind": "spine", "href": href, "file": file_name }
+    if manifest_entries is not None:
+      record["manifest"] = manifest_entries
+    with self._lock:
+      self._spines[href] = file_name
+      if manifest_entries is not None:
+        self._spine_manifests[href] = manifest_entries
+      self._append(record)
+
+  def close(self):
+    with self._lock:
+      self._journal.close()
+
+  def clear(self):
+    self.close()
+    shutil.rmtree(self.path, ignore_errors=True)
+
+  def _load(self):
+    with open(self._journal_path, "r", encoding="utf-8") as file:
+      for line in file:
+        try:
+          record = json.loads(line)
+        except json.JSONDecodeError:
+          # 进程崩溃时最后一行可能没写完，丢弃即可
+          continue
+        if record["kind"] == "value":
+          self._values[record["key"]] = record["value"]
+        elif record["kind"] == "spine":
+          self._spines[record["href"]] = record["file"]
+          if "manifest" in record:
+            self._spine_manifests[record["href"]] = record["manifest"]
+
+  def _append(self, record: dict):
+    self._journal.write(json.dumps(record, ensure_ascii=False))
+    self._journal.write("\n")
+    self._journal.flush()
+    os.fsync(self._journal.fileno())
+
+class CheckpointScope:
+  def __init__(self, checkpoint: Checkpoint, prefix: str):
+    self._checkpoint = checkpoint
+    self._prefix = prefix
+
+  def get(self, key: Any) -> Optional[Any]:
+    return self._checkpoint.get(f"{self._prefix}:{key}")
+
+  def put(self, key: Any, value: Any):
+    self._checkpoint.put(f"{self._prefix}:{key}", value)
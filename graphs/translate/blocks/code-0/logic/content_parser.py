@@ -1,97 +1,121 @@
 import os
+import zipfile
+import posixpath
+
+from typing import Callable, Optional
 from lxml import etree
 from lxml.etree import QName
 from .utils import escape_ascii
 
+# manifest 中的一项。路径在第一次访问时解析并缓存
 class Spine:
-  def __init__(self, folder_path, base_path, item):
-    self._folder_path = folder_path
-    self._base_path = base_path
+  def __init__(self, resolve_path: Callable[[str], str], item):
+    self._resolve_path = resolve_path
+    self._path: Optional[str] = None
+    self.id = item.get("id")
     self.href = item.get("href")
     self.media_type = item.get("media-type")
 
   @property
   def path(self):
-    path = os.path.join(self._base_path, self.href)
-    path = os.path.abspath(path)
-
-    if os.path.exists(path):
-      return path
-
-    path = os.path.join(self._folder_path, self.href)
-    path = os.path.abspath(path)
-    return path
+    if self._path is None:
+      self._path = self._resolve_path(self.href)
+    return self._path
+
+# content.opf 中 manifest 与 spine 的索引，只在第一次使用时扫描一次
+class _ManifestIndex:
+  def __init__(self, resolve_path: Callable[[str], str], manifest, spine):
+    self.id_dict: dict[str, Spine] = {}
+    self.href_dict: dict[str, Spine] = {}
+    self.media_type_dict: dict[str, list[Spine]] = {}
+
+    for child in manifest.iterchildren():
+      if not isinstance(child.tag, str):
+        continue
+      item = Spine(resolve_path=resolve_path, item=child)
+      if item.id is not None:
+        self.id_dict[item.id] = item
+      if item.href is not None:
+        self.href_dict[item.href] = item
+      self.media_type_dict.setdefault(item.media_type, []).append(item)
+
+    # 重复的 idref 以最后一次出现的位置为准
+    idref_dict: dict[str, int] = {}
+    for index, child in enumerate(spine.iterchildren()):
+      idref_dict[child.get("idref")] = index
+
+    self.spines: list[Spine] = []
+    for id, _ in sorted(idref_dict.items(), key=lambda x: x[1]):
+      item = self.id_dict.get(id)
+      if item is not None:
+        self.spines.append(item)
 
 class EpubContent:
   def __init__(self, path: str):
     self.folder_path = path
     self._content_path = self._find_content_path(path)
-    self._tree = etree.parse(self._content_path)
+    self._load(etree.parse(self._content_path))
+
+  def _load(self, tree):
+    self._tree = tree
     self._namespaces = { "ns": self._tree.getroot().nsmap.get(None) }
     self._spine = self._tree.xpath("//ns:spine", namespaces=self._namespaces)[0]
     self._metadata = self._tree.xpath("//ns:metadata", namespaces=self._namespaces)[0]
     self._manifest = self._tree.xpath("//ns:manifest", namespaces=self._namespaces)[0]
+    self._dc_namespaces = { "dc": self._metadata.nsmap.get("dc") }
+    self._invalidate()
+
+  # 修改 content.opf 的树之后调用，丢弃基于旧树建立的索引与节点缓存
+  def _invalidate(self):
+    self._index: Optional[_ManifestIndex] = None
+    self._title_doms: Optional[list] = None
+    self._creator_doms: Optional[list] = None
 
   def save(self):
     self._tree.write(self._content_path, pretty_print=True)
 
   def _find_content_path(self, path: str) -> str:
     root = etree.parse(os.path.join(path, "META-INF", "container.xml")).getroot()
-    rootfile = root.xpath(
-      "//ns:container/ns:rootfiles/ns:rootfile", 
-      namespaces={ "ns": root.nsmap.get(None) },
-    )[0]
-    full_path = rootfile.attrib["full-path"]
+    full_path = _find_rootfile_path(root)
     joined_path = os.path.join(path, full_path)
 
     return os.path.abspath(joined_path)
 
+  def _resolve_path(self, href: str) -> str:
+    base_path = os.path.dirname(self._content_path)
+    path = os.path.join(base_path, href)
+    path = os.path.abspath(path)
+
+    if os.path.exists(path):
+      return path
+
+    path = os.path.join(self.folder_path, href)
+    path = os.path.abspath(path)
+    return path
+
   @property
   def ncx_path(self):
-    ncx_dom = self._manifest.find(".//*[@id=\"ncx\"]")
-    if not ncx_dom is None:
-      href_path = ncx_dom.get("href")
-      base_path = os.path.dirname(self._content_path)
-      path = os.path.join(base_path, href_path)
-      path = os.path.abspath(path)
-
-      if os.path.exists(path):
-        return path
-      
-      path = os.path.join(self.folder_path, path)
-      path = os.path.abspath(path)
-      return path
+    ncx_item = self.get_item("ncx")
+    if not ncx_item is None:
+      return ncx_item.path
 
   @property
-  def spines(self):
-    idref_dict = {}
-    index = 0
-  
-    for child in self._spine.iterchildren():
-      id = child.get("idref")
-      idref_dict[id] = index
-      index += 1
-
-    items = [None for _ in range(index)]
-    spines = []
-
-    for child in self._manifest.iterchildren():
-      id = child.get("id")
-      if id in idref_dict:
-        index = idref_dict[id]
-        items[index] = child
+  def spines(self) -> list[Spine]:
+    return list(self._get_index().spines)
 
-    base_path = os.path.dirname(self._content_path)
-    
-    for item in items:
-      if item is not None:
-        spines.append(Spine(
-          folder_path=self.folder_path,
-          base_path=base_path,
-          item=item,
-        ))
+  def get_item(self, id: str) -> Optional[Spine]:
+    return self._get_index().id_dict.get(id)
 
-    return spines
+  def get_item_by_href(self, href: str) -> Optional[Spine]:
+    return self._get_index().href_dict.get(href)
+
+  def items_of(self, media_type: str) -> list[Spine]:
+    return list(self._get_index().media_type_dict.get(media_type, []))
+
+  def _get_index(self) -> _ManifestIndex:
+    if self._index is None:
+      self._index = _ManifestIndex(self._resolve_path, self._manifest, self._spine)
+    return self._index
 
   @property
   def title(self):
@@ -107,15 +131,11 @@ class EpubContent:
       title_dom.text = escape_ascii(title)
 
   def _get_title(self):
-    titles = self._metadata.xpath(
-      "./dc:title", 
-      namespaces={
-        "dc": self._metadata.nsmap.get("dc"),
-      },
-    )
-    if len(titles) == 0:
+    if self._title_doms is None:
+      self._title_doms = self._metadata.xpath("./dc:title", namespaces=self._dc_namespaces)
+    if len(self._title_doms) == 0:
       return None
-    return titles[0]
+    return self._title_doms[0]
 
   @property
   def authors(self) -> list[str]:
@@ -142,10 +162,44 @@ class EpubContent:
     for creator_dom in creator_doms:
       parent_dom.remove(creator_dom)
 
+    self._creator_doms = None
+
   def _get_creators(self):
-    return self._metadata.xpath(
-      "./dc:creator", 
-      namespaces={
-        "dc": self._metadata.nsmap.get("dc"),
-      },
-    )
+    if self._creator_doms is None:
+      self._creator_doms = self._metadata.xpath("./dc:creator", namespaces=self._dc_namespaces)
+    return self._creator_doms
+
+# 直接读取 EPub 压缩包而不解压。路径均为压缩包内的成员名，而不是文件系统路径
+class ArchiveEpubContent(EpubContent):
+  def __init__(self, zip_file: zipfile.ZipFile):
+    self.folder_path = ""
+    self._names = set(zip_file.namelist())
+    root = etree.fromstring(zip_file.read("META-INF/container.xml"))
+    self._content_path = _find_rootfile_path(root)
+    self._load(etree.fromstring(zip_file.read(self._content_path)).getroottree())
+
+  @property
+  def content_path(self) -> str:
+    return self._content_path
+
+  def save(self):
+    pass
+
+  def to_bytes(self) -> bytes:
+    return etree.tostring(self._tree, pretty_print=True)
+
+  def _resolve_path(self, href: str) -> str:
+    base_path = posixpath.dirname(self._content_path)
+    path = posixpath.normpath(posixpath.join(base_path, href))
+
+    if path in self._names:
+      return path
+
+    return posixpath.normpath(href)
+
+def _find_rootfile_path(root) -> str:
+  rootfile = root.xpath(
+    "//ns:container/ns:rootfiles/ns:rootfile", 
+    namespaces={ "ns": root.nsmap.get(None) },
+  )[0]
+  return rootfile.attrib["full-path"]
@@ -0,0 +1,70 @@
+import math
+
+from typing import Optional
+
+# 试运行的汇总：各章节会发出的请求数与字数，以及按并发与限流估算的耗时和费用。
+# 章节依次翻译，章节内的分组同时发出，因此每个章节大约需要 ceil(请求数 / 并发) 轮，每轮耗时 latency 秒；
+# 设置了限流时，总耗时不少于按配额发完所有请求与字数所需的时间
+class CostEstimate:
+  def __init__(
+    self,
+    concurrency: int = 1,
+    requests_per_minute: Optional[int] = None,
+    characters_per_minute: Optional[int] = None,
+    latency: float = 2.0,
+    price_per_million_characters: Optional[float] = None,
+  ):
+    self._concurrency: int = max(1, concurrency)
+    self._requests_per_minute: Optional[int] = requests_per_minute
+    self._characters_per_minute: Optional[int] = characters_per_minute
+    self._latency: float = latency
+    self._price_per_million_characters: Optional[float] = price_per_million_characters
+    self._pages: list[dict] = []
+
+  # page 为 Translator.estimate_page / estimate_pages / estimate_texts 的返回值
+  def add(self, page: dict):
+    self._pages.append(page)
+
+  def summary(self) -> dict:
+    requests: list[int] = []
+    rounds = 0
+    spines = []
+
+    for page in self._pages:
+      page_requests = page["requests"]
+      requests.extend(page_requests)
+      rounds += math.ceil(len(page_requests) / self._concurrency)
+      spines.append({
+        "file": page["file"],
+        "paragraphs": page["paragraphs"],
+        **_request_stats(page_requests),
+        "overlap_characters": page["overlap_characters"],
+        "context_characters": page["context_characters"],
+      })
+
+    summary = _request_stats(requests)
+    summary["overlap_characters"] = sum(page["overlap_characters"] for page in self._pages)
+    summary["context_characters"] = sum(page["context_characters"] for page in self._pages)
+    summary["seconds"] = self._seconds(rounds, summary["requests"], summary["characters"])
+    if self._price_per_million_characters is not None:
+      summary["cost"] = summary["characters"] * self._price_per_million_characters / 1000000
+    summary["spines"] = spines
+    return summary
+
+  def _seconds(self, rounds: int, requests: int, characters: int) -> float:
+    seconds = rounds * self._latency
+    if self._requests_per_minute is not None:
+      seconds = max(seconds, requests * 60 / self._requests_per_minute)
+    if self._characters_per_minute is not None:
+      seconds = max(seconds, characters * 60 / self._characters_per_minute)
+    return seconds
+
+# characters 为发给接口的总字数（计费字数），包括重叠段落与 context 模式的上下文
+def _request_stats(requests: list[int]) -> dict:
+  characters = sum(requests)
+  return {
+    "requests": len(requests),
+    "characters": characters,
+    "max_request_characters": max(requests, default=0),
+    "mean_request_characters": characters / len(requests) if len(requests) > 0 else 0,
+  }
@@ -0,0 +1,43 @@
+import asyncio
+import threading
+
+from typing import Any, Coroutine
+from concurrent.futures import Future
+
+# 在后台线程中运行一个常驻的事件循环，同步代码通过 submit / run 把协程交给它执行。
+# 同时在途的协程数由信号量限制，数百个请求也只占用这一个线程；
+# 异步客户端（gRPC、httpx）绑定在这个循环上，在整本书的翻译过程中复用
+class EventLoopThread:
+  def __init__(self, max_in_flight: int):
+    self._max_in_flight: int = max(1, max_in_flight)
+    self._semaphore: asyncio.Semaphore = None
+    self._loop = asyncio.new_event_loop()
+    self._thread = threading.Thread(
+      target=self._run_forever,
+      name="translator-event-loop",
+      daemon=True,
+    )
+    self._thread.start()
+
+  # 提交一个受在途数量限制的协程，立即返回 concurrent.futures.Future
+  def submit(self, coroutine: Coroutine) -> Future:
+    return asyncio.run_coroutine_threadsafe(self._limited(coroutine), self._loop)
+
+  # 执行一个不受限制的协程（例如关闭客户端）并等待结果
+  def run(self, coroutine: Coroutine) -> Any:
+    return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+  def close(self):
+    self._loop.call_soon_threadsafe(self._loop.stop)
+    self._thread.join()
+    self._loop.close()
+
+  def _run_forever(self):
+    asyncio.set_event_loop(self._loop)
+    self._loop.run_forever()
+
+  async def _limited(self, coroutine: Coroutine) -> Any:
+    if self._semaphore is None:
+      self._semaphore = asyncio.Semaphore(self._max_in_flight)
+    async with self._semaphore:
+      return await coroutine
@@ -0,0 +1,129 @@
+import re
+import unittest
+
+from typing import Optional
+
+_UrlPattern = re.compile(r"^(?:(?:https?|ftp)://|www\.)\S+$|^[\w.+-]+@[\w-]+(?:\.[\w-]+)+$", re.IGNORECASE)
+_RomanPattern = re.compile(r"^M{0,4}(?:CM|CD|D?C{0,3})(?:XC|XL|L?X{0,3})(?:IX|IV|V?I{0,3})[.)]?$")
+_CodePattern = re.compile(r"^\s*(?:<p[^>]*>\s*)?<(code|kbd|samp|tt|pre)\b[^>]*>.*</\1>\s*(?:</p>\s*)?$", re.DOTALL)
+_MathPattern = re.compile(r"^\s*(?:<p[^>]*>\s*)?<math\b.*</math>\s*(?:</p>\s*)?$", re.DOTALL)
+_LetterPattern = re.compile(r"[^\W\d_]")
+_WordPattern = re.compile(r"[A-Za-zÀ-ɏ]{2,}")
+
+# 每种语言使用的文字（书写系统）。未列出的语言按拉丁字母处理
+_LanguageScripts: dict[str, frozenset] = {
+  "zh": frozenset(("han",)),
+  "ja": frozenset(("han", "kana")),
+  "ko": frozenset(("hangul", "han")),
+  "ru": frozenset(("cyrillic",)),
+  "uk": frozenset(("cyrillic",)),
+  "el": frozenset(("greek",)),
+  "ar": frozenset(("arabic",)),
+}
+
+# 在请求翻译接口之前，于本地识别不需要翻译的段落：纯数字与页码、网址、罗马数字、代码、公式，
+# 以及已经是目标语言的文字。学术书籍的脚注、参考文献与索引中这类段落占比很高
+class ParagraphFilter:
+  def __init__(self, source_language_code: str, target_language_code: str):
+    self._source_scripts = _language_scripts(source_language_code)
+    self._target_scripts = _language_scripts(target_language_code)
+
+  # 返回不需要翻译的原因，需要翻译时返回 None。text 为去掉格式的文字，html 为段落的 HTML（若有）
+  def classify(self, text: str, html: Optional[str] = None) -> Optional[str]:
+    stripped = text.strip()
+
+    if html is not None:
+      if _MathPattern.match(html):
+        return "math"
+      if _CodePattern.match(html):
+        return "code"
+
+    if _LetterPattern.search(stripped) is None:
+      return "numeric"
+    if _UrlPattern.match(stripped):
+      return "url"
+    if _RomanPattern.match(stripped) or (stripped.islower() and _RomanPattern.match(stripped.upper())):
+      return "roman"
+
+    scripts = _text_scripts(stripped)
+    if scripts == { "latin" } and _WordPattern.search(stripped) is None:
+      # 只有单个字母的变量与运算符号，例如 x = 2y + 1
+      return "math"
+    if self._source_scripts != self._target_scripts and \
+       scripts <= self._target_scripts and \
+       not scripts <= self._source_scripts:
+      return "target_language"
+
+    return None
+
+def _language_scripts(language_code: str) -> frozenset:
+  language = language_code.split("-")[0].lower()
+  return _LanguageScripts.get(language, frozenset(("latin",)))
+
+def _text_scripts(text: str) -> set[str]:
+  scripts = set()
+  for char in _LetterPattern.findall(text):
+    scripts.add(_char_script(ord(char)))
+  return scripts
+
+def _char_script(code: int) -> str:
+  if code <= 0x024F:
+    return "latin"
+  elif 0x0370 <= code <= 0x03FF:
+    return "greek"
+  elif 0x0400 <= code <= 0x04FF:
+    return "cyrillic"
+  elif 0x0600 <= code <= 0x06FF:
+    return "arabic"
+  elif 0x3040 <= code <= 0x30FF:
+    return "kana"
+  elif 0x3400 <= code <= 0x4DBF or 0x4E00 <= code <= 0x9FFF or 0xF900 <= code <= 0xFAFF:
+    return "han"
+  elif 0xAC00 <= code <= 0xD7AF or 0x1100 <= code <= 0x11FF:
+    return "hangul"
+  elif 0x1E00 <= code <= 0x1EFF:
+    return "latin"
+  else:
+    return "other"
+
+# run ``python graphs/translate/blocks/code-0/logic/filter.py``
+class _Test(unittest.TestCase):
+
+  def test_numeric_and_url(self):
+    filter = ParagraphFilter("en", "zh-CN")
+    self.assertEqual(filter.classify("123"), "numeric")
+    self.assertEqual(filter.classify(" 12–15. "), "numeric")
+    self.assertEqual(filter.classify("https://example.com/a?b=1"), "url")
+    self.assertEqual(filter.classify("someone@example.org"), "url")
+
+  def test_roman(self):
+    filter = ParagraphFilter("en", "zh-CN")
+    for text in ("IV", "XII.", "xiv", "MCMXCIV", "ix)"):
+      self.assertEqual(filter.classify(text), "roman", text)
+    # 空串也能匹配罗马数字的正则，但没有字母的文字先被归为 numeric
+    self.assertEqual(filter.classify(""), "numeric")
+    for text in ("I think so.", "Mix", "CIVIL", "Did"):
+      self.assertIsNone(filter.classify(text), text)
+
+  def test_math(self):
+    filter = ParagraphFilter("en", "zh-CN")
+    self.assertEqual(filter.classify("x = 2y + 1"), "math")
+    self.assertEqual(filter.classify("a + b = c"), "math")
+    self.assertIsNone(filter.classify("x is a variable"))
+    self.assertEqual(filter.classify("E = mc2", "<p><math><mi>E</mi></math></p>"), "math")
+    self.assertEqual(filter.classify("print(x)", "<p><code>print(x)</code></p>"), "code")
+    self.assertIsNone(filter.classify("Use print(x) here", "<p>Use <code>print(x)</code> here</p>"))
+
+  def test_target_language(self):
+    filter = ParagraphFilter("en", "zh-CN")
+    self.assertEqual(filter.classify("这一段已经是中文。"), "target_language")
+    self.assertIsNone(filter.classify("混合 mixed 文字"))
+    self.assertEqual(ParagraphFilter("en", "ja").classify("ひらがなと漢字"), "target_language")
+    self.assertEqual(ParagraphFilter("zh", "en").classify("Already English text."), "target_language")
+    self.assertEqual(ParagraphFilter("ru", "en").classify("Already English text."), "target_language")
+    self.assertIsNone(ParagraphFilter("ru", "en").classify("Текст на русском"))
+    # 源语言与目标语言使用相同的文字时无法区分，一律翻译
+    self.assertIsNone(ParagraphFilter("fr", "en").classify("Already English text."))
+
+if __name__ == "__main__":
+  unittest.main()
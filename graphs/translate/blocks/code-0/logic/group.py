@@ -1,5 +1,6 @@
 import io
 
+from typing import Callable, Optional
 from .paragraph_sliter import split_paragraph
 
 class Paragraph:
@@ -7,34 +8,52 @@ class Paragraph:
     self.text: str = text
     self.index: int = index
 
+# 段落的拆分（max_paragraph_len、按 max_text_len 截断或切开过长的文字）以字符计，max_text_len 默认与 max_group_len 相同；
+# 分组的大小以 measure 计（默认为字符数，也可以是估计的 token 数），上限为 max_group_len，
+# 调用时可以用 max_group_len 参数临时覆盖，用于动态调整的分组预算
 class ParagraphsGroup:
-  def __init__(self, max_paragraph_len: int, max_group_len: int):
+  def __init__(
+    self,
+    max_paragraph_len: int,
+    max_group_len: int,
+    overlap: int = 2,
+    measure: Callable[[str], int] = len,
+    max_text_len: Optional[int] = None,
+  ):
     self.max_paragraph_len: int = max_paragraph_len
     self.max_group_len: int = max_group_len
+    self.max_text_len: int = max_text_len if max_text_len is not None else max_group_len
+    self.overlap: int = overlap
+    self.measure: Callable[[str], int] = measure
 
-  def split_text_list(self, text_list: list[str]) -> list[list[str]]:
+  def split_text_list(self, text_list: list[str], max_group_len: Optional[int] = None) -> list[list[str]]:
+    if max_group_len is None:
+      max_group_len = self.max_group_len
     splited_text_list: list[list[str]] = []
     current_text_list: list[str] = []
     current_len = 0
 
     for text in text_list:
-      if len(text) > self.max_group_len:
-        text = text[:self.max_group_len]
+      if len(text) > self.max_text_len:
+        text = text[:self.max_text_len]
 
-      if current_len + len(text) > self.max_group_len:
+      text_len = self.measure(text)
+      if current_len + text_len > max_group_len:
         splited_text_list.append(current_text_list)
         current_text_list = []
         current_len = 0
       
       current_text_list.append(text)
-      current_len += len(text)
+      current_len += text_len
 
     if len(current_text_list) > 0:
       splited_text_list.append(current_text_list)
 
     return splited_text_list
 
-  def split_paragraphs(self, text_list: list[str]) -> list[list[Paragraph]]:
+  def split_paragraphs(self, text_list: list[str], max_group_len: Optional[int] = None) -> list[list[Paragraph]]:
+    if max_group_len is None:
+      max_group_len = self.max_group_len
     splited_paragraph_list: list[Paragraph] = []
 
     for index, text in enumerate(text_list):
@@ -46,20 +65,21 @@ class ParagraphsGroup:
     current_paragraph_list: list[Paragraph] = []
 
     for paragraph in splited_paragraph_list:
-      if len(current_paragraph_list) > 0 and sum_len + len(paragraph.text) > self.max_group_len:
+      paragraph_len = self.measure(paragraph.text)
+      if len(current_paragraph_list) > 0 and sum_len + paragraph_len > max_group_len:
         grouped_paragraph_list.append(current_paragraph_list)
         sum_len = 0
         self_paragraphs_count = 0
 
-        # 确保分组中有首尾 2 段分别与上一组、下一组重复，以让翻译具有一定上下文，增强翻译准确性
-        if len(current_paragraph_list) <= 2:
+        # 确保分组中有首尾 overlap 段分别与上一组、下一组重复，以让翻译具有一定上下文，增强翻译准确性
+        if self.carried_overlap(current_paragraph_list) == 0:
           current_paragraph_list = []
         else:
-          current_paragraph_list = current_paragraph_list[-2:]
+          current_paragraph_list = current_paragraph_list[-self.overlap:]
           for cell in current_paragraph_list:
-            sum_len += len(cell.text)
+            sum_len += self.measure(cell.text)
 
-      sum_len += len(paragraph.text)
+      sum_len += paragraph_len
       self_paragraphs_count += 1
       current_paragraph_list.append(paragraph)
 
@@ -68,6 +88,12 @@ class ParagraphsGroup:
 
     return grouped_paragraph_list
 
+  # 该分组末尾有多少段会在下一组开头重复出现
+  def carried_overlap(self, paragraph_list: list[Paragraph]) -> int:
+    if self.overlap <= 0 or len(paragraph_list) <= self.overlap:
+      return 0
+    return self.overlap
+
   def _collect_text(self, index: int, text: str, splited_paragraph_list: list[Paragraph]):
     if len(text) <= self.max_paragraph_len:
       splited_paragraph_list.append(Paragraph(text, index))
@@ -90,14 +116,15 @@ class ParagraphsGroup:
           buffer.close()
           buffer = io.StringIO()
           buffer_len = 0
-        while len(cell) > self.max_group_len:
+        while len(cell) > self.max_text_len:
           splited_paragraph_list.append(Paragraph(
-            text=cell[:self.max_group_len], 
+            text=cell[:self.max_text_len], 
             index=index,
           ))
-          cell = cell[self.max_group_len:]
+          cell = cell[self.max_text_len:]
         if len(cell) > 0:
           buffer.write(cell)
+          buffer_len += len(cell)
 
     if buffer_len > 0:
         buffer.flush()
@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+import threading
+
+from typing import Optional
+
+_Version = 1
+
+# 增量重译：译文旁保存一份清单，记录每个章节中每段原文（以内容的哈希标识）对应的译文。
+# 出版社发布修订版后再次翻译，内容未变的段落直接取用清单中的译文，只有新增或改动的段落才发给翻译接口。
+# 段落按内容而不是位置匹配，插入或删除段落不影响其余段落的复用
+class TranslationManifest:
+  def __init__(self, path: str, scope: str, root: Optional[str] = None):
+    self.path: str = path
+    self.root: Optional[str] = root
+    self._scope: str = scope
+    self._lock = threading.Lock()
+    self._previous: dict[str, str] = {}
+    self._previous_files: dict[str, dict[str, list]] = {}
+    self._files: dict[str, dict[str, list]] = {}
+    self.reused_paragraphs: int = 0
+    self.reused_characters: int = 0
+
+    if os.path.exists(path):
+      self._load()
+
+  @property
+  def previous_size(self) -> int:
+    return len(self._previous)
+
+  def lookup(self, source_text: str) -> Optional[str]:
+    target_text = self._previous.get(_hash(source_text))
+    if target_text is not None:
+      with self._lock:
+        self.reused_paragraphs += 1
+        self.reused_characters += len(source_text)
+    return target_text
+
+  def record(self, file_path: str, index_list: list[int], source_text_list: list[str], target_text_list: list[str]):
+    file_path = self._relative_path(file_path)
+    with self._lock:
+      entries = self._files.setdefault(file_path, {})
+      for i, index in enumerate(index_list):
+        source_text = source_text_list[i]
+        target_text = target_text_list[i]
+        if source_text.strip() == "" or target_text == "":
+          continue
+        # 同一段落可能被拆成多块，它们共用段落序号
+        entries.setdefault(str(index), []).append([_hash(source_text), target_text])
+
+  # 本次运行记录的一个章节的段落。断点续译时随章节一起保存在断点中，见 restore
+  def entries(self, file_path: str) -> dict[str, list]:
+    file_path = self._relative_path(file_path)
+    with self._lock:
+      return dict(self._files.get(file_path, {}))
+
+  # 从断点恢复的章节不会再经过翻译，用断点中保存的段落补上它在清单中的记录；
+  # 断点中没有保存时（例如断点由未开启 incremental 的运行留下），沿用上一份清单中这个章节的段落
+  def restore(self, file_path: str, entries: Optional[dict[str, list]]):
+    file_path = self._relative_path(file_path)
+    with self._lock:
+      if entries is None:
+        entries = self._previous_files.get(file_path)
+      if entries is not None:
+        self._files[file_path] = dict(entries)
+
+  # 原子地写出本次运行的清单：只包含本次出现过的段落，已删除的段落不会一直留在清单里
+  def save(self):
+    with self._lock:
+      data = {
+        "version": _Version,
+        "scope": self._scope,
+        "files": self._files,
+      }
+    folder_path = os.path.dirname(self.path)
+    if folder_path != "":
+      os.makedirs(folder_path, exist_ok=True)
+    temp_path = f"{self.path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+      json.dump(data, file, ensure_ascii=False)
+    os.replace(temp_path, self.path)
+
+  def stats(self) -> dict:
+    return {
+      "previous_paragraphs": len(self._previous),
+      "reused_paragraphs": self.reused_paragraphs,
+      "reused_characters": self.reused_characters,
+    }
+
+  def _load(self):
+    try:
+      with open(self.path, "r", encoding="utf-8") as file:
+        data = json.load(file)
+    except (OSError, ValueError) as e:
+      print(f"Ignore unreadable translation manifest {self.path}: {e}")
+      return
+
+    # 翻译接口、语言或格式不同的清单不能复用
+    if data.get("version") != _Version or data.get("scope") != self._scope:
+      print(f"Ignore translation manifest {self.path}: created with different options")
+      return
+
+    self._previous_files = data.get("files", {})
+    for entries in self._previous_files.values():
+      for pieces in entries.values():
+        for hash, target_text in pieces:
+          self._previous[hash] = target_text
+
+  def _relative_path(self, file_path: str) -> str:
+    if self.root is not None:
+      return os.path.relpath(file_path, self.root)
+    return file_path
+
+def _hash(text: str) -> str:
+  return hashlib.sha256(text.encode("utf-8")).hexdigest()
@@ -0,0 +1,196 @@
+import os
+import time
+import bisect
+import shutil
+import pstats
+import cProfile
+import tempfile
+import unittest
+import threading
+import contextlib
+
+from collections import deque
+from typing import Callable, Optional
+
+# Python 3.12 起 cProfile 基于 sys.monitoring，整个进程同时只能启用一个 Profile，之前的版本只采样当前线程且不能嵌套。
+# 因此整个进程同一时刻只采样一个阶段，其他线程中同时进行的阶段与嵌套的阶段只计时，不采样
+_ProfileLock = threading.Lock()
+
+# 请求耗时直方图的桶上界（秒），最后一个桶收纳其余所有请求
+_LatencyBuckets: tuple = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+# 记录流水线各阶段的耗时、每个翻译接口的请求数与字符数、请求耗时分布。
+# 进度等事件以 dict 的形式交给 sink（由 index 转发给 flow 的 context）；
+# 设置 profile_path 后，各阶段还会用 cProfile 采样（同一时刻只采样一个，见 _ProfileLock），dump_profiles 写出 <stage>.prof
+class Metrics:
+  def __init__(
+    self,
+    sink: Optional[Callable[[dict], None]] = None,
+    profile_path: Optional[str] = None,
+    recent_latencies: int = 1000,
+  ):
+    self._sink = sink
+    self._profile_path = profile_path
+    self._lock = threading.Lock()
+    self._local = threading.local()
+    self._stages: dict[str, dict] = {}
+    self._adapters: dict[str, dict] = {}
+    self._histogram: list[int] = [0] * (len(_LatencyBuckets) + 1)
+    self._recent_latencies: deque = deque(maxlen=recent_latencies)
+    self._profiles: dict[str, pstats.Stats] = {}
+
+  @contextlib.contextmanager
+  def stage(self, name: str):
+    profile = self._start_profile()
+    begin = time.perf_counter()
+    try:
+      yield
+    finally:
+      elapsed = time.perf_counter() - begin
+      if profile is not None:
+        self._stop_profile(name, profile)
+      with self._lock:
+        stage = self._stages.setdefault(name, { "seconds": 0.0, "count": 0 })
+        stage["seconds"] += elapsed
+        stage["count"] += 1
+
+  def record_request(self, adapter: str, characters: int, seconds: float, succeeded: bool):
+    with self._lock:
+      counter = self._adapters.setdefault(adapter, {
+        "requests": 0,
+        "failures": 0,
+        "characters": 0,
+        "seconds": 0.0,
+      })
+      counter["requests"] += 1
+      counter["characters"] += characters
+      counter["seconds"] += seconds
+      if not succeeded:
+        counter["failures"] += 1
+      self._histogram[bisect.bisect_left(_LatencyBuckets, seconds)] += 1
+      self._recent_latencies.append(seconds)
+
+  def latency_percentile(self, percentile: float) -> Optional[float]:
+    with self._lock:
+      latencies = sorted(self._recent_latencies)
+    if len(latencies) == 0:
+      return None
+    index = min(len(latencies) - 1, int(len(latencies) * percentile))
+    return latencies[index]
+
+  # 在当前线程内给 emit 的事件附加字段，例如批量翻译时标记事件属于哪本书
+  @contextlib.contextmanager
+  def labels(self, **labels):
+    previous = getattr(self._local, "labels", None)
+    self._local.labels = dict(previous or {}, **labels)
+    try:
+      yield
+    finally:
+      self._local.labels = previous
+
+  def emit(self, event: dict):
+    if self._sink is not None:
+      labels = getattr(self._local, "labels", None)
+      if labels:
+        event = dict(labels, **event)
+      self._sink(event)
+
+  def summary(self) -> dict:
+    with self._lock:
+      histogram = {}
+      for i, count in enumerate(self._histogram):
+        if i < len(_LatencyBuckets):
+          histogram[f"<={_LatencyBuckets[i]}s"] = count
+        else:
+          histogram[f">{_LatencyBuckets[-1]}s"] = count
+      summary = {
+        "stages": dict((name, dict(stage)) for name, stage in self._stages.items()),
+        "adapters": dict((name, dict(counter)) for name, counter in self._adapters.items()),
+        "latency_histogram": histogram,
+      }
+    summary["latency_p50"] = self.latency_percentile(0.5)
+    summary["latency_p95"] = self.latency_percentile(0.95)
+    return summary
+
+  def _start_profile(self) -> Optional[cProfile.Profile]:
+    if self._profile_path is None or not _ProfileLock.acquire(blocking=False):
+      return None
+    profile = cProfile.Profile()
+    try:
+      profile.enable()
+    except ValueError:
+      # 进程中已有其他性能分析工具，例如整个程序在 cProfile 下运行
+      _ProfileLock.release()
+      return None
+    return profile
+
+  def _stop_profile(self, name: str, profile: cProfile.Profile):
+    profile.disable()
+    _ProfileLock.release()
+
+    with self._lock:
+      stats = self._profiles.get(name)
+      if stats is None:
+        stats = pstats.Stats(profile)
+        self._profiles[name] = stats
+      else:
+        stats.add(profile)
+
+  def dump_profiles(self):
+    if self._profile_path is None:
+      return
+    os.makedirs(self._profile_path, exist_ok=True)
+    with self._lock:
+      for name, stats in self._profiles.items():
+        stats.dump_stats(os.path.join(self._profile_path, f"{name}.prof"))
+
+# run ``python graphs/translate/blocks/code-0/logic/metrics.py``
+class _Test(unittest.TestCase):
+
+  # 多个线程同时进入阶段（例如各翻译线程中的 dom），以及嵌套的阶段，都不会因为重复启用 cProfile 而失败
+  def test_concurrent_profile(self):
+    profile_path = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, profile_path)
+    metrics = Metrics(profile_path=profile_path)
+    barrier = threading.Barrier(4)
+    errors = []
+
+    def run():
+      try:
+        barrier.wait()
+        for _ in range(20):
+          with metrics.stage("dom"):
+            with metrics.stage("serialize"):
+              sum(i * i for i in range(1000))
+      except Exception as e:
+        errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    self.assertEqual(errors, [])
+    stages = metrics.summary()["stages"]
+    self.assertEqual(stages["dom"]["count"], 80)
+    self.assertEqual(stages["serialize"]["count"], 80)
+
+    metrics.dump_profiles()
+    self.assertIn("dom.prof", os.listdir(profile_path))
+    self.assertFalse(_ProfileLock.locked())
+
+  def test_profile_under_other_profiler(self):
+    metrics = Metrics(profile_path=tempfile.gettempdir())
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+      with metrics.stage("parse"):
+        pass
+    finally:
+      profile.disable()
+    self.assertEqual(metrics.summary()["stages"]["parse"]["count"], 1)
+    self.assertFalse(_ProfileLock.locked())
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,4 +1,3 @@
-import io
 import re
 import unittest
 
@@ -29,27 +28,39 @@ _StopSentenceSet: set = {
   ";",
 }
 
-def _is_end_of_sentence(char: str) -> bool:
-  if not re.match(r"[\s\n]", char):
-    return False
-  return True
+_CloseBracketSet: set = set(_BracketDict.values())
+_SpecialCharSet: set = set(_BracketDict.keys()) | _CloseBracketSet | _SplitSentenceSet | _StopSentenceSet | { "." }
+
+# 一次匹配一段连续空白、一段不含特殊字符的文字，或单个特殊字符（括号、标点）。
+# 状态机只需逐个处理这些片段，而不是逐个字符调用正则
+_TokenPattern = re.compile(
+  r"(\s+)|([^\s" + re.escape("".join(sorted(_SpecialCharSet))) + r"]+)|(.)",
+  re.DOTALL,
+)
 
 def split_paragraph(text: str) -> list:
   words_in_sentence = 0
   is_read_words = False
   bracket_stack = []
   sentences = []
-  buffer = io.StringIO()
+  sentence_begin = 0
+
+  for match in _TokenPattern.finditer(text):
+    if match.lastindex == 1:
+      if is_read_words:
+        words_in_sentence += 1
+        is_read_words = False
+      continue
+
+    if match.lastindex == 2:
+      is_read_words = True
+      continue
 
-  for char in text:
-    buffer.write(char)
+    char = match.group(3)
 
     if char in _SplitSentenceSet:
       words_in_sentence = 0
-    elif is_read_words and re.match(r"^[\s\n]$", char):
-      words_in_sentence += 1
-      is_read_words = False
-    elif not is_read_words and not re.match(r"^[\s\n]$", char):
+    else:
       is_read_words = True
 
     if len(bracket_stack) > 0 and char == bracket_stack[-1]:
@@ -62,16 +73,12 @@ def split_paragraph(text: str) -> list:
       words_in_sentence > 1 and char == "."
     )):
       words_in_sentence = 0
-      buffer.flush()
-      sentences.append(buffer.getvalue())
-      buffer.close()
-      buffer = io.StringIO()
-
-  last_sentence = buffer.getvalue()
-  buffer.close()
+      sentence_end = match.end()
+      sentences.append(text[sentence_begin:sentence_end])
+      sentence_begin = sentence_end
 
-  if len(last_sentence):
-    sentences.append(last_sentence)
+  if sentence_begin < len(text):
+    sentences.append(text[sentence_begin:])
 
   target_sentences = []
   last_append_index = -1
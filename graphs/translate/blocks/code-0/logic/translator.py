@@ -1,17 +1,117 @@
+import io
 import re
 import os
-import json
+import copy
+import time
+import bisect
+import random
+import unittest
+import threading
+import contextlib
 
 from enum import Enum
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from html import escape
 from lxml import etree
 
-from .group import ParagraphsGroup
-from .adapter import GoogleTranslator, OpenAITranslator
-from .utils import create_node, escape_ascii
+from .group import ParagraphsGroup, Paragraph
+from .cache import TranslationCache
+from .metrics import Metrics
+from .checkpoint import CheckpointScope
+from .event_loop import EventLoopThread
+from .filter import ParagraphFilter
+from .manifest import TranslationManifest
+from .budget import GroupBudget, budget_characters
+from .adapter import (
+  GoogleTranslator, OpenAITranslator, FakeTranslator,
+  ThrottledTranslator, HedgedTranslator, PooledTranslator, PoolBackend,
+)
+from .utils import create_node, is_plain_text, unescape_unicode
 
 class Adapter(Enum):
     Google = 1
     OpenAI = 2
+    Fake = 3
+    Pool = 4
+
+_AdapterClasses = {
+  Adapter.Google: GoogleTranslator,
+  Adapter.OpenAI: OpenAITranslator,
+  Adapter.Fake: FakeTranslator,
+}
+
+def _create_adapter(
+  adapter: Adapter,
+  project_id: str,
+  source_language_code: str,
+  target_language_code: str,
+  concurrency: int,
+  request_timeout: Optional[float],
+  token_path: Optional[str] = None,
+  api_url: Optional[str] = None,
+):
+  if adapter == Adapter.Google:
+    return GoogleTranslator(
+      project_id=project_id,
+      source_language_code=source_language_code,
+      target_language_code=target_language_code,
+    )
+  elif adapter == Adapter.OpenAI:
+    options = {}
+    if request_timeout is not None:
+      options["read_timeout"] = request_timeout
+    if token_path is not None:
+      options["token_path"] = token_path
+    if api_url is not None:
+      options["api_url"] = api_url
+    return OpenAITranslator(
+      pool_size=max(1, concurrency),
+      target_language_code=target_language_code,
+      **options,
+    )
+  elif adapter == Adapter.Fake:
+    return FakeTranslator()
+  else:
+    raise ValueError(f"invalid adapter: {adapter}")
+
+# backend 为 { name, adapter, weight, project_id, token_path, api_url, requests_per_minute, characters_per_minute }，
+# 除 adapter 外均可省略，省略 project_id 时使用顶层的 project_id。每个后端按自己的配额限流，权重默认取配额
+def _create_backend(
+  backend: dict,
+  project_id: str,
+  source_language_code: str,
+  target_language_code: str,
+  concurrency: int,
+  request_timeout: Optional[float],
+) -> PoolBackend:
+  adapter: Adapter = backend["adapter"]
+  translator = _create_adapter(
+    adapter=adapter,
+    project_id=backend.get("project_id") or project_id,
+    source_language_code=source_language_code,
+    target_language_code=target_language_code,
+    concurrency=concurrency,
+    request_timeout=request_timeout,
+    token_path=backend.get("token_path"),
+    api_url=backend.get("api_url"),
+  )
+  requests_per_minute = backend.get("requests_per_minute")
+  characters_per_minute = backend.get("characters_per_minute")
+  weight = backend.get("weight")
+  if weight is None:
+    weight = characters_per_minute or requests_per_minute or 1
+  return PoolBackend(
+    name=backend.get("name", adapter.name),
+    translator=ThrottledTranslator(
+      translator=translator,
+      requests_per_minute=requests_per_minute,
+      characters_per_minute=characters_per_minute,
+      max_retries=0,
+      max_concurrency=concurrency,
+    ),
+    weight=weight,
+  )
 
 class _XML:
   def __init__(self, page_content: str, parser: etree.HTMLParser):
@@ -42,6 +142,29 @@ class _XML:
 
     return text
 
+  # 深拷贝 DOM，使同一份解析结果可以分别填入多种语言的译文
+  def copy(self) -> "_XML":
+    xml = _XML.__new__(_XML)
+    xml.head = self.head
+    xml.root = copy.deepcopy(self.root)
+    xml.nsmap = self.nsmap.copy()
+    return xml
+
+class _Page:
+  def __init__(self, file_path: str, xml: _XML, p_doms: list, source_text_list: list[str]):
+    self.file_path: str = file_path
+    self.xml: _XML = xml
+    self.p_doms: list = p_doms
+    self.source_text_list: list[str] = source_text_list
+    self.paragraph_group_list: Optional[list[list[Paragraph]]] = None
+
+  # 段落文字与分组只读，可以共享；DOM 会被 _fill_page 修改，必须各自拷贝
+  def copy(self) -> "_Page":
+    xml = self.xml.copy()
+    page = _Page(self.file_path, xml, list(xml.root.xpath("//p")), self.source_text_list)
+    page.paragraph_group_list = self.paragraph_group_list
+    return page
+
 class Translator:
   def __init__(
     self, 
@@ -51,142 +174,687 @@ class Translator:
     max_paragraph_characters: int,
     clean_format: bool,
     adapter: Adapter,
+    concurrency: int = 1,
+    cache: Optional[TranslationCache] = None,
+    client = None,
+    requests_per_minute: Optional[int] = None,
+    characters_per_minute: Optional[int] = None,
+    max_retries: int = 0,
+    request_timeout: Optional[float] = None,
+    overlap_paragraphs: int = 2,
+    overlap_mode: str = "translate",
+    metrics: Optional[Metrics] = None,
+    async_requests: bool = False,
+    skip_untranslatable: bool = False,
+    dry_run: bool = False,
+    group_budget: Optional[int] = None,
+    adaptive_group_size: bool = False,
+    hedge_requests: bool = False,
+    hedge_budget: float = 0.05,
+    backends: Optional[list[dict]] = None,
   ):
-    self.parser = etree.HTMLParser(recover=True)
     self.clean_format = clean_format
+    self.metrics: Metrics = metrics if metrics is not None else Metrics()
+    self._adapter_name: str = adapter.name
+    self.cache = cache
+    self._cache_scope = f"{adapter.name}:{source_language_code}:{target_language_code}"
+    self._local = threading.local()
+    self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    self.group_characters: int = 0
+    self.overlap_characters: int = 0
+    self.filtered_characters: int = 0
+    self.filtered_paragraphs: dict[str, int] = {}
+    self._stats_lock = threading.Lock()
+
+    # translate：相邻分组重复 overlap_paragraphs 段并一起翻译，重复部分的译文会被丢弃
+    # context：分组不重复，上一组末尾的段落仅作为上下文发送（仅支持上下文的接口，如 OpenAI）
+    if overlap_mode == "context":
+      self._context_paragraphs = overlap_paragraphs
+      group_overlap = 0
+    elif overlap_mode == "translate":
+      self._context_paragraphs = 0
+      group_overlap = overlap_paragraphs
+    else:
+      raise ValueError(f"invalid overlap mode: {overlap_mode}")
+
+    self._filter: Optional[ParagraphFilter] = None
+    if skip_untranslatable:
+      self._filter = ParagraphFilter(source_language_code, target_language_code)
+
+    # 多后端池（Adapter.Pool）由 backends 给出各个后端，见 _create_backend
+    if adapter == Adapter.Pool:
+      if not backends:
+        raise ValueError("pool adapter needs backends")
+      adapter_classes = [_AdapterClasses[backend["adapter"]] for backend in backends]
+    else:
+      adapter_classes = [_AdapterClasses[adapter]]
+
+    # 分组大小的预算与单位由接口决定（Google 按字符，OpenAI 按估计的 token），注入的 client 可以自带。
+    # 多后端时取最严格的：有按 token 计的后端时按 token 计，否则取最小的预算
+    # https://support.google.com/translate/thread/18674882/how-many-words-is-maximum-in-google?hl=en
+    adapter_class = min(adapter_classes, key=lambda c: (c.budget_unit != "tokens", c.group_budget))
+    default_budget = getattr(client, "group_budget", adapter_class.group_budget)
+    if group_budget is None:
+      group_budget = default_budget
+    budget_unit = getattr(client, "budget_unit", adapter_class.budget_unit)
+    self.group_budget = GroupBudget(
+      budget=group_budget,
+      # 动态调整时不低于默认预算的 1/5，明确给出更小的预算时以它为准
+      minimum=min(group_budget, default_budget // 5),
+      maximum=getattr(client, "max_group_budget", adapter_class.max_group_budget),
+      unit=budget_unit,
+      adaptive=adaptive_group_size,
+    )
     self.group = ParagraphsGroup(
       max_paragraph_len=max_paragraph_characters,
-      # https://support.google.com/translate/thread/18674882/how-many-words-is-maximum-in-google?hl=en
-      max_group_len=5000,
+      max_group_len=self.group_budget.budget,
+      max_text_len=budget_characters(self.group_budget.budget, budget_unit),
+      overlap=group_overlap,
+      measure=self.group_budget.measure,
     )
-    if adapter == Adapter.Google:
-      self._translator = GoogleTranslator(
+    if OpenAITranslator in adapter_classes:
+      self.clean_format = True
+
+    # client 用于注入一个已经构造好的翻译接口（实现 translate(text_list, mime_type)），此时 adapter 只用作标识。
+    # 试运行（dry_run）只做抽取与分组，不创建接口客户端，因此也不需要凭据
+    if dry_run:
+      self._translator = None
+    elif client is not None:
+      self._translator = client
+    elif adapter == Adapter.Pool:
+      self._translator = PooledTranslator(
+        backends=[
+          _create_backend(backend, project_id, source_language_code, target_language_code, concurrency, request_timeout)
+          for backend in backends
+        ],
+        max_failovers=max_retries,
+      )
+    else:
+      self._translator = _create_adapter(
+        adapter=adapter,
         project_id=project_id,
         source_language_code=source_language_code,
         target_language_code=target_language_code,
+        concurrency=concurrency,
+        request_timeout=request_timeout,
       )
-    elif adapter == Adapter.OpenAI:
-      self.clean_format = True
-      self._translator = OpenAITranslator()
+
+    if self._translator is None:
+      self._supports_context: bool = all(getattr(c, "supports_context", False) for c in adapter_classes)
+    else:
+      self._supports_context = getattr(self._translator, "supports_context", False)
+
+    # 不支持上下文的接口（如 Google）改为 translate 方式的重叠，而不是悄悄丢掉重叠
+    if self._context_paragraphs > 0 and not self._supports_context:
+      print(f"Adapter {adapter.name} does not support context, fall back to translate overlap")
+      self.group.overlap = self._context_paragraphs
+      self._context_paragraphs = 0
+
+    # 多后端池中每个后端各自限流，失败时转到其他后端，不再整体包一层限流与重试
+    if dry_run or adapter == Adapter.Pool:
+      pass
+    elif requests_per_minute is not None or characters_per_minute is not None or max_retries > 0:
+      self._translator = ThrottledTranslator(
+        translator=self._translator,
+        requests_per_minute=requests_per_minute,
+        characters_per_minute=characters_per_minute,
+        max_retries=max_retries,
+        max_concurrency=concurrency,
+      )
+
+    # 对冲请求包裹在限流之外，额外的请求同样受限流约束。同步模式下请求在对冲的线程池中发出，
+    # 每个翻译线程至多占用两个（原请求与对冲请求）
+    if hedge_requests and not dry_run:
+      self._translator = HedgedTranslator(
+        translator=self._translator,
+        budget=hedge_budget,
+        max_workers=max(1, concurrency) * 2,
+      )
+
+    # 异步模式下由一个事件循环驱动所有分组的请求，concurrency 表示同时在途的请求数，而不是线程数
+    self._event_loop: Optional[EventLoopThread] = None
+    if async_requests and not dry_run:
+      if getattr(self._translator, "supports_async", False):
+        self._event_loop = EventLoopThread(max_in_flight=concurrency)
+      else:
+        print(f"Adapter {adapter.name} does not support async requests, fall back to threads")
+
+  @property
+  def parser(self) -> etree.HTMLParser:
+    # lxml 的解析器不能跨线程共享，每个线程各自持有一个
+    parser = getattr(self._local, "parser", None)
+    if parser is None:
+      parser = etree.HTMLParser(recover=True)
+      self._local.parser = parser
+    return parser
+
+  # 先在事件循环中关闭异步客户端，再逐层关闭包裹的接口（线程池、长连接会话等）
+  def close(self):
+    self._executor.shutdown(wait=True)
+    if self._event_loop is not None:
+      if hasattr(self._translator, "close_async"):
+        self._event_loop.run(self._translator.close_async())
+      self._event_loop.close()
+      self._event_loop = None
+    if self._translator is not None and hasattr(self._translator, "close"):
+      self._translator.close()
+
+  # 逐层收集翻译接口（包括 ThrottledTranslator 包裹的内层接口）自己统计的计数
+  def adapter_stats(self) -> dict[str, dict]:
+    stats = {}
+    translator = self._translator
+    while translator is not None:
+      if hasattr(translator, "stats"):
+        stats[type(translator).__name__] = translator.stats()
+      translator = getattr(translator, "translator", None)
+    return stats
 
   def translate(self, text_list: list[str]):
     to_text_list: list[str] = []
-    for text_list in self.group.split_text_list(text_list):
+    with self.metrics.stage("group"):
+      chunk_text_lists = self.group.split_text_list(text_list, self.group_budget.budget)
+    for text_list in chunk_text_lists:
       for text in self._emit_translation_task(text_list, "text/plain"):
         to_text_list.append(text)
     return to_text_list
 
-  def translate_page(self, file_path: str, page_content: str):
-    xml = _XML(page_content, self.parser)
-    source_dom_text_list: list[str] = []
-    p_doms = list(xml.root.xpath('//p'))
+  # 用于增量重译清单：只有翻译接口、语言与格式都相同时，之前的译文才能复用
+  @property
+  def manifest_scope(self) -> str:
+    if self.clean_format:
+      return f"{self._cache_scope}:text"
+    else:
+      return f"{self._cache_scope}:html"
+
+  def translate_page(
+    self,
+    file_path: str,
+    page_content: str,
+    journal: Optional[CheckpointScope] = None,
+    manifest: Optional[TranslationManifest] = None,
+  ):
+    page = self._extract_page(file_path, page_content)
+    translated_group_list = self._translate_group_by_group(file_path, page.source_text_list, journal, manifest)
+    self._record_manifest(manifest, file_path, translated_group_list)
+    return self._fill_page(page, translated_group_list)
+
+  # 解析一次、翻译多次：多个目标语言共用 parse_page 的结果，各自用 translate_parsed_page 在副本上填入译文。
+  # 各语言的 Translator 分组参数相同，因此分组也只需做一次
+  def parse_page(self, file_path: str, page_content: str) -> "_Page":
+    page = self._extract_page(file_path, page_content)
+    page.paragraph_group_list = self._split_paragraphs(page.source_text_list)
+    return page
+
+  def translate_parsed_page(
+    self,
+    page: "_Page",
+    journal: Optional[CheckpointScope] = None,
+    manifest: Optional[TranslationManifest] = None,
+  ) -> str:
+    page = page.copy()
+    translated_group_list = self._translate_groups(page.file_path, page.paragraph_group_list, journal, manifest)
+    self._record_manifest(manifest, page.file_path, translated_group_list)
+    return self._fill_page(page, translated_group_list)
 
-    for p_dom in p_doms:
-      bin_text = etree.tostring(p_dom, method="html", encoding="utf-8")
-      source_dom_text_list.append(bin_text.decode("utf-8"))
+  # 整本书一起分组：先抽取所有章节的段落，再跨越文件边界打包成接近上限的请求，最后把译文分发回各自的 DOM。
+  # 版权页、献词等零碎的短章节不必各自占用一次请求
+  def translate_pages(
+    self,
+    pages: list[tuple[str, str]],
+    journal: Optional[CheckpointScope] = None,
+    manifest: Optional[TranslationManifest] = None,
+  ) -> list[str]:
+    extracted_pages: list[_Page] = []
+    source_text_list: list[str] = []
+    offsets: list[int] = []
 
-    translated_group_list = self._translate_group_by_group(file_path, source_dom_text_list)
-    to_target_text_pair_map: dict[int, list[list[str]]] = {}
+    for file_path, page_content in pages:
+      page = self._extract_page(file_path, page_content)
+      extracted_pages.append(page)
+      offsets.append(len(source_text_list))
+      source_text_list.extend(page.source_text_list)
+
+    translated_group_list = self._translate_group_by_group(
+      f"{len(pages)} pages",
+      source_text_list,
+      journal,
+      manifest,
+    )
+    page_group_lists: list[list[tuple[list[str], list[str], list[int]]]] = [[] for _ in pages]
 
     for (source_text_list, target_text_list, index_list) in translated_group_list:
-      for i, target_text in enumerate(target_text_list):
-        source_text = source_text_list[i]
-        index = index_list[i]
+      for i, index in enumerate(index_list):
+        page_index = bisect.bisect_right(offsets, index) - 1
+        page_group_lists[page_index].append((
+          [source_text_list[i]],
+          [target_text_list[i]],
+          [index - offsets[page_index]],
+        ))
 
-        if target_text != "":
-          if self.clean_format:
-            target_text = escape_ascii(target_text)
+    for i, page in enumerate(extracted_pages):
+      self._record_manifest(manifest, page.file_path, page_group_lists[i])
+
+    return [
+      self._fill_page(page, page_group_lists[i])
+      for i, page in enumerate(extracted_pages)
+    ]
+
+  # 试运行：做真实的抽取与分组，统计每组会发出的请求，但不请求翻译接口。
+  # 返回 { file, paragraphs, requests: [每次请求的字数], overlap_characters, context_characters }，由 CostEstimate 汇总。
+  # 缓存与增量重译清单中已有译文的段落不计入请求；缓存只读，不改变它的淘汰顺序
+  def estimate_page(self, file_path: str, page_content: str, manifest: Optional[TranslationManifest] = None) -> dict:
+    page = self._extract_page(file_path, page_content)
+    paragraph_group_list = self._split_paragraphs(page.source_text_list)
+    return self._estimate_groups(file_path, paragraph_group_list, manifest)
+
+  # 与 translate_pages 相同，整本书一起分组，请求跨越章节，因此只能给出整体的统计
+  def estimate_pages(self, pages: list[tuple[str, str]], manifest: Optional[TranslationManifest] = None) -> dict:
+    source_text_list: list[str] = []
+    for file_path, page_content in pages:
+      source_text_list.extend(self._extract_page(file_path, page_content).source_text_list)
+    paragraph_group_list = self._split_paragraphs(source_text_list)
+    return self._estimate_groups(f"{len(pages)} pages", paragraph_group_list, manifest)
+
+  # 与 translate 相同的分块方式，用于书名、作者与目录
+  def estimate_texts(self, file_path: str, text_list: list[str]) -> dict:
+    requests: list[int] = []
+    for chunk_text_list in self.group.split_text_list(text_list, self.group_budget.budget):
+      _, _, contents = self._lookup_cache(chunk_text_list, "text/plain", read_only=True)
+      if len(contents) > 0:
+        requests.append(sum(len(content) for content in contents))
+    return {
+      "file": file_path,
+      "paragraphs": len(text_list),
+      "requests": requests,
+      "overlap_characters": 0,
+      "context_characters": 0,
+    }
+
+  def _estimate_groups(
+    self,
+    file_path: str,
+    paragraph_group_list: list[list[Paragraph]],
+    manifest: Optional[TranslationManifest] = None,
+  ) -> dict:
+    source_text_lists, context_text_lists = self._group_text_lists(paragraph_group_list)
+    requests: list[int] = []
+    overlap_characters = 0
+    context_characters = 0
+
+    for index, source_text_list in enumerate(source_text_lists):
+      head_count, tail_count = self._overlap_counts(paragraph_group_list, index)
+      for text in source_text_list[:head_count] + source_text_list[len(source_text_list) - tail_count:]:
+        overlap_characters += len(text)
+
+      text_list, _, _, mime_type, context_text_list = self._prepare_text_list(
+        source_text_list,
+        context_text_lists[index],
+        manifest,
+      )
+      # 与 _emit_translation_task 一致：缓存命中的文字不发送，全部命中时不发出请求
+      _, _, contents = self._lookup_cache(text_list, mime_type, read_only=True)
+      if len(contents) == 0:
+        continue
+
+      characters = sum(len(content) for content in contents)
+      if context_text_list:
+        context_size = sum(len(text) for text in context_text_list)
+        context_characters += context_size
+        characters += context_size
+      requests.append(characters)
+
+    return {
+      "file": file_path,
+      "paragraphs": len(set(p.index for paragraph_list in paragraph_group_list for p in paragraph_list)),
+      "requests": requests,
+      "overlap_characters": overlap_characters,
+      "context_characters": context_characters,
+    }
+
+  def _extract_page(self, file_path: str, page_content: str) -> "_Page":
+    with self.metrics.stage("parse"):
+      xml = _XML(page_content, self.parser)
+      source_dom_text_list: list[str] = []
+      p_doms = list(xml.root.xpath('//p'))
+
+      for p_dom in p_doms:
+        bin_text = etree.tostring(p_dom, method="html", encoding="utf-8")
+        source_dom_text_list.append(bin_text.decode("utf-8"))
+
+    return _Page(file_path, xml, p_doms, source_dom_text_list)
+
+  def _fill_page(self, page: "_Page", translated_group_list) -> str:
+    with self.metrics.stage("dom"):
+      to_target_pair_map: dict[int, list[list[tuple[str, bool]]]] = {}
+
+      for (source_text_list, target_text_list, index_list) in translated_group_list:
+        for i, target_text in enumerate(target_text_list):
+          source_text = source_text_list[i]
+          index = index_list[i]
+          target_is_plain = False
+
+          if target_text != "":
+            if self.clean_format:
+              # 纯文本译文直接作为节点文本，不必先转义再解析
+              target_text = unescape_unicode(target_text)
+              target_is_plain = True
+            else:
+              target_text = self._clean_p_tag(target_text)
+
+          pair = [(source_text, False), (target_text, target_is_plain)]
+
+          if index in to_target_pair_map:
+            to_target_pair_map[index].append(pair)
           else:
-            target_text = self._clean_p_tag(target_text)
+            to_target_pair_map[index] = [pair]
 
-        pair = [source_text, target_text]
+      for index, p_dom in enumerate(page.p_doms):
+        if index in to_target_pair_map:
+          for pair in to_target_pair_map[index]:
+            for text, is_plain in pair:
+              if text != "":
+                p_dom.addprevious(self._create_p(p_dom, text, is_plain))
+          p_dom.getparent().remove(p_dom)
 
-        if index in to_target_text_pair_map:
-          to_target_text_pair_map[index].append(pair)
-        else:
-          to_target_text_pair_map[index] = [pair]
-
-    for index, p_dom in enumerate(p_doms):
-      if index in to_target_text_pair_map:
-        new_p_doms = []
-        for pair in to_target_text_pair_map[index]:
-          for text in pair:
-            if text != "":
-              new_p_text = self._wrap_with_p(p_dom, text)
-              new_p_dom = create_node(new_p_text, parser=self.parser)
-              new_p_doms.append(new_p_dom)
-    
-        parent_dom = p_dom.getparent()
-        index_at_parent = parent_dom.index(p_dom)
+    with self.metrics.stage("serialize"):
+      return page.xml.encode()
 
-        for new_p_dom in reversed(new_p_doms):
-          parent_dom.insert(index_at_parent, new_p_dom)
-        parent_dom.remove(p_dom)
+  def _translate_group_by_group(
+    self,
+    file_path: str,
+    source_text_list: list[str],
+    journal: Optional[CheckpointScope] = None,
+    manifest: Optional[TranslationManifest] = None,
+  ):
+    paragraph_group_list = self._split_paragraphs(source_text_list)
+    return self._translate_groups(file_path, paragraph_group_list, journal, manifest)
+
+  # 每次分组时读取当前的预算，动态调整后新的章节按新的大小分组
+  def _split_paragraphs(self, source_text_list: list[str]) -> list[list[Paragraph]]:
+    with self.metrics.stage("group"):
+      return self.group.split_paragraphs(source_text_list, self.group_budget.budget)
 
-    return xml.encode()
+  def _record_manifest(self, manifest: Optional[TranslationManifest], file_path: str, translated_group_list):
+    if manifest is None:
+      return
+    for (source_text_list, target_text_list, index_list) in translated_group_list:
+      manifest.record(file_path, index_list, source_text_list, target_text_list)
 
-  def _translate_group_by_group(self, file_path: str, source_text_list: list[str]):
+  def _translate_groups(
+    self,
+    file_path: str,
+    paragraph_group_list: list[list[Paragraph]],
+    journal: Optional[CheckpointScope] = None,
+    manifest: Optional[TranslationManifest] = None,
+  ):
     target_list = []
-    paragraph_group_list = self.group.split_paragraphs(source_text_list)
+    source_text_lists, context_text_lists = self._group_text_lists(paragraph_group_list)
+
+    def translate_group(index: int) -> list[str]:
+      if journal is not None:
+        target_text_list = journal.get(index)
+        if target_text_list is not None:
+          return list(target_text_list)
+
+      target_text_list = self._translate_text_list(
+        source_text_lists[index],
+        context_text_lists[index],
+        manifest,
+      )
+
+      if journal is not None:
+        journal.put(index, target_text_list)
+      return target_text_list
+
+    async def translate_group_async(index: int) -> list[str]:
+      if journal is not None:
+        target_text_list = journal.get(index)
+        if target_text_list is not None:
+          return list(target_text_list)
+
+      target_text_list = await self._translate_text_list_async(
+        source_text_lists[index],
+        context_text_lists[index],
+        manifest,
+      )
+
+      if journal is not None:
+        journal.put(index, target_text_list)
+      return target_text_list
 
-    for index, paragraph_list in enumerate(paragraph_group_list):
-      source_text_list = list(map(lambda x: self._clean_p_tag(x.text), paragraph_list))
-      target_text_list = self._translate_text_list(source_text_list)
+    # 各组之间互不依赖，可同时发出。结果按提交顺序取回，下方裁剪重叠段落的逻辑依赖这个顺序
+    if self._event_loop is not None:
+      futures = [
+        self._event_loop.submit(translate_group_async(index))
+        for index in range(len(source_text_lists))
+      ]
+      target_text_lists = (future.result() for future in futures)
+    else:
+      target_text_lists = self._executor.map(translate_group, range(len(source_text_lists)))
+
+    for index, target_text_list in enumerate(target_text_lists):
+      paragraph_list = paragraph_group_list[index]
+      source_text_list = source_text_lists[index]
       index_list = list(map(lambda x: x.index, paragraph_list))
+      overlap_characters = 0
 
-      # 长度为 2 的数组来源于裁剪，不得已，此时它的后继的首位不会与它重复，故不必裁剪
-      if index > 0 and len(paragraph_group_list[index - 1]) > 2:
-        source_text_list.pop(0)
+      head_count, tail_count = self._overlap_counts(paragraph_group_list, index)
+      for _ in range(head_count):
+        overlap_characters += len(source_text_list.pop(0))
         target_text_list.pop(0)
         index_list.pop(0)
-
-      if index < len(paragraph_group_list) - 1 and len(paragraph_list) > 2:
-        source_text_list.pop()
+      for _ in range(tail_count):
+        overlap_characters += len(source_text_list.pop())
         target_text_list.pop()
         index_list.pop()
 
+      context_text_list = context_text_lists[index]
+      if context_text_list is not None:
+        overlap_characters += sum(len(text) for text in context_text_list)
+
+      with self._stats_lock:
+        self.group_characters += sum(len(text) for text in source_text_lists[index]) + overlap_characters
+        self.overlap_characters += overlap_characters
+
       target_list.append((source_text_list, target_text_list, index_list))
       print(f"Translate completed: {file_path} task {index + 1}/{len(paragraph_group_list)}")
+      self.metrics.emit({
+        "type": "progress",
+        "file": file_path,
+        "completed": index + 1,
+        "total": len(paragraph_group_list),
+      })
 
     return target_list
 
-  def _translate_text_list(self, source_text_list):
-    target_text_list = [""] * len(source_text_list)
+  # 每组要发送的段落文字，以及 context 模式下附带的上下文（其余模式为 None）
+  def _group_text_lists(self, paragraph_group_list: list[list[Paragraph]]):
+    source_text_lists = list(map(
+      lambda paragraph_list: list(map(lambda x: self._clean_p_tag(x.text), paragraph_list)),
+      paragraph_group_list,
+    ))
+    context_text_lists: list[Optional[list[str]]] = [None] * len(source_text_lists)
+
+    # context 模式下分组之间不重复，而是把上一组末尾的若干段作为只读上下文附在请求中，不翻译也不计入结果
+    if self._context_paragraphs > 0 and self._supports_context:
+      for index in range(1, len(source_text_lists)):
+        context_text_lists[index] = source_text_lists[index - 1][-self._context_paragraphs:]
+
+    return source_text_lists, context_text_lists
+
+  # 第 index 组开头与末尾需要丢弃的重叠段落数。
+  # 重叠的段落前一半保留在上一组，后一半保留在本组。
+  # 不足 overlap 段的分组来源于裁剪，不得已，此时它的后继的首位不会与它重复，故不必裁剪
+  def _overlap_counts(self, paragraph_group_list: list[list[Paragraph]], index: int) -> tuple[int, int]:
+    head_count = 0
+    tail_count = 0
+    if index > 0:
+      head_count = (self.group.carried_overlap(paragraph_group_list[index - 1]) + 1) // 2
+    if index < len(paragraph_group_list) - 1:
+      tail_count = self.group.carried_overlap(paragraph_group_list[index]) // 2
+    return head_count, tail_count
+
+  def _translate_text_list(
+    self,
+    source_text_list,
+    context_text_list: Optional[list[str]] = None,
+    manifest: Optional[TranslationManifest] = None,
+  ):
+    text_list, index_list, passed_list, mime_type, context_text_list = self._prepare_text_list(
+      source_text_list,
+      context_text_list,
+      manifest,
+    )
+    translated_list = self._emit_translation_task(text_list, mime_type, context_text_list)
+    return self._place_text_list(len(source_text_list), index_list, passed_list, translated_list)
+
+  async def _translate_text_list_async(
+    self,
+    source_text_list,
+    context_text_list: Optional[list[str]] = None,
+    manifest: Optional[TranslationManifest] = None,
+  ):
+    text_list, index_list, passed_list, mime_type, context_text_list = self._prepare_text_list(
+      source_text_list,
+      context_text_list,
+      manifest,
+    )
+    translated_list = await self._emit_translation_task_async(text_list, mime_type, context_text_list)
+    return self._place_text_list(len(source_text_list), index_list, passed_list, translated_list)
+
+  # 把段落整理成待翻译的文字，返回 (待翻译文字, 它们在原列表中的位置, 不必请求的 (位置, 译文), mime_type, 整理后的上下文)。
+  # 不必请求的段落包括增量重译清单中已有译文的段落，以及无需翻译、原样保留的段落
+  def _prepare_text_list(
+    self,
+    source_text_list,
+    context_text_list: Optional[list[str]],
+    manifest: Optional[TranslationManifest] = None,
+  ):
     to_translated_text_list = []
     index_list = []
 
-    for index, text in enumerate(source_text_list):
-      if self._is_not_empty(text):
-        text = f"<p>{text}</p>"
-        dom = create_node(text, parser=self.parser)
+    passed_list: list[tuple[int, str]] = []
 
-        if self.clean_format:
-          unformat_text = self._unformat(dom)
-          text = unformat_text
-        else:
-          # 一些英语书籍会用 span 进行缩进排版，这些会影响翻译，应该删除
-          changed = self._try_to_clean_space(dom)
-          if changed:
-            bin_text = etree.tostring(dom, method="html", encoding="utf-8")
-            text = bin_text.decode("utf-8")
-          unformat_text = self._unformat(dom)
-
-        if self._is_not_empty(unformat_text):
-          to_translated_text_list.append(text)
-          index_list.append(index)
-    
-    if self.clean_format:
-      mime_type = "text/plain"
-    else:
-      mime_type = "text/html"
+    # 不需要翻译的段落原样作为译文，不发给翻译接口
+    def collect(index: int, text: str, unformat_text: str, html: str):
+      if not self._is_not_empty(unformat_text):
+        return
+      if self._filter is not None:
+        reason = self._filter.classify(unformat_text, html)
+        if reason is not None:
+          passed_list.append((index, text))
+          self._record_filtered(reason, len(unformat_text))
+          return
+      to_translated_text_list.append(text)
+      index_list.append(index)
+
+    with self.metrics.stage("dom"):
+      for index, text in enumerate(source_text_list):
+        if self._is_not_empty(text):
+          if manifest is not None:
+            target_text = manifest.lookup(text)
+            if target_text is not None:
+              passed_list.append((index, target_text))
+              continue
+
+          html = text
+          if is_plain_text(text):
+            # 没有标签与实体，解析后的文本与原文相同，也不会有需要清理的 span
+            unformat_text = text
+            if not self.clean_format:
+              text = f"<p>{text}</p>"
+            collect(index, text, unformat_text, html)
+            continue
+
+          text = f"<p>{text}</p>"
+          dom = create_node(text, parser=self.parser)
 
-    for i, text in enumerate(self._emit_translation_task(to_translated_text_list, mime_type)):
+          if self.clean_format:
+            unformat_text = self._unformat(dom)
+            text = unformat_text
+          else:
+            # 一些英语书籍会用 span 进行缩进排版，这些会影响翻译，应该删除
+            changed = self._try_to_clean_space(dom)
+            if changed:
+              bin_text = etree.tostring(dom, method="html", encoding="utf-8")
+              text = bin_text.decode("utf-8")
+            unformat_text = self._unformat(dom)
+
+          collect(index, text, unformat_text, html)
+
+      if self.clean_format:
+        mime_type = "text/plain"
+      else:
+        mime_type = "text/html"
+
+      if context_text_list is not None:
+        context_text_list = [
+          text if is_plain_text(text) else self._unformat(create_node(f"<p>{text}</p>", parser=self.parser))
+          for text in context_text_list
+          if self._is_not_empty(text)
+        ]
+
+    return to_translated_text_list, index_list, passed_list, mime_type, context_text_list
+
+  def _place_text_list(
+    self,
+    count: int,
+    index_list: list[int],
+    passed_list: list[tuple[int, str]],
+    translated_list: list[str],
+  ) -> list[str]:
+    target_text_list = [""] * count
+    for i, text in enumerate(translated_list):
       index = index_list[i]
       target_text_list[index] = text
+    for index, text in passed_list:
+      target_text_list[index] = text
+    return target_text_list
+
+  def _record_filtered(self, reason: str, characters: int):
+    with self._stats_lock:
+      self.filtered_characters += characters
+      self.filtered_paragraphs[reason] = self.filtered_paragraphs.get(reason, 0) + 1
+
+  def _emit_translation_task(
+    self,
+    source_text_list,
+    mime_type,
+    context_text_list: Optional[list[str]] = None,
+  ) -> list[str]:
+    target_text_list, indexes, contents = self._lookup_cache(source_text_list, mime_type)
+
+    if len(contents) > 0:
+      try:
+        translated_list = self._request_adapter(contents, mime_type, context_text_list)
+      except Exception as e:
+        self._print_failed_contents(contents)
+        raise e
+      self._store_translated(target_text_list, indexes, contents, translated_list, mime_type)
+
+    return target_text_list
+
+  async def _emit_translation_task_async(
+    self,
+    source_text_list,
+    mime_type,
+    context_text_list: Optional[list[str]] = None,
+  ) -> list[str]:
+    target_text_list, indexes, contents = self._lookup_cache(source_text_list, mime_type)
+
+    if len(contents) > 0:
+      try:
+        translated_list = await self._request_adapter_async(contents, mime_type, context_text_list)
+      except Exception as e:
+        self._print_failed_contents(contents)
+        raise e
+      self._store_translated(target_text_list, indexes, contents, translated_list, mime_type)
 
     return target_text_list
 
-  def _emit_translation_task(self, source_text_list, mime_type) -> list[str]:
+  # 过滤掉空白的文字并查询缓存，返回 (已填入缓存译文的结果, 仍需请求的位置, 仍需请求的文字)。
+  # read_only 时不更新缓存的访问时间与命中统计
+  def _lookup_cache(self, source_text_list, mime_type, read_only: bool = False) -> tuple[list[str], list[int], list[str]]:
     indexes = []
     contents = []
 
@@ -197,19 +865,79 @@ class Translator:
     
     target_text_list = [""] * len(source_text_list)
 
-    if len(contents) > 0:
-      try:
-        for i, text in enumerate(self._translator.translate(contents, mime_type)):
-          index = indexes[i]
-          target_text_list[index] = text
+    if len(contents) > 0 and self.cache is not None:
+      if read_only:
+        cached_list = self.cache.peek_list(self._cache_scope, mime_type, contents)
+      else:
+        cached_list = self.cache.get_list(self._cache_scope, mime_type, contents)
+      missed_indexes = []
+      missed_contents = []
 
-      except Exception as e:
-        print("translate contents failed:")
-        for content in contents:
-          print(content)
-        raise e
+      for i, cached in enumerate(cached_list):
+        if cached is None:
+          missed_indexes.append(indexes[i])
+          missed_contents.append(contents[i])
+        else:
+          target_text_list[indexes[i]] = cached
 
-    return target_text_list
+      indexes = missed_indexes
+      contents = missed_contents
+
+    return target_text_list, indexes, contents
+
+  def _store_translated(self, target_text_list, indexes, contents, translated_list, mime_type):
+    for i, text in enumerate(translated_list):
+      index = indexes[i]
+      target_text_list[index] = text
+
+    if self.cache is not None:
+      self.cache.put_list(self._cache_scope, mime_type, contents, translated_list)
+
+  def _print_failed_contents(self, contents: list[str]):
+    print("translate contents failed:")
+    for content in contents:
+      print(content)
+
+  def _request_adapter(self, contents: list[str], mime_type: str, context_text_list: Optional[list[str]]) -> list[str]:
+    begin = time.perf_counter()
+    succeeded = False
+    try:
+      if context_text_list:
+        translated_list = self._translator.translate(contents, mime_type, context=context_text_list)
+      else:
+        translated_list = self._translator.translate(contents, mime_type)
+      succeeded = True
+      return translated_list
+    finally:
+      self._record_request(contents, begin, succeeded)
+
+  async def _request_adapter_async(self, contents: list[str], mime_type: str, context_text_list: Optional[list[str]]) -> list[str]:
+    begin = time.perf_counter()
+    succeeded = False
+    try:
+      if context_text_list:
+        translated_list = await self._translator.translate_async(contents, mime_type, context=context_text_list)
+      else:
+        translated_list = await self._translator.translate_async(contents, mime_type)
+      succeeded = True
+      return translated_list
+    finally:
+      self._record_request(contents, begin, succeeded)
+
+  def _record_request(self, contents: list[str], begin: float, succeeded: bool):
+    seconds = time.perf_counter() - begin
+    self.metrics.record_request(
+      adapter=self._adapter_name,
+      characters=sum(len(content) for content in contents),
+      seconds=seconds,
+      succeeded=succeeded,
+    )
+    self.group_budget.record(
+      units=sum(self.group_budget.measure(content) for content in contents),
+      begin=begin,
+      seconds=seconds,
+      succeeded=succeeded,
+    )
 
   def _try_to_clean_space(self, dom):
     span_list = []
@@ -236,12 +964,37 @@ class Translator:
   def _is_not_empty(self, text: str) -> bool:
     return not re.match(r"^[\s\n]*$", text)
 
+  def _is_empty(self, text: str) -> bool:
+    return not self._is_not_empty(text)
+
+  # 以 p_dom 的属性创建一个新的段落节点。没有标签与实体的文字直接作为节点文本，省去一次 HTML 解析
+  def _create_p(self, p_dom, text: str, is_plain: bool = False):
+    if (is_plain or is_plain_text(text)) and not self._is_empty(text):
+      new_p_dom = p_dom.makeelement("p", self._result_attributes(p_dom))
+      try:
+        new_p_dom.text = text
+        return new_p_dom
+      except ValueError:
+        # 含有 XML 不允许的字符，交给 HTML 解析器处理
+        pass
+
+    if is_plain:
+      text = escape(text)
+
+    return create_node(self._wrap_with_p(p_dom, text), parser=self.parser)
+
+  def _result_attributes(self, p_dom) -> dict[str, str]:
+    # 只有一个属性（通常是 class）时不复制到译文段落上
+    if len(p_dom.attrib) > 1:
+      return dict(p_dom.attrib)
+    else:
+      return {}
+
   def _wrap_with_p(self, p_dom, text: str) -> str:
     attributes_list = []
-    for key, value in p_dom.attrib.items():
-      json_value = json.dumps(value)
-      attributes_list.append(f"{key}={json_value}")
-    if len(attributes_list) > 1:
+    for key, value in self._result_attributes(p_dom).items():
+      attributes_list.append(f"{key}=\"{escape(value)}\"")
+    if len(attributes_list) > 0:
       attributes = " ".join(attributes_list)
       return f"<p {attributes}>{text}</p>"
     else:
@@ -251,4 +1004,129 @@ class Translator:
     text = re.sub(r"^[\s\n]*<p[^>]*>", "", text)
     text = re.sub(r"</\s*p>[\s\n]*$", "", text)
     text = re.sub(r"[\s\n]+", " ", text)
-    return text
\ No newline at end of file
+    return text
+
+# run ``python -m unittest logic.translator`` in graphs/translate/blocks/code-0
+class _Test(unittest.TestCase):
+
+  # 裁剪重叠段落之后，每段原文都恰好出现一次；被拆成多块的段落，各块按顺序拼起来仍是原文
+  def test_overlap_keeps_each_paragraph_once(self):
+    rand = random.Random(0)
+    words = ("alpha", "beta", "gamma", "delta", "epsilon", "zeta")
+
+    def paragraph(min_words: int, max_words: int) -> str:
+      sentences = []
+      for _ in range(rand.randint(1, 4)):
+        sentence = " ".join(rand.choice(words) for _ in range(rand.randint(min_words, max_words)))
+        sentences.append(f"{sentence.capitalize()}.")
+      return " ".join(sentences)
+
+    text_lists = {
+      "short": [paragraph(2, 10) for _ in range(200)],
+      "long": [paragraph(20, 60) for _ in range(60)],
+      "few": [paragraph(2, 10) for _ in range(3)],
+    }
+    for overlap in (0, 1, 2, 3, 5):
+      for mode in ("translate", "context"):
+        for name, text_list in text_lists.items():
+          with self.subTest(overlap=overlap, mode=mode, text_list=name):
+            self._assert_each_paragraph_once(text_list, overlap, mode)
+
+  def _assert_each_paragraph_once(self, text_list: list[str], overlap: int, mode: str):
+    translator = Translator(
+      project_id="",
+      source_language_code="en",
+      target_language_code="zh-CN",
+      max_paragraph_characters=200,
+      clean_format=True,
+      adapter=Adapter.Fake,
+      concurrency=4,
+      client=FakeTranslator(prefix=""),
+      overlap_paragraphs=overlap,
+      overlap_mode=mode,
+      group_budget=1000,
+    )
+    try:
+      with contextlib.redirect_stdout(io.StringIO()):
+        translated_group_list = translator._translate_group_by_group("test", text_list)
+    finally:
+      translator.close()
+
+    source_pieces: dict[int, list[str]] = {}
+    target_pieces: dict[int, list[str]] = {}
+    previous_index = -1
+    for source_text_list, target_text_list, index_list in translated_group_list:
+      for i, index in enumerate(index_list):
+        self.assertGreaterEqual(index, previous_index)
+        previous_index = index
+        source_pieces.setdefault(index, []).append(source_text_list[i])
+        target_pieces.setdefault(index, []).append(target_text_list[i])
+
+    self.assertEqual(sorted(source_pieces.keys()), list(range(len(text_list))))
+    for index, text in enumerate(text_list):
+      self.assertEqual("".join(source_pieces[index]), text)
+      self.assertEqual("".join(target_pieces[index]), text)
+
+  # 明确给出的预算不被抬高到默认预算的 1/5；按 token 计时，不超过预算的文字不会按字符数截断
+  def test_group_budget(self):
+    translator = self._create_translator(FakeTranslator(), group_budget=500)
+    try:
+      self.assertEqual(translator.group_budget.budget, 500)
+    finally:
+      translator.close()
+
+    client = FakeTranslator()
+    client.budget_unit = "tokens"
+    client.group_budget = 1000
+    client.max_group_budget = 1500
+    translator = self._create_translator(client)
+    try:
+      text = " ".join(["word"] * 600)
+      self.assertLessEqual(translator.group_budget.measure(text), 1000)
+      self.assertEqual(translator.group.split_text_list([text], translator.group_budget.budget), [[text]])
+      paragraph_groups = translator.group.split_paragraphs([text], translator.group_budget.budget)
+      self.assertEqual("".join(p.text for group in paragraph_groups for p in group), text)
+    finally:
+      translator.close()
+
+  def _create_translator(self, client: FakeTranslator, **kwargs) -> Translator:
+    return Translator(
+      project_id="",
+      source_language_code="en",
+      target_language_code="zh-CN",
+      max_paragraph_characters=800,
+      clean_format=True,
+      adapter=Adapter.Fake,
+      concurrency=1,
+      client=client,
+      **kwargs,
+    )
+
+  # 接口不支持上下文时，context 方式退回 translate 方式的重叠
+  def test_context_overlap_fallback(self):
+    text_list = [f"Paragraph number {i} of the chapter." for i in range(100)]
+    for supports_context, overlap, context in ((True, 0, 2), (False, 2, 0)):
+      with self.subTest(supports_context=supports_context):
+        client = FakeTranslator(prefix="")
+        client.supports_context = supports_context
+        with contextlib.redirect_stdout(io.StringIO()):
+          translator = self._create_translator(client, group_budget=500, overlap_mode="context")
+        try:
+          self.assertEqual(translator.group.overlap, overlap)
+          self.assertEqual(translator._context_paragraphs, context)
+          translated_group_list = translator._translate_group_by_group("test", text_list)
+          self.assertEqual(
+            [text for source_text_list, _, _ in translated_group_list for text in source_text_list],
+            text_list,
+          )
+          # context 方式重复的段落只作为上下文发送，translate 方式重复的段落会再翻译一次
+          source_characters = sum(len(text) for text in text_list)
+          self.assertGreater(translator.overlap_characters, 0)
+          if supports_context:
+            self.assertGreater(client.context_characters, 0)
+            self.assertEqual(client.characters, source_characters)
+          else:
+            self.assertEqual(client.context_characters, 0)
+            self.assertGreater(client.characters, source_characters)
+        finally:
+          translator.close()
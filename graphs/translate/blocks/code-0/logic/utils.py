@@ -3,13 +3,20 @@ import re
 from lxml import etree
 from html import escape
 
+# 含有标签、实体或控制字符的文字需要经过 HTML 解析，其余文字解析前后完全相同
+_MarkupPattern = re.compile(r"[<&\r\x00-\x08\x0b\x0c\x0e-\x1f]")
+
 def create_node(node_str: str, parser):
   return etree.HTML(node_str, parser=parser).find("body/*")
 
+def is_plain_text(text: str) -> bool:
+  return _MarkupPattern.search(text) is None
+
 def escape_ascii(content: str) -> str:
-  content = escape(content)
-  content = re.sub(
+  return unescape_unicode(escape(content))
+
+def unescape_unicode(content: str) -> str:
+  return re.sub(
     r"\\u([\da-fA-F]{4})", 
     lambda x: chr(int(x.group(1), 16)), content,
-  )
-  return content
\ No newline at end of file
+  )
\ No newline at end of file
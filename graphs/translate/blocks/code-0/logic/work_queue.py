@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import shutil
+import hashlib
+import tempfile
+import unittest
+import threading
+import contextlib
+
+from typing import Iterator, Optional
+
+# 多机翻译的章节队列：协调者把一本书的每个章节（spine）作为一个单元写入共享目录中的 SQLite 数据库，
+# 多个工作进程（同一台机器或通过共享文件系统的多台机器）领取单元、翻译并写回译文，协调者等全部完成后组装 EPub。
+# 单元的原文也存在队列中，工作进程不需要访问原始文件。
+# 领取的单元带有租约，翻译期间由 heartbeat 定期续租；工作进程退出或失联、租约过期后，单元可以被其他进程重新领取。
+# 翻译失败与租约过期（持有者已失联）计入尝试次数，达到 max_attempts 次的单元标记为失败。
+# 跨机器共享时不使用 WAL（它依赖共享内存，网络文件系统上不可用），用默认的回滚日志与文件锁
+class WorkQueue:
+  def __init__(self, path: str, lease_seconds: float = 600.0, max_attempts: int = 3):
+    folder_path = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder_path, exist_ok=True)
+
+    self.path: str = path
+    self._lease_seconds: float = lease_seconds
+    self._max_attempts: int = max_attempts
+    self._lock = threading.Lock()
+    # 自行管理事务：领取单元需要 BEGIN IMMEDIATE 先拿到写锁，避免两个进程领到同一个单元
+    self._conn = sqlite3.connect(path, timeout=60.0, isolation_level=None, check_same_thread=False)
+    self._conn.execute("""
+      CREATE TABLE IF NOT EXISTS units (
+        job TEXT NOT NULL,
+        options TEXT NOT NULL,
+        href TEXT NOT NULL,
+        path TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        source TEXT NOT NULL,
+        target TEXT,
+        status TEXT NOT NULL,
+        worker TEXT,
+        lease_until REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        PRIMARY KEY (job, href)
+      )
+    """)
+    self._conn.execute("CREATE INDEX IF NOT EXISTS units_options_status ON units (options, status)")
+
+  # 已存在的单元（例如上次运行已完成的章节）保持原状，协调者重新运行时只会补上缺少的单元
+  def enqueue(self, job: str, options: str, units: list[tuple[str, str, str]]):
+    with self._lock:
+      self._conn.execute("BEGIN IMMEDIATE")
+      try:
+        self._conn.executemany(
+          "INSERT OR IGNORE INTO units (job, options, href, path, position, source, status) VALUES (?, ?, ?, ?, ?, ?, 'pending')",
+          [(job, options, href, path, position, source) for position, (href, path, source) in enumerate(units)],
+        )
+        # 上次运行失败的单元重新开始
+        self._conn.execute(
+          "UPDATE units SET status = 'pending', attempts = 0, error = NULL WHERE job = ? AND status = 'failed'",
+          (job,),
+        )
+        self._conn.execute("COMMIT")
+      except BaseException:
+        self._conn.execute("ROLLBACK")
+        raise
+
+  # 领取一个待翻译或租约已过期的单元。options 必须与单元的一致（语言、接口等影响译文的选项），
+  # job 不为 None 时只领取这本书的单元。重新领取租约过期的单元时，上一个持有者的这次尝试计入次数
+  def claim(self, options: str, worker: str, job: Optional[str] = None) -> Optional["WorkUnit"]:
+    query = (
+      "SELECT job, href, path, source, status, attempts FROM units "
+      "WHERE options = ? AND (status = 'pending' OR (status = 'claimed' AND lease_until < ?))"
+    )
+    with self._lock:
+      self._conn.execute("BEGIN IMMEDIATE")
+      try:
+        while True:
+          now = time.time()
+          if job is None:
+            row = self._conn.execute(f"{query} ORDER BY job, position LIMIT 1", (options, now)).fetchone()
+          else:
+            row = self._conn.execute(f"{query} AND job = ? ORDER BY position LIMIT 1", (options, now, job)).fetchone()
+          if row is None:
+            unit = None
+            break
+
+          unit_job, href, path, source, status, attempts = row
+          if status == "claimed":
+            attempts += 1
+          if attempts >= self._max_attempts:
+            self._conn.execute(
+              "UPDATE units SET status = 'failed', attempts = ?, error = COALESCE(error, 'lease expired') WHERE job = ? AND href = ?",
+              (attempts, unit_job, href),
+            )
+            continue
+
+          self._conn.execute(
+            "UPDATE units SET status = 'claimed', worker = ?, lease_until = ?, attempts = ? WHERE job = ? AND href = ?",
+            (worker, now + self._lease_seconds, attempts, unit_job, href),
+          )
+          unit = WorkUnit(unit_job, href, path, source, worker)
+          break
+        self._conn.execute("COMMIT")
+      except BaseException:
+        self._conn.execute("ROLLBACK")
+        raise
+    return unit
+
+  # 延长租约，单元已被其他进程接手或已完成时返回 False
+  def renew(self, unit: "WorkUnit") -> bool:
+    with self._lock:
+      cursor = self._conn.execute(
+        "UPDATE units SET lease_until = ? WHERE job = ? AND href = ? AND status = 'claimed' AND worker = ?",
+        (time.time() + self._lease_seconds, unit.job, unit.href, unit.worker),
+      )
+      return cursor.rowcount > 0
+
+  # 在后台线程中每隔 interval 秒（默认为租约的 1/3）续租，直到离开 with 块。
+  # 翻译时间长于租约的章节不会因此被其他进程重新领取，也不计入尝试次数
+  @contextlib.contextmanager
+  def heartbeat(self, unit: "WorkUnit", interval: Optional[float] = None) -> Iterator[None]:
+    if interval is None:
+      interval = self._lease_seconds / 3
+    stopped = threading.Event()
+
+    def renew_until_stopped():
+      while not stopped.wait(interval):
+        try:
+          if not self.renew(unit):
+            print(f"Lease of queued spine lost: {unit.href}")
+            return
+        except sqlite3.Error as e:
+          # 例如数据库暂时被锁，下一次再续
+          print(f"Renew lease of queued spine failed: {unit.href}: {e}")
+
+    thread = threading.Thread(target=renew_until_stopped, name=f"heartbeat-{unit.href}", daemon=True)
+    thread.start()
+    try:
+      yield
+    finally:
+      stopped.set()
+      thread.join()
+
+  # 写回译文。租约过期后同一单元可能被两个进程翻译，先写回的为准
+  def complete(self, unit: "WorkUnit", target: str):
+    with self._lock:
+      self._conn.execute(
+        "UPDATE units SET status = 'done', target = ?, lease_until = NULL, error = NULL WHERE job = ? AND href = ? AND status != 'done'",
+        (target, unit.job, unit.href),
+      )
+
+  # 交还翻译失败的单元，计入一次尝试。单元已被其他进程接手时忽略
+  def fail(self, unit: "WorkUnit", error: str):
+    with self._lock:
+      self._conn.execute(
+        "UPDATE units SET status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END, attempts = attempts + 1, "
+        "lease_until = NULL, error = ? WHERE job = ? AND href = ? AND status = 'claimed' AND worker = ?",
+        (self._max_attempts, error, unit.job, unit.href, unit.worker),
+      )
+
+  # 各状态（pending、claimed、done、failed）的单元数
+  def progress(self, job: str) -> dict[str, int]:
+    with self._lock:
+      rows = self._conn.execute("SELECT status, COUNT(*) FROM units WHERE job = ? GROUP BY status", (job,)).fetchall()
+    return dict(rows)
+
+  def errors(self, job: str) -> dict[str, str]:
+    with self._lock:
+      rows = self._conn.execute("SELECT href, error FROM units WHERE job = ? AND status = 'failed'", (job,)).fetchall()
+    return dict(rows)
+
+  # { 章节路径: 译文 }
+  def results(self, job: str) -> dict[str, str]:
+    with self._lock:
+      rows = self._conn.execute("SELECT path, target FROM units WHERE job = ? AND status = 'done'", (job,)).fetchall()
+    return dict(rows)
+
+  def remove(self, job: str):
+    with self._lock:
+      self._conn.execute("DELETE FROM units WHERE job = ?", (job,))
+
+  def close(self):
+    with self._lock:
+      self._conn.close()
+
+class WorkUnit:
+  def __init__(self, job: str, href: str, path: str, source: str, worker: str):
+    self.job: str = job
+    self.href: str = href
+    self.path: str = path
+    self.source: str = source
+    self.worker: str = worker
+
+# 一本书的标识：文件内容与影响译文的选项的哈希。相同的书与选项重新运行时沿用队列中已完成的单元
+def queue_job(file_path: str, options: str) -> str:
+  hash = hashlib.sha256()
+  with open(file_path, "rb") as file:
+    for chunk in iter(lambda: file.read(1024 * 1024), b""):
+      hash.update(chunk)
+  hash.update(options.encode("utf-8"))
+  return hash.hexdigest()
+
+# 影响译文的选项，工作进程只领取选项与自己一致的单元
+def queue_options(options: dict) -> str:
+  return json.dumps(options, sort_keys=True, ensure_ascii=False)
+
+def queue_worker_name() -> str:
+  return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+# run ``python graphs/translate/blocks/code-0/logic/work_queue.py``
+class _Test(unittest.TestCase):
+
+  def setUp(self):
+    self._folder_path = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self._folder_path)
+
+  def test_claim(self):
+    queue = self._open_queue()
+    try:
+      self.assertIsNone(queue.claim("options", "w1"))
+      queue.enqueue("job", "options", [("a.xhtml", "OEBPS/a.xhtml", "<a/>"), ("b.xhtml", "OEBPS/b.xhtml", "<b/>")])
+      self.assertIsNone(queue.claim("other options", "w1"))
+      self.assertIsNone(queue.claim("options", "w1", job="other job"))
+
+      unit1 = queue.claim("options", "w1")
+      unit2 = queue.claim("options", "w2", job="job")
+      self.assertEqual((unit1.href, unit1.path, unit1.source), ("a.xhtml", "OEBPS/a.xhtml", "<a/>"))
+      self.assertEqual(unit2.href, "b.xhtml")
+      self.assertIsNone(queue.claim("options", "w3"))
+      self.assertEqual(queue.progress("job"), { "claimed": 2 })
+
+      queue.complete(unit1, "<A/>")
+      queue.complete(unit2, "<B/>")
+      self.assertEqual(queue.progress("job"), { "done": 2 })
+      self.assertEqual(queue.results("job"), { "OEBPS/a.xhtml": "<A/>", "OEBPS/b.xhtml": "<B/>" })
+
+      # 重新运行时已完成的单元保持原状
+      queue.enqueue("job", "options", [("a.xhtml", "OEBPS/a.xhtml", "<a/>")])
+      self.assertIsNone(queue.claim("options", "w1"))
+    finally:
+      queue.close()
+
+  # 续租的单元在翻译时间超过租约时也不会被重新领取，不计入尝试次数
+  def test_heartbeat(self):
+    queue = self._open_queue(lease_seconds=0.2, max_attempts=1)
+    try:
+      queue.enqueue("job", "options", [("a.xhtml", "OEBPS/a.xhtml", "<a/>")])
+      unit = queue.claim("options", "w1")
+      with queue.heartbeat(unit, interval=0.05):
+        time.sleep(0.6)
+        self.assertIsNone(queue.claim("options", "w2"))
+      self.assertEqual(queue.progress("job"), { "claimed": 1 })
+      queue.complete(unit, "<A/>")
+      self.assertEqual(queue.progress("job"), { "done": 1 })
+    finally:
+      queue.close()
+
+  # 持有者失联、租约过期后单元被其他进程接手；过期达到 max_attempts 次后标记为失败
+  def test_expiry(self):
+    queue = self._open_queue(lease_seconds=0.1, max_attempts=2)
+    try:
+      queue.enqueue("job", "options", [("a.xhtml", "OEBPS/a.xhtml", "<a/>")])
+      unit1 = queue.claim("options", "w1")
+      self.assertIsNone(queue.claim("options", "w2"))
+      time.sleep(0.15)
+
+      unit2 = queue.claim("options", "w2")
+      self.assertEqual(unit2.href, "a.xhtml")
+      self.assertFalse(queue.renew(unit1))
+      self.assertTrue(queue.renew(unit2))
+      # 失去租约的进程交还单元时被忽略
+      queue.fail(unit1, "late failure")
+      self.assertEqual(queue.progress("job"), { "claimed": 1 })
+
+      time.sleep(0.15)
+      self.assertIsNone(queue.claim("options", "w3"))
+      self.assertEqual(queue.progress("job"), { "failed": 1 })
+      self.assertEqual(queue.errors("job"), { "a.xhtml": "lease expired" })
+    finally:
+      queue.close()
+
+  def test_fail(self):
+    queue = self._open_queue(max_attempts=2)
+    try:
+      queue.enqueue("job", "options", [("a.xhtml", "OEBPS/a.xhtml", "<a/>")])
+      unit = queue.claim("options", "w1")
+      queue.fail(unit, "first failure")
+      self.assertEqual(queue.progress("job"), { "pending": 1 })
+
+      unit = queue.claim("options", "w2")
+      self.assertEqual(unit.worker, "w2")
+      queue.fail(unit, "second failure")
+      self.assertEqual(queue.progress("job"), { "failed": 1 })
+      self.assertEqual(queue.errors("job"), { "a.xhtml": "second failure" })
+      self.assertIsNone(queue.claim("options", "w3"))
+
+      # 重新运行时失败的单元重新开始
+      queue.enqueue("job", "options", [("a.xhtml", "OEBPS/a.xhtml", "<a/>")])
+      self.assertEqual(queue.progress("job"), { "pending": 1 })
+      self.assertIsNotNone(queue.claim("options", "w1"))
+    finally:
+      queue.close()
+
+  def _open_queue(self, lease_seconds: float = 600.0, max_attempts: int = 3) -> WorkQueue:
+    return WorkQueue(
+      path=os.path.join(self._folder_path, "queue.db"),
+      lease_seconds=lease_seconds,
+      max_attempts=max_attempts,
+    )
+
+if __name__ == "__main__":
+  unittest.main()